@@ -0,0 +1,96 @@
+"""
+Benchmark du rendu des tickets
+Compare le rendu avec et sans cache d'encodage (ENCODING_CACHE_SIZE) des
+chaînes répétées: en-têtes, séparateurs, noms de produits, options.
+Aucune imprimante ni Supabase requis: les tickets sont rendus en mémoire.
+
+Utilisation: python bench_tickets.py [nombre_de_tickets]
+"""
+
+import sys
+import time
+
+try:
+    from printer_agent import (
+        CodepageProfile,
+        Config,
+        TicketBuffer,
+        TicketGenerator,
+    )
+except ImportError as e:
+    print(f"❌ Erreur import: {e}")
+    print("Assurez-vous que printer_agent.py est dans le même dossier")
+    sys.exit(1)
+
+
+BENCH_ORDER = {
+    "id": 999,
+    "order_number": "BENCH-001",
+    "customer_name": "Client Test",
+    "customer_phone": "06 12 34 56 78",
+    "payment_status": "paid",
+    "items": [
+        {"name": "Ramen Tonkotsu", "quantity": 2, "price": 13.50,
+         "options": ["Extra chashu", "Œuf mariné"], "comment": "Bien chaud SVP"},
+        {"name": "Gyoza", "quantity": 1, "price": 6.00, "options": [], "comment": None},
+        {"name": "Thé vert", "quantity": 2, "price": 2.50, "options": ["Sans sucre"], "comment": None},
+    ],
+}
+
+
+def render(profile: CodepageProfile) -> bytes:
+    """Rend le ticket caisse + le ticket cuisine d'une commande"""
+    buffer = TicketBuffer(profile)
+    TicketGenerator.print_cashier_ticket(buffer, BENCH_ORDER, profile)
+    TicketGenerator.print_kitchen_ticket(buffer, BENCH_ORDER, profile)
+    return buffer.getvalue()
+
+
+def bench(profile: CodepageProfile, count: int) -> float:
+    """Rend `count` commandes et retourne la durée moyenne (µs)"""
+    start = time.perf_counter()
+    for _ in range(count):
+        render(profile)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = 7
+
+    print("=" * 60)
+    print("  BENCHMARK RENDU TICKETS - MITAKE")
+    print("=" * 60)
+
+    # Même page de code, cache désactivé (ENCODING_CACHE_SIZE=0) ou non
+    profiles = {
+        "Sans cache d'encodage": CodepageProfile(Config.PRINTER_CODEPAGE, cache_size=0),
+        "Avec cache d'encodage": CodepageProfile(Config.PRINTER_CODEPAGE),
+    }
+
+    # Les deux rendus doivent envoyer exactement les mêmes octets
+    payloads = {label: render(profile) for label, profile in profiles.items()}
+    if len(set(payloads.values())) != 1:
+        sizes = ", ".join(f"{label}: {len(payload)} octets" for label, payload in payloads.items())
+        print(f"❌ Rendus différents ({sizes})")
+        sys.exit(1)
+    print(f"\n✅ Rendus identiques ({len(payloads[next(iter(payloads))])} octets par commande)")
+
+    # Tours alternés, meilleur tour retenu: le bruit de la machine (fréquence,
+    # autres processus) pèse autant sur les deux modes
+    print(f"⏱️  {rounds} tours de {count} commandes (ticket caisse + ticket cuisine)\n")
+    timings = {label: [] for label in profiles}
+    for _ in range(rounds):
+        for label, profile in profiles.items():
+            timings[label].append(bench(profile, count))
+    best = {label: min(durations) for label, durations in timings.items()}
+    for label, duration in best.items():
+        print(f"   {label:<28} {duration:8.1f} µs/commande")
+
+    without_cache, with_cache = best.values()
+    print(f"\n🚀 Accélération: x{without_cache / with_cache:.2f}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Tickets de référence (golden): rendu, taille et longueur de papier
+Rend un corpus fixe de commandes représentatives (petite, énorme, longs
+commentaires, nombreuses options...) et compare chaque ticket à la référence
+enregistrée dans golden_tickets.json: octets exacts, taille, lignes, avance
+papier (mm) et durée de rendu. Toute régression au-delà de la tolérance fait
+échouer le script (code de retour 1), avec l'aperçu des lignes modifiées.
+Aucune imprimante ni Supabase requis: les tickets sont rendus en mémoire.
+
+Utilisation:
+    python golden_tickets.py                      # compare à la référence
+    python golden_tickets.py --update             # après un changement de mise en page voulu
+    python golden_tickets.py --time-tolerance 50 --size-tolerance 2
+    python golden_tickets.py --no-timing          # machine chargée (CI): octets et papier seulement
+"""
+
+import argparse
+import base64
+import difflib
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+try:
+    import printer_agent
+    from printer_agent import (
+        CodepageProfile,
+        Config,
+        EscposPreview,
+        PrintTimeEstimator,
+        TicketBuffer,
+        TicketGenerator,
+    )
+except ImportError as e:
+    print(f"❌ Erreur import: {e}")
+    print("Assurez-vous que printer_agent.py est dans le même dossier")
+    sys.exit(1)
+
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_tickets.json")
+
+# Paramètres figés: la référence ne doit pas dépendre du .env de la machine
+RENDER_SETTINGS = {
+    "codepage": "cp858",
+    "paper_width": Config.PAPER_WIDTH,
+    "qr_url": "https://mitake.fr/suivi/{order_number}",
+    "qr_size": 6,
+    "frozen_at": "2024-01-15T12:30:00",
+}
+FROZEN_AT = datetime.fromisoformat(RENDER_SETTINGS["frozen_at"])
+
+
+class FrozenDatetime(datetime):
+    """datetime.now() fixe: la date et l'heure imprimées ne changent pas les octets"""
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.combine(FROZEN_AT.date(), FROZEN_AT.time(), tzinfo=tz)
+
+
+def item(name, quantity=1, price=10.0, options=None, comment=None) -> dict:
+    return {"name": name, "quantity": quantity, "price": price, "options": options or [], "comment": comment}
+
+
+CORPUS = {
+    "petite": {
+        "id": 1, "order_number": "G-001", "customer_name": "Léa", "payment_status": "paid",
+        "items": [item("Ramen Shoyu", 1, 11.50)],
+    },
+    "standard": {
+        "id": 2, "order_number": "G-002", "customer_name": "Client Test",
+        "customer_phone": "06 12 34 56 78", "payment_status": "paid",
+        "items": [
+            item("Ramen Tonkotsu", 2, 13.50, ["Extra chashu", "Œuf mariné"], "Bien chaud SVP"),
+            item("Gyoza", 1, 6.00),
+            item("Thé vert", 2, 2.50, ["Sans sucre"]),
+        ],
+    },
+    "non_payee": {
+        "id": 3, "order_number": "G-003", "customer_name": "Anonyme", "payment_status": "pending",
+        "items": [item("Karaage", 3, 7.50), item("Edamame", 1, 4.50)],
+    },
+    "enorme": {
+        "id": 4, "order_number": "G-004", "customer_name": "Séminaire Société Générale",
+        "customer_phone": "01 23 45 67 89", "payment_status": "paid",
+        "items": [item(f"Plateau {n:02d}", 1 + n % 4, 9.0 + n % 7, ["Épicé"] if n % 3 == 0 else [])
+                  for n in range(1, 61)],
+    },
+    "longs_commentaires": {
+        "id": 5, "order_number": "G-005", "customer_name": "Jean-Baptiste de la Fontaine-Müller",
+        "payment_status": "paid",
+        "items": [
+            item("Ramen Miso", 1, 12.50, comment="Allergie sévère aux arachides et aux fruits à coque: "
+                 "merci de changer de planche et de gants, le client a son auto-injecteur avec lui"),
+            item("Poke bowl saumon avocat mangue edamame sésame grillé", 2, 14.90,
+                 comment="Sauce à part, pas de coriandre, riz bien froid, servir en dernier "
+                         "après les entrées chaudes de la table"),
+        ],
+    },
+    "nombreuses_options": {
+        "id": 6, "order_number": "G-006", "customer_name": "Zoé", "payment_status": "paid",
+        "items": [
+            item("Ramen à composer", 1, 15.00, ["Bouillon tonkotsu", "Nouilles fermes", "Extra chashu",
+                                                 "Œuf mariné", "Maïs", "Pousses de bambou", "Nori x3",
+                                                 "Sans oignons", "Huile pimentée", "Ail noir",
+                                                 "Gingembre rouge", "Sésame"]),
+            item("Gyoza", 2, 6.00, ["Poulet", "Sauce ponzu", "Grillés", "Vapeur"]),
+        ],
+    },
+}
+
+STATIONS = {
+    "cashier": TicketGenerator.print_cashier_ticket,
+    "kitchen": TicketGenerator.print_kitchen_ticket,
+}
+
+
+def configure():
+    """Applique RENDER_SETTINGS et fige l'heure du module printer_agent"""
+    Config.PRINTER_CODEPAGE = RENDER_SETTINGS["codepage"]
+    Config.TICKET_QR_URL = RENDER_SETTINGS["qr_url"]
+    Config.TICKET_QR_SIZE = RENDER_SETTINGS["qr_size"]
+    Config.LOGO_PATH = ""
+    printer_agent.datetime = FrozenDatetime
+
+
+def render(station: str, order: dict, profile: CodepageProfile) -> bytes:
+    buffer = TicketBuffer(profile)
+    STATIONS[station](buffer, order, profile)
+    return buffer.getvalue()
+
+
+def measure(repeat: int, timing: bool, rounds: int = 7) -> dict:
+    """Rend chaque ticket du corpus; durée = meilleure moyenne sur `rounds`
+    séries de `repeat` rendus (µs), comme timeit: le minimum est bien moins
+    sensible que la médiane aux autres processus de la machine"""
+    profile = CodepageProfile.get(RENDER_SETTINGS["codepage"])
+    results = {}
+    for name, order in CORPUS.items():
+        for station in STATIONS:
+            payload = render(station, order, profile)  # échauffement (cache d'encodage)
+            durations = []
+            for _ in range(rounds if timing else 0):
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    render(station, order, profile)
+                durations.append((time.perf_counter() - started) / repeat * 1e6)
+            stats = PrintTimeEstimator.analyze(payload, RENDER_SETTINGS["paper_width"])
+            results[f"{name}/{station}"] = {
+                "bytes": len(payload),
+                "lines": stats["lines"],
+                "mm": round(stats["mm"], 1),
+                "render_us": round(min(durations), 1) if durations else None,
+                "sha256": hashlib.sha256(payload).hexdigest(),
+                "payload": base64.b64encode(payload).decode("ascii"),
+            }
+    return results
+
+
+def preview_diff(golden: dict, current: dict) -> list:
+    """Lignes modifiées entre les aperçus texte des deux versions d'un ticket"""
+    before = EscposPreview.text(base64.b64decode(golden["payload"]), RENDER_SETTINGS["paper_width"])
+    after = EscposPreview.text(base64.b64decode(current["payload"]), RENDER_SETTINGS["paper_width"])
+    return [line for line in difflib.unified_diff(before.splitlines(), after.splitlines(),
+                                                  "référence", "actuel", n=1, lineterm="")]
+
+
+def compare(golden: dict, current: dict, args) -> list:
+    """Returns: liste des régressions (ticket, message)"""
+    regressions = []
+    
+    def fail(key: str, message: str):
+        regressions.append((key, message))
+        print(f"❌ {key}: {message}")
+    
+    for key in golden:
+        if key not in current:
+            fail(key, "ticket absent du corpus actuel")
+    for key, now in current.items():
+        ref = golden.get(key)
+        if ref is None:
+            fail(key, "nouveau ticket sans référence (lancer --update)")
+            continue
+        problems = []
+        for metric in ("bytes", "lines", "mm"):
+            limit = ref[metric] * (1 + args.size_tolerance / 100)
+            if now[metric] > limit:
+                problems.append(f"{metric} {ref[metric]:g} -> {now[metric]:g} "
+                                f"(+{(now[metric] / max(ref[metric], 1) - 1) * 100:.1f}%)")
+        if args.timing and ref.get("render_us") and now["render_us"] is not None:
+            limit = ref["render_us"] * (1 + args.time_tolerance / 100)
+            # Marge absolue: quelques µs de bruit ne comptent pas sur les petits tickets
+            if now["render_us"] > limit and now["render_us"] - ref["render_us"] > args.time_slack:
+                problems.append(f"rendu {ref['render_us']:g} -> {now['render_us']:g} µs "
+                                f"(+{(now['render_us'] / ref['render_us'] - 1) * 100:.0f}%)")
+        if now["sha256"] != ref["sha256"]:
+            problems.append("octets différents de la référence")
+        if problems:
+            fail(key, ", ".join(problems))
+            if now["sha256"] != ref["sha256"]:
+                for line in preview_diff(ref, now)[2:args.diff_lines + 2]:
+                    print(f"      {line}")
+    return regressions
+
+
+def print_table(golden: dict, current: dict):
+    print(f"   {'Ticket':<30} {'Octets':>8} {'Lignes':>7} {'mm':>7} {'Rendu µs':>9} {'Réf. µs':>8}")
+    for key, now in current.items():
+        ref = golden.get(key, {})
+        timing = f"{now['render_us']:9.1f}" if now["render_us"] is not None else f"{'-':>9}"
+        reference = f"{ref['render_us']:8.1f}" if ref.get("render_us") else f"{'-':>8}"
+        mark = "" if not ref or ref["sha256"] == now["sha256"] else "  ≠"
+        print(f"   {key:<30} {now['bytes']:>8} {now['lines']:>7} {now['mm']:>7.1f} {timing} {reference}{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tickets de référence: rendu, taille et longueur de papier")
+    parser.add_argument("--update", action="store_true", help="réécrit la référence avec le rendu actuel")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="fichier de référence (défaut: golden_tickets.json)")
+    parser.add_argument("--repeat", type=int, default=50, help="rendus par série de mesure (défaut: 50)")
+    parser.add_argument("--size-tolerance", type=float, default=0,
+                        help="hausse tolérée des octets/lignes/mm en %% (défaut: 0)")
+    parser.add_argument("--time-tolerance", type=float, default=30,
+                        help="hausse tolérée de la durée de rendu en %% (défaut: 30)")
+    parser.add_argument("--time-slack", type=float, default=5, help="marge absolue de durée en µs (défaut: 5)")
+    parser.add_argument("--no-timing", dest="timing", action="store_false",
+                        help="ne compare pas les durées de rendu")
+    parser.add_argument("--diff-lines", type=int, default=20, help="lignes d'aperçu affichées par ticket modifié")
+    args = parser.parse_args()
+
+    configure()
+    print("=" * 60)
+    print("  TICKETS DE RÉFÉRENCE - MITAKE")
+    print("=" * 60)
+    print(f"\n🧾 {len(CORPUS)} commandes x {len(STATIONS)} tickets, page de code {RENDER_SETTINGS['codepage']}\n")
+
+    current = measure(max(args.repeat, 1), args.timing or args.update)
+    golden = {}
+    if os.path.exists(args.golden):
+        with open(args.golden, encoding="utf-8") as f:
+            reference = json.load(f)
+        if reference.get("settings") != RENDER_SETTINGS and not args.update:
+            print("❌ Paramètres de rendu différents de ceux de la référence: relancer avec --update")
+            return 2
+        golden = reference.get("tickets", {})
+
+    print_table(golden, current)
+    total_us = sum(t["render_us"] or 0 for t in current.values())
+    if total_us:
+        print(f"\n⏱️  {total_us / len(CORPUS):.1f} µs par commande (caisse + cuisine), "
+              f"{len(CORPUS) * 1e6 / total_us:.0f} commandes/s sur ce corpus")
+
+    if args.update:
+        with open(args.golden, "w", encoding="utf-8") as f:
+            json.dump({"settings": RENDER_SETTINGS, "tickets": current}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\n📝 Référence mise à jour: {args.golden}")
+        print("=" * 60)
+        return 0
+    if not golden:
+        print(f"\n❌ Aucune référence ({args.golden}): lancer d'abord avec --update")
+        return 2
+
+    print()
+    regressions = compare(golden, current, args)
+    improved = [key for key, now in current.items() if key in golden
+                and now["bytes"] < golden[key]["bytes"]]
+    if improved:
+        print(f"📉 Tickets plus courts que la référence: {', '.join(improved)}")
+    print("=" * 60)
+    if regressions:
+        print(f"❌ {len(regressions)} ticket(s) en régression")
+        print("Si le changement est voulu: python golden_tickets.py --update")
+        return 1
+    print("✅ Aucun écart avec la référence")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
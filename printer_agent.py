@@ -12,10 +12,28 @@ import os
 import sys
 import time
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional
 import json
 import random
+import abc
+import base64
+import collections
+import functools
+import hashlib
+import itertools
+import multiprocessing
+import queue
+import socket
+import sqlite3
+import tempfile
+import threading
+import unicodedata
+import zlib
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from dotenv import load_dotenv
 
 # ============================================================================
@@ -64,14 +82,35 @@ except Exception:
     def create_client(*_, **__):
         raise RuntimeError("Supabase non installé. Exécute: pip install -r requirements.txt")
     # Pas d'import supplémentaire non gardé (fix: suppression import en double)
+# Session HTTP partagée (httpx est une dépendance de supabase)
 try:
-    from escpos.printer import Usb, Network, Win32Raw  # type: ignore
-    from escpos.exceptions import Error as EscposError  # type: ignore
+    import httpx  # type: ignore
+    try:
+        from supabase import ClientOptions  # type: ignore
+    except ImportError:
+        from supabase.lib.client_options import ClientOptions  # type: ignore
 except Exception:
-    # En mode mock ou si librairie absente, on continue
-    Usb = Network = Win32Raw = object  # sentinelles
-    class EscposError(Exception):
-        pass
+    httpx = None
+    ClientOptions = None
+# python-escpos (USB, spouleur Windows): importé à la première connexion qui en a
+# besoin (arbre d'import lourd: PIL, qrcode...). Les imprimantes réseau passent
+# par RawNetworkPrinter (socket TCP directe) sauf PRINTER_NETWORK_TRANSPORT=escpos.
+Usb = Network = Win32Raw = None
+class EscposError(Exception):
+    pass
+
+def load_escpos() -> bool:
+    """Importe python-escpos à la demande; False si la librairie est absente"""
+    global Usb, Network, Win32Raw, EscposError
+    if Usb is not None:
+        return True
+    try:
+        from escpos.printer import Usb, Network, Win32Raw  # type: ignore
+        from escpos.exceptions import Error as EscposError  # type: ignore
+        return True
+    except Exception as e:
+        logger.error(f"❌ python-escpos indisponible ({e}): pip install python-escpos")
+        return False
 
 # ============================================================================
 # CONFIGURATION
@@ -87,7 +126,26 @@ class Config:
     # Table et colonnes Supabase
     TABLE_NAME = "orders"
     STATUS_PENDING = "pending_print"
+    STATUS_PRINTING = "printing"
     STATUS_PRINTED = "printed"
+    STATUS_CANCELLED = os.getenv("STATUS_CANCELLED", "cancelled")
+    
+    # Session HTTP Supabase: délais stricts (secondes), pool keep-alive, compression
+    SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+    SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", "10"))
+    SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "4"))
+    SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "120"))
+    SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "false").lower() in ("1", "true", "yes")  # paquet h2 requis
+    SUPABASE_COMPRESSION = os.getenv("SUPABASE_COMPRESSION", "true").lower() in ("1", "true", "yes")
+    
+    # Plusieurs agents sur la même table: réservation atomique des commandes
+    # (colonnes claimed_by et lease_expires_at requises, voir README)
+    CLAIM_ORDERS = os.getenv("CLAIM_ORDERS", "false").lower() in ("1", "true", "yes")
+    AGENT_ID = os.getenv("AGENT_ID", f"{socket.gethostname()}-{os.getpid()}")
+    CLAIM_LEASE_SECONDS = int(os.getenv("CLAIM_LEASE_SECONDS", "120"))
+    # Relecture complète des commandes en attente (commandes rendues après un
+    # échec, par cet agent ou un autre, plus anciennes que la dernière lue)
+    PENDING_RESCAN_SECONDS = float(os.getenv("PENDING_RESCAN_SECONDS", "30"))
     
     # Configuration des imprimantes
     # IMPORTANT: Pour trouver les Vendor ID et Product ID sur Windows:
@@ -107,6 +165,26 @@ class Config:
     # DÉTECTION OS WINDOWS
     IS_WINDOWS = (os.name == 'nt')
 
+    # Priorité d'impression: avance (secondes) accordée aux commandes payées en
+    # ligne et par type de commande; une commande avec heure de retrait passe à
+    # l'échéance (retrait - temps de préparation)
+    PRIORITY_PAID_BOOST = float(os.getenv("PRIORITY_PAID_BOOST", "120"))
+    PRIORITY_ORDER_TYPES = {
+        kind.strip(): float(boost)
+        for kind, _, boost in (entry.partition(":") for entry in
+                               os.getenv("PRIORITY_ORDER_TYPES", "delivery:60,takeaway:30").split(","))
+        if kind.strip() and boost.strip()
+    }
+    PRIORITY_PICKUP_LEAD = float(os.getenv("PRIORITY_PICKUP_LEAD", "900"))
+
+    # Page de code par défaut des imprimantes (CP858 = CP850 + €)
+    PRINTER_CODEPAGE = os.getenv("PRINTER_CODEPAGE", "cp858").lower()
+    # Nombre de chaînes répétées encodées gardées en cache (en-têtes, produits, options)
+    ENCODING_CACHE_SIZE = int(os.getenv("ENCODING_CACHE_SIZE", "2048"))
+    # Vitesse d'impression par défaut (mm/s) et durée d'une coupe, pour l'estimation
+    PRINT_SPEED = float(os.getenv("PRINT_SPEED", "200"))
+    PRINT_CUT_SECONDS = float(os.getenv("PRINT_CUT_SECONDS", "0.5"))
+
     # Imprimante CAISSE (Ticket client avec prix)
     PRINTER_CASHIER = {
         # Sur Windows, on force le type 'windows' sauf si on est en mode mock
@@ -118,6 +196,8 @@ class Config:
         "product_id": int(os.getenv("PRINTER_CASHIER_PID", "0x0e28"), 16) if os.getenv("PRINTER_CASHIER_PID") else 0x0e28,
         "ip": os.getenv("PRINTER_CASHIER_IP", "192.168.1.100"),
         "port": int(os.getenv("PRINTER_CASHIER_PORT", "9100")),
+        "codepage": os.getenv("PRINTER_CASHIER_CODEPAGE", PRINTER_CODEPAGE),
+        "speed": float(os.getenv("PRINTER_CASHIER_SPEED", PRINT_SPEED)),  # mm/s
     }
     
     # Imprimante CUISINE (Ticket cuisine sans prix)
@@ -129,7 +209,56 @@ class Config:
         "product_id": int(os.getenv("PRINTER_KITCHEN_PID", "0x0e29"), 16) if os.getenv("PRINTER_KITCHEN_PID") else 0x0e29,
         "ip": os.getenv("PRINTER_KITCHEN_IP", "192.168.1.101"),
         "port": int(os.getenv("PRINTER_KITCHEN_PORT", "9100")),
+        "codepage": os.getenv("PRINTER_KITCHEN_CODEPAGE", PRINTER_CODEPAGE),
+        "speed": float(os.getenv("PRINTER_KITCHEN_SPEED", PRINT_SPEED)),  # mm/s
+    }
+    
+    # Imprimante CUISINE DE SECOURS (optionnelle: activée si un nom ou une IP est renseigné)
+    PRINTER_KITCHEN_BACKUP = {
+        "type": "windows" if IS_WINDOWS else os.getenv("PRINTER_KITCHEN_BACKUP_TYPE", "network"),
+        "name": os.getenv("PRINTER_KITCHEN_BACKUP_NAME", "EPSON TM-T20IV Receipt (2)"),
+        "vendor_id": int(os.getenv("PRINTER_KITCHEN_BACKUP_VID", "0x04b8"), 16) if os.getenv("PRINTER_KITCHEN_BACKUP_VID") else 0x04b8,
+        "product_id": int(os.getenv("PRINTER_KITCHEN_BACKUP_PID", "0x0e29"), 16) if os.getenv("PRINTER_KITCHEN_BACKUP_PID") else 0x0e29,
+        "ip": os.getenv("PRINTER_KITCHEN_BACKUP_IP", ""),
+        "port": int(os.getenv("PRINTER_KITCHEN_BACKUP_PORT", "9100")),
+        "codepage": os.getenv("PRINTER_KITCHEN_BACKUP_CODEPAGE", PRINTER_CODEPAGE),
+        "speed": float(os.getenv("PRINTER_KITCHEN_BACKUP_SPEED", PRINT_SPEED)),  # mm/s
+    }
+    KITCHEN_BACKUP_ENABLED = bool(os.getenv("PRINTER_KITCHEN_BACKUP_NAME") or os.getenv("PRINTER_KITCHEN_BACKUP_IP"))
+    
+    # Basculement: postes essayés dans l'ordre quand l'imprimante d'un poste échoue
+    # Postes disponibles: cashier, kitchen, kitchen_backup
+    FAILOVER = {
+        "cashier": [st.strip() for st in os.getenv("PRINTER_CASHIER_FAILOVER", "").split(",") if st.strip()],
+        "kitchen": [st.strip() for st in os.getenv("PRINTER_KITCHEN_FAILOVER", "kitchen_backup,cashier").split(",") if st.strip()],
+        "kitchen_backup": [st.strip() for st in os.getenv("PRINTER_KITCHEN_BACKUP_FAILOVER", "kitchen,cashier").split(",") if st.strip()],
     }
+    # Répartition des tickets cuisine entre kitchen et kitchen_backup (imprimantes
+    # identiques) selon la fin d'impression estimée, au lieu d'un simple secours
+    KITCHEN_LOAD_BALANCE = os.getenv("PRINTER_KITCHEN_BALANCE", "false").lower() in ("1", "true", "yes")
+    # Libellé du bandeau imprimé sur un ticket redirigé ("COPIE CUISINE")
+    STATION_LABELS = {"cashier": "CAISSE", "kitchen": "CUISINE", "kitchen_backup": "CUISINE"}
+    # Après un échec, une imprimante n'a droit qu'à une tentative pendant ce délai
+    PRINTER_DOWN_RECHECK = int(os.getenv("PRINTER_DOWN_RECHECK", "60"))  # secondes
+    # Délais maximum (secondes): connexion, écriture réseau/USB, et job complet
+    # (au-delà, le chien de garde abandonne le job et réinitialise la connexion)
+    PRINTER_CONNECT_TIMEOUT = float(os.getenv("PRINTER_CONNECT_TIMEOUT", "5"))
+    PRINTER_WRITE_TIMEOUT = float(os.getenv("PRINTER_WRITE_TIMEOUT", "10"))
+    # 0 = automatique: durée de toutes les tentatives (RETRY_ATTEMPTS x (connexion
+    # + écriture) + pauses RETRY_DELAY) plus PRINT_JOB_MARGIN
+    PRINT_JOB_TIMEOUT = float(os.getenv("PRINT_JOB_TIMEOUT", "0"))
+    PRINT_JOB_MARGIN = float(os.getenv("PRINT_JOB_MARGIN", "15"))
+    # Imprimantes réseau: "raw" (socket TCP directe, sans python-escpos) ou "escpos"
+    PRINTER_NETWORK_TRANSPORT = os.getenv("PRINTER_NETWORK_TRANSPORT", "raw").lower()
+    WATCHDOG_INTERVAL = 1.0
+    # Files bornées: au-delà de PRINT_QUEUE_MAX tickets en attente sur une imprimante,
+    # la lecture des nouvelles commandes Supabase est suspendue (contre-pression);
+    # caisse locale, réimpressions et basculements ne sont jamais refusés
+    PRINT_QUEUE_MAX = int(os.getenv("PRINT_QUEUE_MAX", "20"))
+    # Tickets envoyés au plus par job / session (une écriture par ticket)
+    PRINT_BATCH_MAX = max(1, int(os.getenv("PRINT_BATCH_MAX", "5")))
+    # Alerte de surcharge: attente d'un nouveau ticket au-delà de ce seuil (secondes)
+    BACKLOG_WARN_SECONDS = float(os.getenv("BACKLOG_WARN_SECONDS", "120"))
     
     # Paramètres généraux
     RETRY_ATTEMPTS = 3
@@ -138,6 +267,62 @@ class Config:
     
     # Caractères pour la mise en page
     PAPER_WIDTH = 48  # Nombre de caractères (80mm ≈ 48 chars)
+    
+    # Logo du ticket caisse (PNG/JPG), converti une fois en raster ESC/POS
+    LOGO_PATH = os.getenv("LOGO_PATH", "")
+    LOGO_MAX_WIDTH = int(os.getenv("LOGO_MAX_WIDTH", "384"))  # points (80mm = 576)
+    CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(APP_DIR, "cache"))
+    # QR code du ticket caisse (commande GS ( k native), ex: https://mitake.fr/c/{order_number}
+    TICKET_QR_URL = os.getenv("TICKET_QR_URL", "")
+    TICKET_QR_SIZE = int(os.getenv("TICKET_QR_SIZE", "6"))  # taille d'un module (1-16)
+    
+    # Réimpression: derniers tickets rendus gardés par imprimante (copie disque optionnelle)
+    REPRINT_BUFFER_SIZE = int(os.getenv("REPRINT_BUFFER_SIZE", "50"))
+    REPRINT_DIR = os.getenv("REPRINT_DIR", "")  # vide = mémoire uniquement
+    # Archive SQLite des tickets imprimés (vide = désactivée) et durée de conservation
+    ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", os.path.join(APP_DIR, "archive.db"))
+    ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "90"))
+    # API d'administration locale (réimpression, files, pause): 0 = désactivée
+    ADMIN_HOST = os.getenv("ADMIN_HOST", "127.0.0.1")
+    ADMIN_PORT = int(os.getenv("ADMIN_PORT", "0"))
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # en-tête X-Admin-Token exigé si renseigné
+    
+    # Réception locale des commandes (caisse sur le réseau local): 0 = désactivée
+    # Hors boucle locale (ex: 0.0.0.0 pour la caisse sur le réseau), INGEST_TOKEN est obligatoire
+    INGEST_HOST = os.getenv("INGEST_HOST", "127.0.0.1")
+    INGEST_PORT = int(os.getenv("INGEST_PORT", "0"))
+    INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+    INGEST_OUTBOX = os.getenv("INGEST_OUTBOX", os.path.join(APP_DIR, "outbox.db"))
+    INGEST_SYNC_INTERVAL = float(os.getenv("INGEST_SYNC_INTERVAL", "10"))  # secondes
+    # Colonnes envoyées à Supabase pour une commande reçue en local
+    INGEST_SYNC_COLUMNS = ("order_number", "customer_name", "customer_phone", "payment_status",
+                           "items", "order_type", "pickup_time", "created_at")
+    
+    # Diagnostic (python printer_agent.py diagnose): délai maximum de chaque sonde
+    DIAG_TIMEOUT = float(os.getenv("DIAG_TIMEOUT", "2"))  # secondes
+    
+    # Tickets modificatifs: commandes imprimées puis modifiées ou annulées (colonne
+    # de date de mise à jour requise, voir README); version imprimée gardée dans l'archive
+    ORDER_UPDATES = os.getenv("ORDER_UPDATES", "false").lower() in ("1", "true", "yes")
+    ORDER_UPDATED_COLUMN = os.getenv("ORDER_UPDATED_COLUMN", "updated_at")
+    
+    # Sorties complémentaires aux imprimantes, séparées par des virgules (ex: kds)
+    ORDER_SINKS = [name.strip() for name in os.getenv("ORDER_SINKS", "").split(",") if name.strip()]
+    # Écran cuisine (sortie kds): page et websocket sur ce port
+    # Écran sur un autre poste du réseau: KDS_HOST=0.0.0.0, KDS_TOKEN alors obligatoire
+    KDS_HOST = os.getenv("KDS_HOST", "127.0.0.1")
+    KDS_PORT = int(os.getenv("KDS_PORT", "8766"))
+    KDS_TOKEN = os.getenv("KDS_TOKEN", "")  # ?token=... exigé si renseigné
+    KDS_BACKLOG = int(os.getenv("KDS_BACKLOG", "30"))  # commandes renvoyées à un écran qui se connecte
+    KDS_SEND_TIMEOUT = 2.0  # secondes: un écran plus lent est déconnecté
+    
+    # Enregistrement des commandes reçues (JSONL horodaté) pour rejeu: vide = désactivé
+    ORDER_RECORD_PATH = os.getenv("ORDER_RECORD_PATH", "")
+    
+    # Mode RUSH: regroupe les tickets cuisine arrivés dans une même fenêtre
+    RUSH_MODE = os.getenv("RUSH_MODE", "false").lower() in ("1", "true", "yes")
+    RUSH_WINDOW = float(os.getenv("RUSH_WINDOW", "45"))  # secondes
+    RUSH_MAX_ORDERS = int(os.getenv("RUSH_MAX_ORDERS", "8"))  # flush anticipé
 
 
 # ============================================================================
@@ -200,6 +385,10 @@ class MockPrinter:
                 line = ' ' * pad + line
         return line[:self.width]
 
+    def qr(self, content: str, size: int = 3, **kwargs):
+        # Pas de rendu graphique en mode mock: on affiche le contenu
+        self.text(f"[QR: {content}]\n")
+
     def cut(self):
         # Formater et afficher le ticket
         if not self.buffer:
@@ -229,6 +418,30 @@ class MockPrinter:
         pass
 
 
+class FakePrinter:
+    """Imprimante factice (type "fake"): accepte les octets ESC/POS et simule
+    la durée d'impression estimée (PrintTimeEstimator), sans rien afficher.
+    Utile pour les tests de charge (rejeu, endurance).
+    """
+
+    def __init__(self, name: str, speed: float = Config.PRINT_SPEED):
+        self.name = name
+        self.speed = speed
+        self.jobs = 0
+        self.bytes = 0
+
+    def _raw(self, msg: bytes):
+        time.sleep(PrintTimeEstimator.seconds(msg, self.speed))
+        self.jobs += 1
+        self.bytes += len(msg)
+
+    def open(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
 # ============================================================================
 # LOGGING
 # ============================================================================
@@ -279,6 +492,363 @@ if WINDOWS_PRINTING:
 logger.info("=" * 70)
 
 
+# ============================================================================
+# PAGE DE CODE IMPRIMANTE (ENCODAGE)
+# ============================================================================
+
+class CodepageProfile:
+    """Page de code explicite d'une imprimante avec cache d'encodage borné.
+
+    Le texte est encodé directement en octets, sans passer par la recherche
+    d'encodage de python-escpos. Les chaînes qui reviennent d'une commande à
+    l'autre (en-têtes, séparateurs, noms de produits, options) passent par le
+    cache LRU (encode_static); les lignes propres à une commande (numéro,
+    heure, client, total, commentaires) ne servent qu'une fois et ne feraient
+    qu'évincer les entrées utiles.
+    """
+
+    # nom -> (n de la commande ESC t n Epson, codec Python)
+    TABLES = {
+        "cp437": (0, "cp437"),
+        "cp850": (2, "cp850"),
+        "cp858": (19, "cp858"),
+        "cp1252": (16, "cp1252"),
+    }
+
+    # Remplacements pour les glyphes absents de la page de code
+    FALLBACKS = {
+        "€": "EUR",
+        "✓": "v",
+        "✔": "v",
+        "Œ": "OE",
+        "œ": "oe",
+        "’": "'",
+        "‘": "'",
+        "“": '"',
+        "”": '"',
+        "…": "...",
+        "–": "-",
+        "—": "-",
+        "\u00a0": " ",
+    }
+
+    _profiles: Dict[str, "CodepageProfile"] = {}
+
+    def __init__(self, name: str, cache_size: int = Config.ENCODING_CACHE_SIZE):
+        name = (name or Config.PRINTER_CODEPAGE).lower()
+        if name not in self.TABLES:
+            logger.warning(f"⚠️ Page de code inconnue '{name}', utilisation de cp858")
+            name = "cp858"
+        self.name = name
+        self.number, self.codec = self.TABLES[name]
+        # ESC t n: sélection de la page de code côté imprimante
+        self.select_command = b"\x1bt" + bytes([self.number])
+        # ENCODING_CACHE_SIZE=0: cache désactivé, encodage direct
+        self.encode_static = functools.lru_cache(maxsize=cache_size)(self.encode) if cache_size > 0 else self.encode
+
+    @classmethod
+    def get(cls, name: Optional[str] = None) -> "CodepageProfile":
+        """Retourne le profil partagé (et donc son cache) pour une page de code"""
+        key = (name or Config.PRINTER_CODEPAGE).lower()
+        if key not in cls._profiles:
+            cls._profiles[key] = cls(key)
+        return cls._profiles[key]
+
+    def encode(self, text: str) -> bytes:
+        """Encode un texte, caractère par caractère seulement si nécessaire"""
+        try:
+            return text.encode(self.codec)
+        except UnicodeEncodeError:
+            pass
+        out = bytearray()
+        for char in text:
+            try:
+                out += char.encode(self.codec)
+            except UnicodeEncodeError:
+                out += self._fallback(char).encode(self.codec, errors="replace")
+        return bytes(out)
+
+    def _fallback(self, char: str) -> str:
+        """Remplacement d'un glyphe absent (table puis décomposition Unicode)"""
+        if char in self.FALLBACKS:
+            return self.FALLBACKS[char]
+        # Ex: "ō" -> "o" ; sinon '?'
+        stripped = unicodedata.normalize("NFKD", char).encode("ascii", "ignore").decode("ascii")
+        return stripped or "?"
+
+
+# ============================================================================
+# RENDU ESC/POS EN MÉMOIRE
+# ============================================================================
+
+class TicketBuffer:
+    """Imprimante ESC/POS en mémoire: accumule les octets d'un ticket.
+
+    Expose le même sous-ensemble d'API que python-escpos (set/text/cut/_raw).
+    Comme python-escpos 3.1, set() ne change que les paramètres passés; le
+    style courant est suivi pour n'émettre que les commandes qui le modifient
+    (None = état inconnu de l'imprimante: la commande est toujours émise).
+    """
+
+    ALIGN = {"left": 0, "center": 1, "right": 2}
+
+    def __init__(self, profile: Optional[CodepageProfile] = None):
+        self.profile = profile or CodepageProfile.get()
+        self.data = bytearray()
+        self.style: Dict[str, object] = {"align": None, "bold": None, "size": None, "invert": None}
+
+    def _raw(self, msg: bytes):
+        self.data += msg
+
+    def text(self, data: str):
+        self.data += self.profile.encode(data)
+
+    def set(self, align=None, bold=None, width=None, height=None, invert=None, **kwargs):
+        """Alignement (ESC a), gras (ESC E), taille (GS !) et inversion (GS B)"""
+        if align is not None:
+            self._style("align", align, b"\x1ba" + bytes([self.ALIGN.get(align, 0)]))
+        if bold is not None:
+            self._style("bold", bool(bold), b"\x1bE" + (b"\x01" if bold else b"\x00"))
+        if width is not None or height is not None:
+            current_width, current_height = self.style["size"] or (1, 1)
+            width = max(1, min(8, int(current_width if width is None else width)))
+            height = max(1, min(8, int(current_height if height is None else height)))
+            self._style("size", (width, height), b"\x1d!" + bytes([((width - 1) << 4) | (height - 1)]))
+        if invert is not None:
+            self._style("invert", bool(invert), b"\x1dB" + (b"\x01" if invert else b"\x00"))
+    
+    def _style(self, key: str, value, command: bytes):
+        if self.style[key] != value:
+            self.style[key] = value
+            self.data += command
+
+    def qr(self, content: str, size: int = 3, ec: str = "M", **kwargs):
+        """QR code natif de l'imprimante (GS ( k, modèle 2), sans image raster"""
+        data = content.encode("utf-8")
+        size = max(1, min(16, int(size)))
+        ec_level = {"L": 48, "M": 49, "Q": 50, "H": 51}.get(ec.upper(), 49)
+        store_len = len(data) + 3
+        self.data += b"\x1d(k\x04\x00\x31\x41\x32\x00"           # modèle 2
+        self.data += b"\x1d(k\x03\x00\x31\x43" + bytes([size])      # taille module
+        self.data += b"\x1d(k\x03\x00\x31\x45" + bytes([ec_level])  # correction
+        self.data += b"\x1d(k" + bytes([store_len % 256, store_len // 256]) + b"\x31\x50\x30" + data
+        self.data += b"\x1d(k\x03\x00\x31\x51\x30"                 # impression
+        self.data += b"\n"
+
+    def cut(self, mode: str = "FULL", feed: bool = True):
+        """Avance de 6 lignes (ESC d) puis coupe (GS V)"""
+        if feed:
+            self.data += b"\x1bd\x06"
+        self.data += b"\x1dV" + (b"\x01" if mode.upper() == "PART" else b"\x00")
+
+    def close(self):
+        pass
+
+    def getvalue(self) -> bytes:
+        return bytes(self.data)
+
+
+class RasterLogo:
+    """Logo converti une seule fois en image raster ESC/POS (GS v 0).
+
+    Le résultat est mis en cache sur disque, indexé par l'empreinte SHA-256
+    du fichier image et la largeur cible: PIL n'est utilisé qu'au premier
+    démarrage après un changement de logo.
+    """
+
+    _blobs: Dict[str, bytes] = {}
+
+    @classmethod
+    def get(cls, path: str = None, max_width: int = None) -> bytes:
+        """Retourne la commande raster du logo (b"" si aucun logo ou erreur)"""
+        path = Config.LOGO_PATH if path is None else path
+        max_width = max_width or Config.LOGO_MAX_WIDTH
+        if not path:
+            return b""
+        key = f"{path}:{max_width}"
+        if key not in cls._blobs:
+            cls._blobs[key] = cls._load(path, max_width)
+        return cls._blobs[key]
+
+    @classmethod
+    def _load(cls, path: str, max_width: int) -> bytes:
+        try:
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        except OSError as e:
+            logger.warning(f"⚠️ Logo introuvable ({path}): {e}")
+            return b""
+        cache_file = os.path.join(Config.CACHE_DIR, f"logo_{digest}_{max_width}.bin")
+        if os.path.exists(cache_file):
+            with open(cache_file, "rb") as f:
+                return f.read()
+        try:
+            blob = cls.convert(path, max_width)
+        except Exception as e:
+            logger.warning(f"⚠️ Conversion du logo impossible: {e}")
+            return b""
+        try:
+            os.makedirs(Config.CACHE_DIR, exist_ok=True)
+            with open(cache_file, "wb") as f:
+                f.write(blob)
+            logger.info(f"🖼️ Logo converti et mis en cache: {cache_file} ({len(blob)} octets)")
+        except OSError as e:
+            logger.warning(f"⚠️ Impossible d'écrire le cache du logo: {e}")
+        return blob
+
+    @staticmethod
+    def convert(path: str, max_width: int) -> bytes:
+        """Image -> GS v 0 (1 bit par point, tramage Floyd-Steinberg)"""
+        from PIL import Image, ImageOps  # type: ignore
+
+        image = Image.open(path)
+        if image.mode in ("RGBA", "LA", "P"):
+            # Transparence -> fond blanc
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+        image = image.convert("L")
+        if image.width > max_width:
+            height = max(1, round(image.height * max_width / image.width))
+            image = image.resize((max_width, height))
+        # Bit à 1 = point noir: on inverse avant de passer en 1 bit
+        image = ImageOps.invert(image).convert("1")
+        width_bytes = (image.width + 7) // 8
+        return (
+            b"\x1dv0\x00"
+            + bytes([width_bytes % 256, width_bytes // 256, image.height % 256, image.height // 256])
+            + image.tobytes()
+        )
+
+
+# ============================================================================
+# ESTIMATION DE LA DURÉE D'IMPRESSION
+# ============================================================================
+
+class PrintTimeEstimator:
+    """Estime l'avance papier d'un ticket rendu (ESC/POS) et sa durée d'impression.
+
+    Parcourt les octets: chaque saut de ligne compte selon la hauteur de
+    caractère en cours (GS !), les lignes trop longues sont repliées, et les
+    avances (ESC d / ESC J), images raster (GS v 0), QR codes et coupes sont
+    pris en compte. Valeurs pour une tête 203 dpi (8 points/mm).
+    """
+
+    DOTS_PER_MM = 8
+    LINE_DOTS = 24      # hauteur d'un caractère (police A)
+    SPACING_DOTS = 6    # interligne par défaut
+    QR_MODULES = 33     # QR version ~4 pour une URL courte
+
+    @classmethod
+    def analyze(cls, payload: bytes, width: int = Config.PAPER_WIDTH) -> Dict:
+        """Retourne {"lines", "dots", "mm", "cuts"} pour un ticket rendu"""
+        dots = lines = cuts = 0
+        char_width = char_height = 1
+        column = 0
+        qr_size = 3
+        i, n = 0, len(payload)
+        while i < n:
+            byte = payload[i]
+            if byte == 0x0A:  # LF
+                dots += cls.LINE_DOTS * char_height + cls.SPACING_DOTS
+                lines += 1
+                column = 0
+                i += 1
+            elif byte == 0x1B and i + 1 < n:  # ESC
+                cmd = payload[i + 1]
+                if cmd == ord('d') and i + 2 < n:
+                    dots += payload[i + 2] * (cls.LINE_DOTS + cls.SPACING_DOTS)
+                    lines += payload[i + 2]
+                elif cmd == ord('J') and i + 2 < n:
+                    dots += payload[i + 2]
+                i += 2 if cmd == ord('@') else 3
+            elif byte == 0x1D and i + 1 < n:  # GS
+                cmd = payload[i + 1]
+                if cmd == ord('!') and i + 2 < n:
+                    char_width = (payload[i + 2] >> 4) + 1
+                    char_height = (payload[i + 2] & 0x0F) + 1
+                    i += 3
+                elif cmd == ord('V') and i + 2 < n:
+                    cuts += 1
+                    i += 4 if payload[i + 2] in (65, 66) else 3
+                elif cmd == ord('v') and i + 7 < n:
+                    width_bytes = payload[i + 4] + payload[i + 5] * 256
+                    height = payload[i + 6] + payload[i + 7] * 256
+                    dots += height
+                    i += 8 + width_bytes * height
+                elif cmd == ord('(') and i + 6 < n and payload[i + 2] == ord('k'):
+                    length = payload[i + 3] + payload[i + 4] * 256
+                    function = payload[i + 6]
+                    if function == 0x43:  # taille de module
+                        qr_size = payload[i + 7]
+                    elif function == 0x51:  # impression du symbole
+                        dots += cls.QR_MODULES * qr_size
+                    i += 5 + length
+                else:
+                    i += 3
+            else:
+                if byte >= 0x20:
+                    column += char_width
+                    if column > width:  # repli automatique de la ligne
+                        dots += cls.LINE_DOTS * char_height + cls.SPACING_DOTS
+                        lines += 1
+                        column = char_width
+                i += 1
+        return {"lines": lines, "dots": dots, "mm": dots / cls.DOTS_PER_MM, "cuts": cuts}
+
+    @classmethod
+    def seconds(cls, payload: bytes, speed_mm_s: float) -> float:
+        """Durée estimée d'impression (avance papier à `speed_mm_s` + coupes)"""
+        stats = cls.analyze(payload)
+        return stats["mm"] / max(speed_mm_s, 1.0) + stats["cuts"] * Config.PRINT_CUT_SECONDS
+
+
+# ============================================================================
+# TRANSPORT RÉSEAU DIRECT (PORT 9100)
+# ============================================================================
+
+class RawNetworkPrinter:
+    """
+    Transport réseau minimal: les octets ESC/POS déjà rendus (TicketBuffer)
+    partent tels quels sur une socket TCP, sans python-escpos.
+    Même interface que les imprimantes python-escpos pour PrinterManager:
+    open(), _raw(data), close() et la socket dans `device`.
+    """
+    
+    def __init__(self, host: str, port: int = 9100, timeout: float = Config.PRINTER_CONNECT_TIMEOUT,
+                 write_timeout: float = Config.PRINTER_WRITE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.device: Optional[socket.socket] = None
+    
+    def open(self):
+        """Connexion (délai `timeout`), puis délai d'écriture `write_timeout`"""
+        device = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        # Ticket envoyé en une écriture: pas d'attente de Nagle sur le dernier segment
+        device.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        device.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        device.settimeout(self.write_timeout)
+        self.device = device
+    
+    def _raw(self, data: bytes):
+        if self.device is None:
+            self.open()
+        self.device.sendall(data)
+    
+    def close(self):
+        """Ferme la socket (débloque aussi un sendall en cours dans un autre thread)"""
+        device, self.device = self.device, None
+        if device is None:
+            return
+        try:
+            device.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        device.close()
+
+
 # ============================================================================
 # GESTIONNAIRE D'IMPRIMANTES
 # ============================================================================
@@ -286,11 +856,19 @@ logger.info("=" * 70)
 class PrinterManager:
     """Gère la connexion et l'impression sur les imprimantes ESC/POS"""
     
+    # Types d'imprimante: type → fonction de connexion (voir register)
+    CONNECTORS: Dict[str, Callable[["PrinterManager"], bool]] = {}
+    
     def __init__(self, config: Dict):
         self.config = config
         self.printer = None
         self.printer_type = config.get("type", "network")
-        
+        self.codepage = CodepageProfile.get(config.get("codepage"))
+        self.failed_at: Optional[float] = None  # dernier échec (toutes tentatives épuisées)
+        self.epoch = 0  # incrémenté à chaque réinitialisation par le chien de garde
+        self.speed = float(config.get("speed", Config.PRINT_SPEED))  # mm/s
+        self.reconnect_requested = False  # cf. request_reconnect
+
     def _scan_usb_devices(self):
         """Analyse les périphériques USB disponibles (Epson: VID 0x04b8)"""
         try:
@@ -311,16 +889,13 @@ class PrinterManager:
             self.printer = MockPrinter(self.config.get('name', 'MockPrinter'))
             logger.info(f"🧪 [MOCK] Imprimante simulée prête: {self.config.get('name', 'MockPrinter')}")
             return True
+        connector = self.CONNECTORS.get(self.printer_type)
+        if connector is None:
+            logger.error(f"❌ Type d'imprimante non supporté: {self.printer_type} "
+                         f"(types connus: {', '.join(sorted(self.CONNECTORS))})")
+            return False
         try:
-            if self.printer_type == "usb":
-                return self._connect_usb()
-            elif self.printer_type == "network":
-                return self._connect_network()
-            elif self.printer_type == "windows" and WINDOWS_PRINTING:
-                return self._connect_windows()
-            else:
-                logger.error(f"❌ Type d'imprimante non supporté: {self.printer_type}")
-                return False
+            return connector(self)
         except EscposError as e:
             logger.error(f"❌ Erreur connexion imprimante {self.config['name']}: {e}")
             return False
@@ -328,6 +903,25 @@ class PrinterManager:
             logger.error(f"❌ Erreur inattendue connexion: {e}")
             return False
     
+    @classmethod
+    def register(cls, printer_type: str):
+        """
+        Enregistre un type d'imprimante (clé "type" de la configuration):
+            @PrinterManager.register("serial")
+            def _connect_serial(manager) -> bool: ...
+        La fonction reçoit le PrinterManager, renseigne manager.printer et
+        retourne True si la connexion est établie.
+        """
+        def decorator(connector: Callable[["PrinterManager"], bool]):
+            cls.CONNECTORS[printer_type] = connector
+            return connector
+        return decorator
+    
+    def _connect_fake(self) -> bool:
+        """Imprimante factice (rejeu, tests d'endurance): durée d'impression simulée"""
+        self.printer = FakePrinter(self.config.get('name', 'FakePrinter'), self.speed)
+        return True
+    
     def _connect_usb(self) -> bool:
         """Connexion USB avec détection d'erreurs détaillée"""
         try:
@@ -340,7 +934,10 @@ class PrinterManager:
             if isinstance(product_id, str):
                 product_id = int(product_id, 16) if product_id.startswith("0x") else int(product_id, 16)
             
-            self.printer = Usb(vendor_id, product_id)
+            if not load_escpos():
+                return False
+            # Délai d'écriture pyusb en millisecondes
+            self.printer = Usb(vendor_id, product_id, timeout=int(Config.PRINTER_WRITE_TIMEOUT * 1000))
             logger.info(f"✅ Connecté à l'imprimante USB {self.config['name']} (VID: 0x{vendor_id:04x}, PID: 0x{product_id:04x})")
             return True
         except EscposError as e:
@@ -369,10 +966,16 @@ class PrinterManager:
                 return False
             
             logger.info(f"📡 Tentative de connexion: {ip}:{port}")
-            self.printer = Network(ip, port=port)
+            if Config.PRINTER_NETWORK_TRANSPORT == "escpos" and load_escpos():
+                self.printer = Network(ip, port=port, timeout=Config.PRINTER_CONNECT_TIMEOUT)
+            else:
+                self.printer = RawNetworkPrinter(ip, port=port, timeout=Config.PRINTER_CONNECT_TIMEOUT)
+            self.printer.open()
+            # Connexion établie: délai d'écriture (une imprimante figée ne bloque plus sendall)
+            self.printer.device.settimeout(Config.PRINTER_WRITE_TIMEOUT)
             logger.info(f"✅ Connecté à l'imprimante réseau {self.config['name']} ({ip}:{port})")
             return True
-        except EscposError as e:
+        except (EscposError, OSError) as e:
             logger.error(f"❌ Réseau: Impossible de joindre {ip}:{port}")
             logger.error(f"   Erreur: {e}")
             logger.error(f"   💡 Solutions:")
@@ -398,6 +1001,8 @@ class PrinterManager:
                 logger.error(f"   Ajouter: PRINTER_CASHIER_NAME=NOM_IMPRIMANTE")
                 return False
             
+            if not load_escpos():
+                return False
             self.printer = Win32Raw(printer_name)
             logger.info(f"✅ Connecté à l'imprimante Windows {printer_name}")
             return True
@@ -422,6 +1027,71 @@ class PrinterManager:
         except Exception as e:
             logger.warning(f"⚠️ Erreur déconnexion: {e}")
     
+    def reset(self):
+        """
+        Abandonne la connexion en cours (appelé par le chien de garde)
+        La socket est fermée pour débloquer l'écriture en attente; la prochaine
+        impression se reconnecte.
+        """
+        printer, self.printer = self.printer, None
+        self.epoch += 1
+        self.failed_at = time.time()
+        if printer is None or Config.PRINTER_MODE == 'mock':
+            return
+        try:
+            printer.close()
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur réinitialisation {self.config.get('name')}: {e}")
+    
+    def request_reconnect(self):
+        """
+        Demande une nouvelle connexion avant la prochaine impression
+        Appliquée par le thread d'impression (jamais pendant une écriture en cours),
+        contrairement à disconnect() appelé depuis un autre thread.
+        """
+        self.reconnect_requested = True
+    
+    def _apply_reconnect(self):
+        if self.reconnect_requested:
+            self.reconnect_requested = False
+            self.disconnect()
+            self.printer = None
+    
+    def _drop(self, printer):
+        """Ferme la connexion après une erreur, sauf si elle a déjà été remplacée"""
+        if printer is not None and printer is self.printer:
+            self.disconnect()
+    
+    def is_down(self) -> bool:
+        """True si l'imprimante a échoué récemment (toutes tentatives épuisées)"""
+        return self.failed_at is not None and time.time() - self.failed_at < Config.PRINTER_DOWN_RECHECK
+    
+    def health_check(self) -> bool:
+        """
+        Vérifie rapidement que l'imprimante peut imprimer
+        Windows: état du spouleur (hors ligne, erreur, plus de papier).
+        Autres: état du dernier envoi.
+        """
+        if Config.PRINTER_MODE == 'mock':
+            return True
+        if self.printer_type == "windows" and WINDOWS_PRINTING:
+            try:
+                handle = win32print.OpenPrinter(self.config.get("name"))
+                try:
+                    info = win32print.GetPrinter(handle, 2)
+                finally:
+                    win32print.ClosePrinter(handle)
+                blocking = (win32print.PRINTER_STATUS_OFFLINE
+                            | win32print.PRINTER_STATUS_ERROR
+                            | win32print.PRINTER_STATUS_PAPER_OUT)
+                if info["Status"] & blocking or info["Attributes"] & win32print.PRINTER_ATTRIBUTE_WORK_OFFLINE:
+                    logger.warning(f"⚠️ Imprimante {self.config['name']} indisponible (statut spouleur 0x{info['Status']:x})")
+                    return False
+            except Exception as e:
+                logger.warning(f"⚠️ État spouleur illisible pour {self.config.get('name')}: {e}")
+                return False
+        return not self.is_down()
+    
     def print_raw(self, commands: callable, retry: int = Config.RETRY_ATTEMPTS) -> bool:
         """
         Exécute les commandes d'impression avec gestion des erreurs
@@ -432,6 +1102,7 @@ class PrinterManager:
         """
         if Config.PRINTER_MODE == 'mock':
             try:
+                self._apply_reconnect()
                 if not self.printer:
                     self.connect()
                 commands(self.printer)
@@ -440,160 +1111,1130 @@ class PrinterManager:
             except Exception as e:
                 logger.error(f"❌ [MOCK] Erreur simulation impression: {e}")
                 return False
-        # Mode réel
+        # Mode réel: rendu complet en mémoire, puis une seule écriture
+        try:
+            payload = self.render(commands)
+        except Exception as e:
+            logger.error(f"❌ Erreur rendu ticket pour {self.config['name']}: {e}")
+            return False
+        return self.print_payload(payload, retry=retry)
+    
+    def render(self, commands: callable) -> bytes:
+        """Rend les commandes d'impression en octets ESC/POS (sans imprimer)"""
+        buffer = TicketBuffer(self.codepage)
+        commands(buffer)
+        return buffer.getvalue()
+    
+    def print_payload(self, payload: bytes, retry: int = Config.RETRY_ATTEMPTS,
+                      job_name: str = "mitake") -> bool:
+        """
+        Envoie des octets déjà rendus en une seule session
+        Sur Windows, un seul document spouleur (StartDoc/EndDoc) par appel.
+        Args:
+            payload: Ticket ESC/POS rendu
+            retry: Nombre de tentatives
+            job_name: Nom du document dans le spouleur Windows
+        Returns: True si impression réussie
+        """
+        return self.send_tickets([payload], retry=retry, job_name=job_name) == 1
+    
+    def send_tickets(self, payloads: List[bytes], retry: int = Config.RETRY_ATTEMPTS,
+                     job_name: str = "mitake", on_sent: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Envoie plusieurs tickets rendus dans une même session, une écriture par ticket
+        Sur Windows, un seul document spouleur par tentative. Après une erreur,
+        seuls les tickets pas encore envoyés sont renvoyés.
+        Args:
+            payloads: Tickets ESC/POS rendus, dans l'ordre d'impression
+            retry: Nombre de tentatives (pour l'ensemble des tickets)
+            job_name: Nom du document dans le spouleur Windows
+            on_sent: Appelé avec l'index de chaque ticket dès qu'il est envoyé
+                     (Windows: à la fermeture du document)
+        Returns: Nombre de tickets envoyés (les premiers de `payloads`)
+        """
+        if self.is_down():
+            # Imprimante en échec récent: une seule tentative avant basculement
+            retry = 1
+        self._apply_reconnect()
+        epoch = self.epoch
+        sent = 0
+        
+        def confirm(count: int):
+            nonlocal sent
+            for idx in range(sent, count):
+                sent = idx + 1
+                if on_sent:
+                    on_sent(idx)
+        
         for attempt in range(retry):
+            if self.epoch != epoch:
+                # Job abandonné par le chien de garde: ne pas réessayer en parallèle
+                return sent
+            printer = None
             try:
                 if not self.printer and not self.connect():
                     raise Exception("Impossible de se connecter à l'imprimante")
-                commands(self.printer)
+                printer = self.printer
+                if self.printer_type == "windows":
+                    printer.open(job_name=job_name)
+                    written, error = sent, None
+                    try:
+                        for payload in payloads[sent:]:
+                            printer._raw(payload)
+                            written += 1
+                    except Exception as e:
+                        error = e
+                    # Fin du document: les tickets déjà écrits partent au spouleur
+                    printer.close()
+                    confirm(written)
+                    if error:
+                        raise error
+                else:
+                    for payload in payloads[sent:]:
+                        printer._raw(payload)
+                        confirm(sent + 1)
                 logger.info(f"✅ Impression réussie sur {self.config['name']}")
-                return True
+                self.failed_at = None
+                return sent
             except EscposError as e:
                 logger.error(f"❌ Erreur impression (tentative {attempt+1}/{retry}): {e}")
-                self.disconnect()
+                self._drop(printer)
                 if attempt < retry - 1:
                     time.sleep(Config.RETRY_DELAY)
             except Exception as e:
                 logger.error(f"❌ Erreur inattendue (tentative {attempt+1}/{retry}): {e}")
-                self.disconnect()
+                self._drop(printer)
                 if attempt < retry - 1:
                     time.sleep(Config.RETRY_DELAY)
-        return False
+        self.failed_at = time.time()
+        return sent
+    
+    def print_jobs(self, jobs: List["PrintJob"],
+                   on_printed: Optional[Callable[["PrintJob"], None]] = None) -> List[bool]:
+        """
+        Imprime plusieurs tickets en un seul job / une seule session
+        Chaque ticket est rendu séparément (une erreur de rendu n'affecte que
+        son ticket) puis écrit séparément: une erreur ne renvoie que les
+        tickets non envoyés.
+        Args:
+            on_printed: Appelé pour chaque ticket dès qu'il est envoyé
+        Returns: Succès de chaque ticket, dans l'ordre de `jobs`
+        """
+        if Config.PRINTER_MODE == 'mock':
+            results = []
+            for job in jobs:
+                results.append(self.print_raw(job.commands))
+                if results[-1] and on_printed:
+                    on_printed(job)
+            return results
+        results = [False] * len(jobs)
+        rendered = []
+        for idx, job in enumerate(jobs):
+            try:
+                rendered.append((idx, job.render_for(self)))
+            except Exception as e:
+                logger.error(f"❌ Erreur rendu ticket {job.label} pour {self.config['name']}: {e}")
+        if not rendered:
+            return results
+        if len(rendered) > 1:
+            logger.info(f"📦 {len(rendered)} tickets regroupés en un seul job sur {self.config['name']}")
+        
+        def sent(position: int):
+            idx = rendered[position][0]
+            results[idx] = True
+            if on_printed:
+                on_printed(jobs[idx])
+        
+        self.send_tickets([data for _, data in rendered], on_sent=sent,
+                          job_name=f"mitake ({len(rendered)} tickets)")
+        return results
+
+
+# Types d'imprimante intégrés (les autres s'ajoutent avec @PrinterManager.register)
+PrinterManager.CONNECTORS.update({
+    "usb": PrinterManager._connect_usb,
+    "network": PrinterManager._connect_network,
+    "windows": PrinterManager._connect_windows,
+    "fake": PrinterManager._connect_fake,
+})
 
 
 # ============================================================================
-# GÉNÉRATEURS DE TICKETS
+# ARCHIVE DES TICKETS IMPRIMÉS
 # ============================================================================
 
-class TicketGenerator:
-    """Génère le contenu des tickets pour caisse et cuisine"""
+class TicketArchive:
+    """Archive locale SQLite de chaque ticket imprimé (ou définitivement en échec).
+
+    Index sur le numéro de commande, la date et l'imprimante: "la commande X
+    est-elle sortie, quand, sur quelle imprimante ?" sans parcourir les logs.
+    Les octets ESC/POS sont compressés (zlib); les tickets plus anciens que
+    Config.ARCHIVE_RETENTION_DAYS sont purgés au démarrage puis chaque heure.
+    """
     
-    @staticmethod
-    def _center(text: str, width: int = Config.PAPER_WIDTH) -> str:
-        """Centre un texte sur la largeur du ticket"""
-        return text.center(width)
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY,
+            printed_at REAL NOT NULL,
+            station TEXT NOT NULL,
+            printer TEXT NOT NULL,
+            label TEXT,
+            success INTEGER NOT NULL,
+            size INTEGER,
+            payload BLOB
+        );
+        CREATE TABLE IF NOT EXISTS ticket_orders (
+            ticket_id INTEGER NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
+            order_number TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tickets_printed_at ON tickets(printed_at);
+        CREATE INDEX IF NOT EXISTS idx_tickets_printer ON tickets(printer, printed_at);
+        CREATE INDEX IF NOT EXISTS idx_ticket_orders_number ON ticket_orders(order_number);
+        CREATE INDEX IF NOT EXISTS idx_ticket_orders_ticket ON ticket_orders(ticket_id);
+        CREATE TABLE IF NOT EXISTS printed_orders (
+            order_number TEXT PRIMARY KEY,
+            printed_at REAL NOT NULL,
+            cancelled INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_printed_orders_printed_at ON printed_orders(printed_at);
+    """
+    PRUNE_INTERVAL = 3600  # secondes
     
-    @staticmethod
-    def _line(char: str = "-", width: int = Config.PAPER_WIDTH) -> str:
-        """Génère une ligne de séparation"""
-        return char * width
+    def __init__(self, path: str = Config.ARCHIVE_PATH, retention_days: int = Config.ARCHIVE_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(self.SCHEMA)
+        self.pruned_at = 0.0
+        self.prune()
     
-    @staticmethod
-    def _format_price(price: float) -> str:
-        """Formate un prix en euros"""
-        return f"{price:.2f}€"
+    def record(self, job: "PrintJob", station: str, printer: str, success: bool):
+        """Archive un ticket (ne bloque jamais l'impression en cas d'erreur)"""
+        payload = job.payload or b""
+        try:
+            with self.lock, self.db:
+                cursor = self.db.execute(
+                    "INSERT INTO tickets (printed_at, station, printer, label, success, size, payload) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), station, printer, job.label, int(success), len(payload),
+                     zlib.compress(payload, 6) if payload else None)
+                )
+                self.db.executemany(
+                    "INSERT INTO ticket_orders (ticket_id, order_number) VALUES (?, ?)",
+                    [(cursor.lastrowid, str(number)) for number in job.order_numbers if number is not None]
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Archivage du ticket {job.label} impossible: {e}")
+        if time.time() - self.pruned_at > self.PRUNE_INTERVAL:
+            self.prune()
     
-    @staticmethod
-    def print_cashier_ticket(printer, order: Dict):
-        """
-        Génère le ticket CAISSE avec tous les détails et prix
-        Args:
-            printer: Instance de l'imprimante ESC/POS
-            order: Dictionnaire contenant les données de commande
-        """
+    def prune(self) -> int:
+        """Supprime les tickets au-delà de la durée de conservation; retourne leur nombre"""
+        self.pruned_at = time.time()
+        if self.retention_days <= 0:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
         try:
-            # En-tête
-            printer.set(align='center', bold=True, width=2, height=2)
-            printer.text("RESTAURANT MITAKE\n")
-            printer.set(align='center', bold=False)
-            printer.text("Ticket de Caisse\n")
-            printer.text(TicketGenerator._line("=") + "\n")
-            
-            # Informations commande
-            printer.set(align='left', bold=False)
-            printer.text(f"Commande N°: {order.get('order_number', 'N/A')}\n")
-            printer.text(f"Date: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n")
-            printer.text(f"Client: {order.get('customer_name', 'Anonyme')}\n")
-            
-            if order.get('customer_phone'):
-                printer.text(f"Tel: {order['customer_phone']}\n")
-            
-            printer.text(TicketGenerator._line("-") + "\n")
-            
-            # Produits
-            items = order.get('items', [])
-            total = 0.0
-            
-            for item in items:
-                name = item.get('name', 'Produit')
-                quantity = item.get('quantity', 1)
-                price = item.get('price', 0.0)
-                subtotal = quantity * price
-                total += subtotal
-                
-                # Nom du produit et prix
-                printer.set(bold=True)
-                printer.text(f"{quantity}x {name}\n")
-                printer.set(bold=False, align='right')
-                printer.text(f"{TicketGenerator._format_price(subtotal)}\n")
-                printer.set(align='left')
-                
-                # Options/Modifications
-                if item.get('options'):
-                    for option in item['options']:
-                        printer.text(f"  + {option}\n")
-                
-                # Commentaire
-                if item.get('comment'):
-                    printer.text(f"  Note: {item['comment']}\n")
-                
-                printer.text("\n")
-            
-            # Total
-            printer.text(TicketGenerator._line("-") + "\n")
-            printer.set(bold=True, width=2, height=2, align='right')
-            printer.text(f"TOTAL: {TicketGenerator._format_price(total)}\n")
-            printer.set(bold=False, width=1, height=1, align='center')
-            
-            # Statut de paiement
-            printer.text("\n")
-            payment_status = order.get('payment_status', 'pending')
-            if payment_status == 'paid':
-                printer.set(bold=True)
-                printer.text("✓ PAYÉ EN LIGNE\n")
-            else:
-                printer.set(bold=True, invert=True)
-                printer.text("  À PAYER EN CAISSE  \n")
-            
-            printer.set(bold=False, invert=False)
-            printer.text("\n")
-            printer.text(TicketGenerator._line("=") + "\n")
-            printer.text("Merci de votre visite !\n")
-            printer.text(TicketGenerator._line("=") + "\n")
-            
-            # Coupe du papier
-            printer.text("\n\n")
-            printer.cut()
-            
-        except Exception as e:
-            logger.error(f"❌ Erreur génération ticket caisse: {e}")
-            raise
+            with self.lock, self.db:
+                deleted = self.db.execute("DELETE FROM tickets WHERE printed_at < ?", (cutoff,)).rowcount
+                self.db.execute("DELETE FROM printed_orders WHERE printed_at < ?", (cutoff,))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Purge de l'archive impossible: {e}")
+            return 0
+        if deleted:
+            logger.info(f"🧹 Archive: {deleted} ticket(s) de plus de {self.retention_days} jours supprimé(s)")
+        return deleted
     
-    @staticmethod
-    def print_kitchen_ticket(printer, order: Dict):
-        """
-        Génère le ticket CUISINE avec nom en GROS, options, sans prix
+    def _rows(self, where: str, params: tuple, limit: int) -> List[Dict]:
+        query = ("SELECT t.id, t.printed_at, t.station, t.printer, t.label, t.success, t.size, "
+                 "GROUP_CONCAT(o.order_number) FROM tickets t "
+                 "LEFT JOIN ticket_orders o ON o.ticket_id = t.id "
+                 f"WHERE {where} GROUP BY t.id ORDER BY t.printed_at DESC LIMIT ?")
+        with self.lock:
+            rows = self.db.execute(query, params + (limit,)).fetchall()
+        return [{
+            "id": row[0],
+            "printed_at": datetime.fromtimestamp(row[1]).strftime("%d/%m/%Y %H:%M:%S"),
+            "station": row[2], "printer": row[3], "label": row[4],
+            "success": bool(row[5]), "bytes": row[6],
+            "orders": row[7].split(",") if row[7] else [],
+        } for row in rows]
+    
+    def find_order(self, order_number: str, limit: int = 50) -> List[Dict]:
+        """Tickets d'une commande, du plus récent au plus ancien"""
+        return self._rows("t.id IN (SELECT ticket_id FROM ticket_orders WHERE order_number = ?)",
+                          (str(order_number),), limit)
+    
+    def find_between(self, start: datetime, end: datetime, printer: Optional[str] = None,
+                     limit: int = 500) -> List[Dict]:
+        """Tickets imprimés entre deux dates (éventuellement sur une imprimante)"""
+        where, params = "t.printed_at >= ? AND t.printed_at < ?", (start.timestamp(), end.timestamp())
+        if printer:
+            where, params = where + " AND (t.printer = ? OR t.station = ?)", params + (printer, printer)
+        return self._rows(where, params, limit)
+    
+    def remember_order(self, order: Dict, cancelled: bool = False):
+        """Garde la version imprimée d'une commande (base des tickets modificatifs)"""
+        try:
+            with self.lock, self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO printed_orders (order_number, printed_at, cancelled, data) VALUES (?, ?, ?, ?)",
+                    (str(order.get("order_number")), time.time(), int(cancelled),
+                     json.dumps(order, ensure_ascii=False, default=str))
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Version imprimée de #{order.get('order_number')} non enregistrée: {e}")
+    
+    def printed_order(self, order_number) -> Optional[Dict]:
+        """Dernière version imprimée: {"order": ..., "cancelled": bool}; None si inconnue"""
+        with self.lock:
+            row = self.db.execute("SELECT data, cancelled FROM printed_orders WHERE order_number = ?",
+                                  (str(order_number),)).fetchone()
+        return {"order": json.loads(row[0]), "cancelled": bool(row[1])} if row else None
+    
+    def last_updated(self, column: str) -> Optional[str]:
+        """Plus grande date de mise à jour (horloge serveur) parmi les versions imprimées gardées"""
+        try:
+            with self.lock:
+                row = self.db.execute("SELECT MAX(json_extract(data, ?)) FROM printed_orders",
+                                      (f"$.{column}",)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Curseur des modifications illisible dans l'archive: {e}")
+            return None
+        return str(row[0]) if row and row[0] else None
+    
+    def payload(self, ticket_id: int) -> Optional[bytes]:
+        """Octets ESC/POS d'un ticket archivé (décompressés)"""
+        with self.lock:
+            row = self.db.execute("SELECT payload FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+        if not row:
+            return None
+        return zlib.decompress(row[0]) if row[0] else b""
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# ============================================================================
+# FILES D'IMPRESSION
+# ============================================================================
+
+class OrderPriority:
+    """Priorité d'impression d'une commande, exprimée comme une échéance (timestamp).
+
+    Les files impriment d'abord l'échéance la plus proche. Une commande part
+    de son heure de création, avancée de Config.PRIORITY_PAID_BOOST si elle est
+    payée et du bonus de son `order_type`; une commande avec `pickup_time` a
+    pour échéance l'heure de retrait moins le temps de préparation. L'avance
+    étant bornée, une commande ordinaire finit toujours par passer devant les
+    suivantes (vieillissement): elle ne peut pas être affamée.
+    """
+    
+    @staticmethod
+    def _timestamp(value) -> Optional[float]:
+        """Convertit un horodatage Supabase (ISO 8601, UTC si sans fuseau)"""
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    
+    @classmethod
+    def deadline(cls, order: Dict, now: Optional[float] = None) -> float:
+        """Échéance d'impression de la commande (plus petit = plus urgent)"""
+        now = time.time() if now is None else now
+        pickup = cls._timestamp(order.get("pickup_time"))
+        if pickup is not None:
+            deadline = pickup - Config.PRIORITY_PICKUP_LEAD
+        else:
+            created = cls._timestamp(order.get("created_at"))
+            deadline = min(created, now) if created is not None else now
+        if order.get("payment_status") == "paid":
+            deadline -= Config.PRIORITY_PAID_BOOST
+        deadline -= Config.PRIORITY_ORDER_TYPES.get(order.get("order_type"), 0.0)
+        return deadline
+    
+    @classmethod
+    def sort(cls, orders: List[Dict]) -> List[Dict]:
+        """Trie des commandes dans l'ordre où la cuisine en a besoin"""
+        now = time.time()
+        return sorted(orders, key=lambda order: cls.deadline(order, now))
+
+
+class PrintJob:
+    """Ticket en attente d'impression: commandes ESC/POS + callback de fin"""
+    
+    def __init__(self, commands: callable, on_done: Optional[Callable[[bool], None]] = None,
+                 label: str = "", priority: Optional[float] = None,
+                 order_numbers: Optional[List[str]] = None):
+        self.commands = commands
+        self.on_done = on_done
+        self.label = label
+        self.order_numbers = order_numbers or []  # commandes couvertes (archive)
+        self.priority = time.time() if priority is None else priority  # échéance (cf. OrderPriority)
+        self.success = False
+        self.done = threading.Event()
+        self.failover: Optional[List["PrintDispatcher"]] = None  # postes de secours restants
+        self.rerouted = False
+        self.payload: Optional[bytes] = None  # rendu mis en cache (par page de code)
+        self.payload_codepage: Optional[str] = None
+        self.estimate = 0.0  # durée d'impression estimée (secondes)
+        self.queued_at: Optional[float] = None  # première mise en file (time.monotonic)
+    
+    def render_for(self, manager: PrinterManager) -> bytes:
+        """Rend le ticket pour une imprimante (réutilise le rendu si même page de code)"""
+        if self.payload is None or self.payload_codepage != manager.codepage.name:
+            self.payload = manager.render(self.commands)
+            self.payload_codepage = manager.codepage.name
+        return self.payload
+    
+    def add_banner(self, station: str):
+        """Ajoute en tête du ticket le bandeau "COPIE <poste>" (ticket redirigé)"""
+        if self.rerouted:
+            return
+        self.rerouted = True
+        commands = self.commands
+        label = Config.STATION_LABELS.get(station, station.upper())
+        
+        def with_banner(printer):
+            TicketGenerator.print_failover_banner(printer, label)
+            commands(printer)
+        self.commands = with_banner
+        self.payload = None
+    
+    def finish(self, success: bool):
+        """Enregistre le résultat et prévient l'appelant"""
+        self.success = success
+        self.done.set()
+        if self.on_done:
+            try:
+                self.on_done(success)
+            except Exception as e:
+                logger.error(f"❌ Erreur callback fin d'impression {self.label}: {e}")
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Attend la fin de l'impression et retourne son succès"""
+        self.done.wait(timeout)
+        return self.success
+
+
+class ReprintBuffer:
+    """Derniers tickets imprimés sur une imprimante (anneau borné), pour réimpression.
+
+    Les octets ESC/POS déjà rendus sont conservés: une réimpression ne demande
+    ni aller-retour Supabase ni nouveau rendu. Avec un répertoire, chaque ticket
+    est aussi copié sur disque (un fichier JSON par ticket) et rechargé au démarrage.
+    """
+    
+    def __init__(self, station: str, size: int = Config.REPRINT_BUFFER_SIZE,
+                 directory: Optional[str] = None):
+        self.station = station
+        self.entries = collections.deque(maxlen=max(size, 1))
+        self.lock = threading.Lock()
+        self.directory = os.path.join(directory, station) if directory else None
+        last_id = self._load() if self.directory else 0
+        self.sequence = itertools.count(last_id + 1)
+    
+    def _path(self, entry_id: int) -> str:
+        return os.path.join(self.directory, f"{entry_id:08d}.json")
+    
+    def _load(self) -> int:
+        """Recharge les derniers tickets copiés sur disque; retourne le dernier numéro"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+            for name in names[-self.entries.maxlen:]:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    entry = json.load(f)
+                entry["payload"] = base64.b64decode(entry["payload"])
+                self.entries.append(entry)
+        except Exception as e:
+            logger.warning(f"⚠️ Historique de réimpression illisible ({self.directory}): {e}")
+        return self.entries[-1]["id"] if self.entries else 0
+    
+    def add(self, job: "PrintJob"):
+        """Enregistre un ticket imprimé (octets rendus pour cette imprimante)"""
+        if job.payload is None:
+            return
+        entry = {"id": next(self.sequence), "label": job.label, "printed_at": time.time(),
+                 "orders": job.order_numbers, "payload": job.payload, "commands": job.commands}
+        with self.lock:
+            evicted = self.entries[0] if len(self.entries) == self.entries.maxlen else None
+            self.entries.append(entry)
+        if not self.directory:
+            return
+        try:
+            record = {key: entry[key] for key in ("id", "label", "printed_at", "orders")}
+            record["payload"] = base64.b64encode(entry["payload"]).decode("ascii")
+            with open(self._path(entry["id"]), "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            if evicted:
+                os.remove(self._path(evicted["id"]))
+        except OSError as e:
+            logger.warning(f"⚠️ Copie disque du ticket {job.label} impossible: {e}")
+    
+    def get(self, entry_id: int) -> Optional[Dict]:
+        with self.lock:
+            return next((entry for entry in self.entries if entry["id"] == entry_id), None)
+    
+    def list(self) -> List[Dict]:
+        """Tickets disponibles, du plus récent au plus ancien (sans les octets)"""
+        with self.lock:
+            entries = list(self.entries)
+        return [{"id": entry["id"], "label": entry["label"], "bytes": len(entry["payload"]),
+                 "printed_at": datetime.fromtimestamp(entry["printed_at"]).strftime("%d/%m/%Y %H:%M:%S")}
+                for entry in reversed(entries)]
+
+
+class PrintDispatcher:
+    """File d'impression d'une imprimante, vidée par un thread dédié.
+
+    Les tickets en attente sortent par échéance croissante (OrderPriority),
+    à échéance égale dans l'ordre d'arrivée. Quand plusieurs tickets attendent,
+    jusqu'à Config.PRINT_BATCH_MAX partent dans un seul job (spouleur Windows)
+    ou une seule connexion (réseau/USB), une écriture par ticket: chaque ticket
+    est acquitté dès son envoi.
+    """
+    
+    def __init__(self, manager: PrinterManager, station: str = "",
+                 archive: Optional["TicketArchive"] = None):
+        self.manager = manager
+        self.station = station
+        self.archive = archive
+        self.failover: List["PrintDispatcher"] = []  # postes de secours, dans l'ordre
+        self.backlog = 0.0  # durée estimée des tickets en file (secondes)
+        self.pending = 0  # tickets en file ou en cours d'impression
+        self.backlog_lock = threading.Lock()
+        self.capacity = Config.PRINT_QUEUE_MAX
+        self.waits = collections.deque(maxlen=200)  # temps passé en file (secondes)
+        self.overloaded = False
+        self.queue: "queue.PriorityQueue" = queue.PriorityQueue()  # (échéance, n°, ticket)
+        self.sequence = itertools.count()
+        # Lot en cours d'impression, surveillé par le chien de garde (PrintWatchdog)
+        self.state_lock = threading.Lock()
+        self.current: Optional[List[PrintJob]] = None
+        self.deadline = 0.0
+        self.generation = 0  # incrémenté quand un thread bloqué est abandonné
+        self.stop_seen = False
+        # Pause (API d'administration): le ticket suivant attend la reprise
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.held: Optional[PrintJob] = None
+        self.history = ReprintBuffer(station, directory=Config.REPRINT_DIR or None)
+        self.thread = self._start_thread()
+    
+    def _start_thread(self) -> threading.Thread:
+        thread = threading.Thread(
+            target=self._run, args=(self.generation,),
+            name=f"print-{self.manager.config.get('name')}", daemon=True
+        )
+        thread.start()
+        return thread
+    
+    def submit(self, job: PrintJob) -> PrintJob:
+        """Ajoute un ticket à la file"""
+        if job.failover is None:
+            job.failover = list(self.failover)
+        if not job.estimate:
+            job.estimate = self.estimate(job)
+        self._enqueue(job)
+        return job
+    
+    def estimate(self, job: PrintJob) -> float:
+        """Durée d'impression estimée d'un ticket sur cette imprimante"""
+        try:
+            return PrintTimeEstimator.seconds(job.render_for(self.manager), self.manager.speed)
+        except Exception as e:
+            logger.warning(f"⚠️ Estimation impossible pour {job.label}: {e}")
+            return 0.0
+    
+    def _enqueue(self, job: PrintJob):
+        if job.queued_at is None:
+            job.queued_at = time.monotonic()
+        with self.backlog_lock:
+            self.backlog += job.estimate
+            self.pending += 1
+        self.queue.put((job.priority, next(self.sequence), job))
+    
+    def _release(self, job: PrintJob):
+        with self.backlog_lock:
+            self.backlog = max(0.0, self.backlog - job.estimate)
+            self.pending = max(0, self.pending - 1)
+    
+    def free_slots(self) -> int:
+        """Places libres avant la limite de la file (contre-pression sur le polling)"""
+        return max(0, self.capacity - self.pending)
+    
+    def oldest_wait(self) -> float:
+        """Ancienneté (secondes) du plus vieux ticket en attente"""
+        with self.queue.mutex:
+            queued = [job.queued_at for _, _, job in self.queue.queue if job is not None and job.queued_at]
+        held = self.held
+        if held is not None and held.queued_at:
+            queued.append(held.queued_at)
+        return time.monotonic() - min(queued) if queued else 0.0
+    
+    def backlog_latency(self) -> float:
+        """Attente prévisible d'un nouveau ticket: durée estimée de la file, ou
+        ancienneté du plus vieux ticket si l'imprimante n'avance pas (panne, pause)"""
+        return max(self.backlog, self.oldest_wait())
+    
+    def check_overload(self, threshold: float = Config.BACKLOG_WARN_SECONDS) -> bool:
+        """Alerte (une fois) quand l'attente dépasse le seuil; fin d'alerte sous la moitié"""
+        latency = self.backlog_latency()
+        if not self.overloaded and latency > threshold:
+            self.overloaded = True
+            logger.warning(f"🚨 Surcharge {self.manager.config.get('name')}: ~{latency:.0f}s d'attente, "
+                           f"{self.pending} ticket(s) en file (seuil {threshold:g}s)")
+        elif self.overloaded and latency < threshold / 2:
+            self.overloaded = False
+            logger.info(f"✅ Fin de surcharge {self.manager.config.get('name')} (~{latency:.0f}s d'attente)")
+        return self.overloaded
+    
+    def _reroute(self, job: PrintJob) -> bool:
+        """Redirige un ticket vers le prochain poste de secours disponible"""
+        while job.failover:
+            target = job.failover.pop(0)
+            if target is self:
+                continue
+            logger.warning(f"🔀 Ticket {job.label} redirigé de {self.manager.config.get('name')} "
+                           f"vers {target.manager.config.get('name')}")
+            job.add_banner(self.station)
+            self._release(job)
+            target._enqueue(job)
+            return True
+        return False
+    
+    def _run(self, generation: int):
+        while True:
+            _, _, job = self.queue.get()
+            if job is None:
+                return
+            if not self.resumed.is_set():
+                self.held = job
+                self.resumed.wait()
+                self.held = None
+            batch = [job]
+            stop = False
+            while len(batch) < Config.PRINT_BATCH_MAX:
+                try:
+                    _, _, extra = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if extra is None:
+                    stop = True
+                    with self.state_lock:
+                        self.stop_seen = True
+                    break
+                batch.append(extra)
+            if not self._print_batch(batch, generation) or stop:
+                return
+    
+    @staticmethod
+    def retry_seconds() -> float:
+        """Durée maximale des tentatives de print_payload (connexion + écriture, pauses)"""
+        attempts = max(Config.RETRY_ATTEMPTS, 1)
+        return (attempts * (Config.PRINTER_CONNECT_TIMEOUT + Config.PRINTER_WRITE_TIMEOUT)
+                + (attempts - 1) * Config.RETRY_DELAY)
+    
+    @classmethod
+    def job_timeout(cls) -> float:
+        """Délai d'un lot avant abandon par le chien de garde (hors durée d'impression estimée)"""
+        return Config.PRINT_JOB_TIMEOUT or cls.retry_seconds() + Config.PRINT_JOB_MARGIN
+    
+    def _print_batch(self, batch: List[PrintJob], generation: int) -> bool:
+        """
+        Imprime un lot; les tickets en échec basculent vers les postes de secours
+        Returns: False si le lot a été abandonné par le chien de garde (thread remplacé)
+        """
+        with self.state_lock:
+            self.current = batch
+            self.deadline = time.time() + self.job_timeout() + sum(job.estimate for job in batch)
+        now = time.monotonic()
+        self.waits.extend(now - job.queued_at for job in batch if job.queued_at)
+        healthy = not any(job.failover for job in batch) or self.manager.health_check()
+        with self.state_lock:
+            if self.generation != generation:
+                return False
+            if not healthy:
+                # Imprimante signalée hors service: basculement sans attendre les tentatives
+                batch = [job for job in batch if not self._reroute(job)]
+            self.current = list(batch) or None
+        if not batch:
+            return True
+        printed = []
+        
+        def on_printed(job: PrintJob):
+            # Ticket envoyé: acquitté sans attendre la fin du lot
+            with self.state_lock:
+                if self.generation != generation:
+                    return
+                self.current.remove(job)
+            printed.append(job)
+            self._complete(job, True)
+        
+        try:
+            results = self.manager.print_jobs(batch, on_printed=on_printed)
+        except Exception as e:
+            logger.error(f"❌ Erreur file d'impression {self.manager.config.get('name')}: {e}")
+            results = [False] * len(batch)
+        with self.state_lock:
+            if self.generation != generation:
+                if any(success and job not in printed for job, success in zip(batch, results)):
+                    logger.warning(f"⚠️ Job abandonné finalement imprimé sur {self.manager.config.get('name')} "
+                                   f"(ticket possiblement en double)")
+                return False
+            self.current = None
+        for job, success in zip(batch, results):
+            if job in printed:
+                continue
+            if not success and self._reroute(job):
+                continue
+            self._complete(job, success)
+        return True
+    
+    def _complete(self, job: PrintJob, success: bool):
+        """Résultat définitif d'un ticket sur ce poste: historique, archive, callback"""
+        self._release(job)
+        if success:
+            self.history.add(job)
+        if self.archive:
+            self.archive.record(job, self.station, self.manager.config.get("name"), success)
+        job.finish(success)
+    
+    def check_timeout(self) -> bool:
+        """
+        Abandonne le lot en cours s'il dépasse son délai (appelé par le chien de garde)
+        Le thread bloqué est laissé de côté, un nouveau thread reprend la file,
+        la connexion est réinitialisée et les tickets basculent ou échouent.
+        Returns: True si un lot a été abandonné
+        """
+        with self.state_lock:
+            if not self.current or time.time() < self.deadline:
+                return False
+            batch, self.current = self.current, None
+            self.generation += 1
+            resend_stop, self.stop_seen = self.stop_seen, False
+        logger.error(f"⏱️ Impression bloquée sur {self.manager.config.get('name')}: "
+                     f"{len(batch)} ticket(s) abandonné(s), connexion réinitialisée")
+        self.manager.reset()
+        with self.state_lock:
+            self.thread = self._start_thread()
+        for job in batch:
+            if self._reroute(job):
+                continue
+            self._complete(job, False)
+        if resend_stop:
+            # L'ancien thread avait reçu la demande d'arrêt: la transmettre au nouveau
+            self.queue.put((float("inf"), next(self.sequence), None))
+        return True
+    
+    @property
+    def paused(self) -> bool:
+        return not self.resumed.is_set()
+    
+    def pause(self):
+        """Suspend l'impression (les tickets s'accumulent dans la file)"""
+        self.resumed.clear()
+        logger.info(f"⏸️ Imprimante {self.manager.config.get('name')} en pause")
+    
+    def resume(self):
+        """Reprend l'impression des tickets en attente"""
+        self.resumed.set()
+        logger.info(f"▶️ Imprimante {self.manager.config.get('name')} reprise")
+    
+    def reprint(self, entry: Dict) -> PrintJob:
+        """Réimprime un ticket de l'historique (de n'importe quelle imprimante), en tête de file"""
+        payload = entry["payload"]
+        replay = entry.get("commands")
+        
+        def commands(printer):
+            if hasattr(printer, "_raw"):
+                printer._raw(payload)
+            elif replay is not None:
+                replay(printer)  # imprimante simulée (mode mock)
+            else:
+                # Mode mock, ticket rechargé de REPRINT_DIR (octets seulement): aperçu texte
+                printer.text(EscposPreview.text(payload, getattr(printer, "width", Config.PAPER_WIDTH)))
+                printer.cut()
+        job = PrintJob(commands, label=f"réimpression {entry['label']}", priority=0.0,
+                       order_numbers=entry.get("orders"))
+        # Octets déjà rendus: la page de code est sélectionnée dans le ticket lui-même
+        job.payload = payload
+        job.payload_codepage = self.manager.codepage.name
+        job.failover = []
+        return self.submit(job)
+    
+    def status(self) -> Dict:
+        """État de la file (imprimante, pause, tickets en cours et en attente)"""
+        with self.queue.mutex:
+            waiting = [job for _, _, job in sorted(self.queue.queue, key=lambda item: item[:2]) if job is not None]
+        held = self.held
+        if held is not None:
+            waiting.insert(0, held)
+        describe = lambda job: {"label": job.label, "estimate": round(job.estimate, 1)}
+        waits = list(self.waits)
+        return {
+            "printer": self.manager.config.get("name"),
+            "paused": self.paused,
+            "down": self.manager.is_down(),
+            "backlog": round(self.backlog, 1),
+            "pending": self.pending,
+            "capacity": self.capacity,
+            "fill": round(self.pending / self.capacity, 2) if self.capacity else None,
+            "oldest_wait": round(self.oldest_wait(), 1),
+            "wait_avg": round(sum(waits) / len(waits), 2) if waits else None,
+            "wait_max": round(max(waits), 2) if waits else None,
+            "overloaded": self.overloaded,
+            "printing": [describe(job) for job in (self.current or [])],
+            "queue": [describe(job) for job in waiting],
+            "history": len(self.history.entries),
+        }
+    
+    def stop(self, timeout: Optional[float] = None):
+        """Imprime les tickets restants puis arrête le thread"""
+        self.resumed.set()
+        self.queue.put((float("inf"), next(self.sequence), None))
+        thread = self.thread
+        thread.join(timeout)
+        if self.thread is not thread:
+            # Thread remplacé par le chien de garde pendant l'attente
+            self.thread.join(timeout)
+
+
+class PrintWatchdog:
+    """Chien de garde: abandonne les jobs d'impression bloqués.
+
+    Vérifie périodiquement chaque file; un lot qui dépasse PrintDispatcher.job_timeout()
+    (plus sa durée estimée) est abandonné sans bloquer les autres imprimantes.
+    Signale aussi les files en surcharge (Config.BACKLOG_WARN_SECONDS).
+    """
+    
+    def __init__(self, dispatchers: List[PrintDispatcher], interval: float = Config.WATCHDOG_INTERVAL):
+        self.dispatchers = dispatchers
+        self.interval = interval
+        if Config.PRINT_JOB_TIMEOUT and Config.PRINT_JOB_TIMEOUT < PrintDispatcher.retry_seconds():
+            logger.warning(f"⚠️ PRINT_JOB_TIMEOUT={Config.PRINT_JOB_TIMEOUT:g}s inférieur à la durée des tentatives "
+                           f"({PrintDispatcher.retry_seconds():g}s): des jobs encore en cours seront abandonnés")
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="print-watchdog", daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            for dispatcher in self.dispatchers:
+                try:
+                    dispatcher.check_timeout()
+                    dispatcher.check_overload()
+                except Exception as e:
+                    logger.error(f"❌ Erreur chien de garde ({dispatcher.station}): {e}")
+    
+    def stop(self):
+        self.stopped.set()
+
+
+class PrinterPool:
+    """Répartit les tickets d'un poste entre imprimantes identiques.
+
+    Chaque ticket part vers l'imprimante qui aura fini le plus tôt, d'après
+    la durée estimée des tickets déjà en file (et non en tourniquet).
+    """
+    
+    def __init__(self, dispatchers: List[PrintDispatcher]):
+        self.dispatchers = dispatchers
+        self.manager = dispatchers[0].manager
+    
+    def submit(self, job: PrintJob) -> PrintJob:
+        """Envoie le ticket à l'imprimante dont la file se videra en premier"""
+        candidates = [d for d in self.dispatchers if not d.manager.is_down() and not d.paused] or self.dispatchers
+        estimates = {d.station: d.estimate(job) for d in candidates}
+        target = min(candidates, key=lambda d: d.backlog + estimates[d.station])
+        job.estimate = estimates[target.station]
+        logger.info(f"⚖️ Ticket {job.label} (~{job.estimate:.1f}s) → {target.manager.config.get('name')} "
+                    f"(file: {target.backlog:.1f}s)")
+        return target.submit(job)
+    
+    def free_slots(self) -> int:
+        candidates = [d for d in self.dispatchers if not d.manager.is_down() and not d.paused] or self.dispatchers
+        return sum(d.free_slots() for d in candidates)
+
+
+class OrderTracker:
+    """Suit les tickets d'une commande, poste par poste; appelle
+    on_complete(order, succès) une fois tous terminés"""
+    
+    def __init__(self, order: Dict, stations: List[str], on_complete: Callable[[Dict, bool], None]):
+        self.order = order
+        self.stations = list(stations)
+        self.results: Dict[str, bool] = {}
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+    
+    def done(self, station: str) -> Callable[[bool], None]:
+        """Callback de fin du ticket d'un poste (à passer au PrintJob)"""
+        return lambda success: self._job_done(station, success)
+    
+    @property
+    def printed(self) -> set:
+        """Postes dont le ticket est imprimé"""
+        with self.lock:
+            return {station for station, success in self.results.items() if success}
+    
+    def _job_done(self, station: str, success: bool):
+        with self.lock:
+            self.results[station] = success
+            complete = len(self.results) == len(self.stations)
+        if complete:
+            # Acquittée seulement si chaque poste a imprimé (éventuellement en secours)
+            self.on_complete(self.order, all(self.results.values()))
+
+
+# ============================================================================
+# GÉNÉRATEURS DE TICKETS
+# ============================================================================
+
+class TicketGenerator:
+    """Génère le contenu des tickets pour caisse et cuisine"""
+    
+    @staticmethod
+    def _center(text: str, width: int = Config.PAPER_WIDTH) -> str:
+        """Centre un texte sur la largeur du ticket"""
+        return text.center(width)
+    
+    @staticmethod
+    def _line(char: str = "-", width: int = Config.PAPER_WIDTH) -> str:
+        """Génère une ligne de séparation"""
+        return char * width
+    
+    @staticmethod
+    def _format_price(price: float) -> str:
+        """Formate un prix en euros"""
+        return f"{price:.2f}€"
+    
+    @staticmethod
+    def _select_codepage(printer, profile: CodepageProfile):
+        """Active la page de code du profil sur l'imprimante (ESC t n)"""
+        if hasattr(printer, '_raw'):
+            printer._raw(profile.select_command)
+    
+    @staticmethod
+    def _text_writer(printer, profile: CodepageProfile, cached: bool = False) -> Callable[[str], None]:
+        """
+        Retourne l'écriture de texte: octets encodés ou texte brut en mode mock
+        Args:
+            cached: Texte répété d'une commande à l'autre (produits, options, séparateurs),
+                    encodage servi par le cache du profil
+        """
+        if hasattr(printer, '_raw'):
+            encode = profile.encode_static if cached else profile.encode
+            return lambda data: printer._raw(encode(data))
+        return printer.text
+    
+    @staticmethod
+    def _segment_writer(printer, cached: Callable[[str], None]) -> Callable[[str], None]:
+        """Retourne l'émission des segments statiques (texte servi par le cache d'encodage)"""
+        return lambda name: getattr(TicketGenerator, f"_segment_{name}")(printer, cached)
+    
+    # ------------------------------------------------------------------
+    # Segments statiques (identiques pour chaque commande)
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _segment_cashier_header(printer, text: Callable[[str], None]):
+        """En-tête du ticket caisse (logo éventuel inclus)"""
+        logo = RasterLogo.get()
+        if logo:
+            printer.set(align='center')
+            if hasattr(printer, '_raw'):
+                printer._raw(logo + b"\n")
+            else:
+                text("[LOGO]\n")
+        printer.set(align='center', bold=True, width=2, height=2)
+        text("RESTAURANT MITAKE\n")
+        printer.set(align='center', bold=False, width=1, height=1)
+        text("Ticket de Caisse\n")
+        text(TicketGenerator._line("=") + "\n")
+        printer.set(align='left', bold=False)
+    
+    @staticmethod
+    def _segment_cashier_paid(printer, text: Callable[[str], None]):
+        """Mention commande payée en ligne"""
+        printer.set(bold=True)
+        text("✓ PAYÉ EN LIGNE\n")
+    
+    @staticmethod
+    def _segment_cashier_unpaid(printer, text: Callable[[str], None]):
+        """Mention commande à payer en caisse"""
+        printer.set(bold=True, invert=True)
+        text("  À PAYER EN CAISSE  \n")
+    
+    @staticmethod
+    def _segment_cashier_footer(printer, text: Callable[[str], None]):
+        """Pied de page du ticket caisse et coupe"""
+        printer.set(bold=False, invert=False)
+        text("\n")
+        text(TicketGenerator._line("=") + "\n")
+        text("Merci de votre visite !\n")
+        text(TicketGenerator._line("=") + "\n")
+        text("\n\n")
+        printer.cut()
+    
+    @staticmethod
+    def _segment_kitchen_header(printer, text: Callable[[str], None]):
+        """En-tête du ticket cuisine"""
+        printer.set(align='center', bold=True, width=2, height=2)
+        text("*** CUISINE ***\n")
+        printer.set(bold=False, width=1, height=1)
+        text(TicketGenerator._line("=") + "\n")
+    
+    @staticmethod
+    def _segment_kitchen_rush_header(printer, text: Callable[[str], None]):
+        """En-tête du ticket de préparation groupé (mode rush)"""
+        printer.set(align='center', bold=True, width=2, height=2)
+        text("*** CUISINE RUSH ***\n")
+        printer.set(bold=False, width=1, height=1)
+        text(TicketGenerator._line("=") + "\n")
+    
+    @staticmethod
+    def _segment_kitchen_footer(printer, text: Callable[[str], None]):
+        """Pied de page du ticket cuisine et coupe"""
+        printer.set(align='center')
+        text(TicketGenerator._line("=") + "\n")
+        text("\n\n")
+        printer.cut()
+    
+    # ------------------------------------------------------------------
+    # Tickets
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def print_cashier_ticket(printer, order: Dict, profile: Optional[CodepageProfile] = None):
+        """
+        Génère le ticket CAISSE avec tous les détails et prix
+        Args:
+            printer: Instance de l'imprimante ESC/POS
+            order: Dictionnaire contenant les données de commande
+            profile: Page de code (défaut: celle du tampon de rendu, sinon Config.PRINTER_CODEPAGE)
+        """
+        profile = profile or getattr(printer, 'profile', None) or CodepageProfile.get()
+        try:
+            TicketGenerator._select_codepage(printer, profile)
+            text = TicketGenerator._text_writer(printer, profile)
+            cached = TicketGenerator._text_writer(printer, profile, cached=True)
+            segment = TicketGenerator._segment_writer(printer, cached)
+            
+            # En-tête
+            segment("cashier_header")
+            
+            # Informations commande
+            text(f"Commande N°: {order.get('order_number', 'N/A')}\n")
+            text(f"Date: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n")
+            text(f"Client: {order.get('customer_name', 'Anonyme')}\n")
+            
+            if order.get('customer_phone'):
+                text(f"Tel: {order['customer_phone']}\n")
+            
+            cached(TicketGenerator._line("-") + "\n")
+            
+            # Produits
+            items = order.get('items', [])
+            total = 0.0
+            
+            for item in items:
+                name = item.get('name', 'Produit')
+                quantity = item.get('quantity', 1)
+                price = item.get('price', 0.0)
+                subtotal = quantity * price
+                total += subtotal
+                
+                # Nom du produit et prix
+                printer.set(bold=True)
+                cached(f"{quantity}x {name}\n")
+                printer.set(bold=False, align='right')
+                text(f"{TicketGenerator._format_price(subtotal)}\n")
+                printer.set(align='left')
+                
+                # Options/Modifications
+                if item.get('options'):
+                    for option in item['options']:
+                        cached(f"  + {option}\n")
+                
+                # Commentaire
+                if item.get('comment'):
+                    text(f"  Note: {item['comment']}\n")
+                
+                text("\n")
+            
+            # Total
+            cached(TicketGenerator._line("-") + "\n")
+            printer.set(bold=True, width=2, height=2, align='right')
+            text(f"TOTAL: {TicketGenerator._format_price(total)}\n")
+            printer.set(bold=False, width=1, height=1, align='center')
+            
+            # Statut de paiement
+            text("\n")
+            payment_status = order.get('payment_status', 'pending')
+            if payment_status == 'paid':
+                segment("cashier_paid")
+            else:
+                segment("cashier_unpaid")
+            
+            # QR code (suivi de commande / avis), commande native de l'imprimante
+            if Config.TICKET_QR_URL:
+                printer.set(align='center')
+                text("\n")
+                printer.qr(
+                    Config.TICKET_QR_URL.format(
+                        order_number=order.get('order_number', ''), id=order.get('id', '')
+                    ),
+                    size=Config.TICKET_QR_SIZE,
+                )
+            
+            # Pied de page et coupe du papier
+            segment("cashier_footer")
+            
+        except Exception as e:
+            logger.error(f"❌ Erreur génération ticket caisse: {e}")
+            raise
+    
+    @staticmethod
+    def print_kitchen_ticket(printer, order: Dict, profile: Optional[CodepageProfile] = None):
+        """
+        Génère le ticket CUISINE avec nom en GROS, options, sans prix
         Args:
             printer: Instance de l'imprimante ESC/POS
             order: Dictionnaire contenant les données de commande
+            profile: Page de code (défaut: celle du tampon de rendu, sinon Config.PRINTER_CODEPAGE)
         """
+        profile = profile or getattr(printer, 'profile', None) or CodepageProfile.get()
         try:
+            TicketGenerator._select_codepage(printer, profile)
+            text = TicketGenerator._text_writer(printer, profile)
+            cached = TicketGenerator._text_writer(printer, profile, cached=True)
+            segment = TicketGenerator._segment_writer(printer, cached)
+            
             # En-tête
-            printer.set(align='center', bold=True, width=2, height=2)
-            printer.text("*** CUISINE ***\n")
-            printer.set(bold=False, width=1, height=1)
-            printer.text(TicketGenerator._line("=") + "\n")
+            segment("kitchen_header")
             
             # Numéro de commande en TRÈS GROS
             printer.set(align='center', bold=True, width=3, height=3)
-            printer.text(f"N° {order.get('order_number', '???')}\n")
+            text(f"N° {order.get('order_number', '???')}\n")
             printer.set(width=1, height=1)
-            printer.text("\n")
+            text("\n")
             
             # Heure
             printer.set(align='center', bold=False)
-            printer.text(f"{datetime.now().strftime('%H:%M')}\n")
-            printer.text(TicketGenerator._line("-") + "\n")
+            text(f"{datetime.now().strftime('%H:%M')}\n")
+            cached(TicketGenerator._line("-") + "\n")
             
             # Produits
             items = order.get('items', [])
@@ -604,148 +2245,1332 @@ class TicketGenerator:
                 
                 # Nom du produit en TRÈS GROS
                 printer.set(align='left', bold=True, width=2, height=2)
-                printer.text(f"{quantity}x {name}\n")
+                cached(f"{quantity}x {name}\n")
                 printer.set(width=1, height=1, bold=False)
                 
                 # Options/Modifications en gras
                 if item.get('options'):
                     printer.set(bold=True)
                     for option in item['options']:
-                        printer.text(f"  >> {option}\n")
+                        cached(f"  >> {option}\n")
                     printer.set(bold=False)
                 
                 # Commentaire en surbrillance si présent
                 if item.get('comment'):
                     printer.set(invert=True, bold=True)
-                    printer.text(f"  NOTE: {item['comment'].upper()}\n")
+                    text(f"  NOTE: {item['comment'].upper()}\n")
                     printer.set(invert=False, bold=False)
                 
-                printer.text("\n")
+                text("\n")
                 
                 # Séparateur entre produits
                 if idx < len(items):
-                    printer.text(TicketGenerator._line("-") + "\n")
-            
-            # Pied de page
-            printer.set(align='center')
-            printer.text(TicketGenerator._line("=") + "\n")
-            printer.text("\n\n")
+                    cached(TicketGenerator._line("-") + "\n")
             
-            # Coupe automatique du papier
-            printer.cut()
+            # Pied de page et coupe automatique du papier
+            segment("kitchen_footer")
             
         except Exception as e:
             logger.error(f"❌ Erreur génération ticket cuisine: {e}")
             raise
+    
+    @staticmethod
+    def print_failover_banner(printer, station_label: str, profile: Optional[CodepageProfile] = None):
+        """
+        Bandeau imprimé en tête d'un ticket redirigé vers une autre imprimante
+        Args:
+            printer: Instance de l'imprimante ESC/POS
+            station_label: Poste d'origine du ticket (ex: "CUISINE")
+            profile: Page de code (défaut: celle du tampon de rendu, sinon Config.PRINTER_CODEPAGE)
+        """
+        profile = profile or getattr(printer, 'profile', None) or CodepageProfile.get()
+        TicketGenerator._select_codepage(printer, profile)
+        text = TicketGenerator._text_writer(printer, profile)
+        printer.set(align='center', bold=True, width=2, height=2, invert=True)
+        text(f" COPIE {station_label} \n")
+        printer.set(align='center', bold=False, width=1, height=1, invert=False)
+        text("(imprimante habituelle indisponible)\n")
+    
+    @staticmethod
+    def print_delta_ticket(printer, order: Dict, added: List[Dict], removed: List[Dict],
+                           cancelled: bool = False, profile: Optional[CodepageProfile] = None):
+        """
+        Ticket modificatif: uniquement les changements depuis le ticket imprimé
+        Args:
+            printer: Instance de l'imprimante ESC/POS
+            order: Nouvelle version de la commande
+            added, removed: Produits ajoutés / retirés (OrderDelta.diff)
+            cancelled: Commande annulée (removed = tout ce qui avait été imprimé)
+            profile: Page de code (défaut: celle du tampon de rendu, sinon Config.PRINTER_CODEPAGE)
+        """
+        profile = profile or getattr(printer, 'profile', None) or CodepageProfile.get()
+        try:
+            TicketGenerator._select_codepage(printer, profile)
+            text = TicketGenerator._text_writer(printer, profile)
+            cached = TicketGenerator._text_writer(printer, profile, cached=True)
+            segment = TicketGenerator._segment_writer(printer, cached)
+            
+            # Bandeau inversé: impossible à confondre avec un ticket normal
+            printer.set(align='center', bold=True, width=2, height=2, invert=True)
+            text(" ANNULATION \n" if cancelled else " MODIFICATION \n")
+            printer.set(align='center', bold=True, width=3, height=3, invert=False)
+            text(f"N° {order.get('order_number', '???')}\n")
+            printer.set(align='center', bold=False, width=1, height=1)
+            customer = order.get('customer_name')
+            text(f"{customer + ' - ' if customer else ''}{datetime.now().strftime('%H:%M')}\n")
+            cached(TicketGenerator._line("-") + "\n")
+            
+            if cancelled:
+                printer.set(align='center', bold=True, width=2, height=2)
+                cached("NE PAS PRÉPARER\n")
+                printer.set(align='left', bold=False, width=1, height=1)
+            
+            for title, sign, items in (("AJOUTER", "+", added), ("RETIRER", "-", removed)):
+                if not items:
+                    continue
+                printer.set(align='left', bold=True, width=1, height=1)
+                cached(f"{title}:\n")
+                for item in items:
+                    printer.set(align='left', bold=True, width=2, height=2)
+                    cached(f"{sign}{item.get('quantity', 1)}x {item.get('name', 'Produit')}\n")
+                    printer.set(bold=True, width=1, height=1)
+                    for option in item.get('options') or []:
+                        cached(f"  >> {option}\n")
+                    if item.get('comment'):
+                        printer.set(invert=True, bold=True)
+                        text(f"  NOTE: {item['comment'].upper()}\n")
+                    printer.set(bold=False, invert=False)
+                text("\n")
+            
+            segment("kitchen_footer")
+        
+        except Exception as e:
+            logger.error(f"❌ Erreur génération ticket modificatif: {e}")
+            raise
+    
+    @staticmethod
+    def print_kitchen_rush_ticket(printer, orders: List[Dict], profile: Optional[CodepageProfile] = None):
+        """
+        Génère un ticket CUISINE groupé pour plusieurs commandes (mode rush):
+        produits regroupés avec le détail par commande, puis un talon par commande.
+        Une seule coupe pour tout le lot.
+        Args:
+            printer: Instance de l'imprimante ESC/POS
+            orders: Commandes arrivées dans la même fenêtre
+            profile: Page de code (défaut: celle du tampon de rendu, sinon Config.PRINTER_CODEPAGE)
+        """
+        profile = profile or getattr(printer, 'profile', None) or CodepageProfile.get()
+        try:
+            TicketGenerator._select_codepage(printer, profile)
+            text = TicketGenerator._text_writer(printer, profile)
+            cached = TicketGenerator._text_writer(printer, profile, cached=True)
+            segment = TicketGenerator._segment_writer(printer, cached)
+            
+            # En-tête
+            segment("kitchen_rush_header")
+            printer.set(align='center', bold=True)
+            text(f"{len(orders)} commandes - {datetime.now().strftime('%H:%M')}\n")
+            printer.set(align='center', bold=False)
+            numbers = ", ".join(str(o.get('order_number', '???')) for o in orders)
+            text(f"N° {numbers}\n")
+            cached(TicketGenerator._line("-") + "\n")
+            
+            # Regroupement par produit (ordre de première apparition)
+            groups: Dict[str, List] = {}
+            for order in orders:
+                for item in order.get('items', []):
+                    name = item.get('name', 'Produit')
+                    groups.setdefault(name, []).append((order.get('order_number', '???'), item))
+            
+            for idx, (name, entries) in enumerate(groups.items(), 1):
+                total_quantity = sum(item.get('quantity', 1) for _, item in entries)
+                
+                # Total du produit en TRÈS GROS
+                printer.set(align='left', bold=True, width=2, height=2)
+                cached(f"{total_quantity}x {name}\n")
+                printer.set(width=1, height=1, bold=False)
+                
+                # Détail par commande
+                for number, item in entries:
+                    printer.set(bold=True)
+                    text(f"  {item.get('quantity', 1)}x  N° {number}\n")
+                    printer.set(bold=False)
+                    for option in item.get('options') or []:
+                        cached(f"      >> {option}\n")
+                    if item.get('comment'):
+                        printer.set(invert=True, bold=True)
+                        text(f"      NOTE: {item['comment'].upper()}\n")
+                        printer.set(invert=False, bold=False)
+                
+                if idx < len(groups):
+                    cached(TicketGenerator._line("-") + "\n")
+            
+            # Talons par commande (séparés par une ligne pointillée, sans coupe)
+            printer.set(align='center')
+            cached(TicketGenerator._line("=") + "\n")
+            for order in orders:
+                printer.set(align='center', bold=True, width=2, height=2)
+                text(f"N° {order.get('order_number', '???')}\n")
+                printer.set(align='left', bold=False, width=1, height=1)
+                for item in order.get('items', []):
+                    cached(f"  {item.get('quantity', 1)}x {item.get('name', 'Produit')}\n")
+                cached(TicketGenerator._line("- ")[:Config.PAPER_WIDTH] + "\n")
+            
+            # Pied de page et coupe unique
+            segment("kitchen_footer")
+            
+        except Exception as e:
+            logger.error(f"❌ Erreur génération ticket cuisine rush: {e}")
+            raise
+
+
+# ============================================================================
+# TICKETS MODIFICATIFS (COMMANDES MODIFIÉES OU ANNULÉES)
+# ============================================================================
+
+class OrderDelta:
+    """Différence entre la version imprimée d'une commande et sa nouvelle version.
+
+    Un produit est identifié par (nom, options, commentaire): changer une
+    option donne un retrait de l'ancien produit et un ajout du nouveau.
+    """
+    
+    @staticmethod
+    def _key(item: Dict) -> tuple:
+        return (item.get("name", "Produit"), tuple(item.get("options") or []), item.get("comment") or "")
+    
+    @classmethod
+    def quantities(cls, items: Optional[List[Dict]]) -> Dict[tuple, int]:
+        quantities: Dict[tuple, int] = {}
+        for item in items or []:
+            key = cls._key(item)
+            quantities[key] = quantities.get(key, 0) + int(item.get("quantity", 1) or 0)
+        return quantities
+    
+    @classmethod
+    def diff(cls, printed_items: Optional[List[Dict]], items: Optional[List[Dict]]) -> tuple:
+        """Returns: (ajouts, retraits), produits au format de `items` avec la quantité d'écart"""
+        before, after = cls.quantities(printed_items), cls.quantities(items)
+        added, removed = [], []
+        for key in list(before) + [key for key in after if key not in before]:
+            change = after.get(key, 0) - before.get(key, 0)
+            if change:
+                name, options, comment = key
+                item = {"name": name, "quantity": abs(change), "options": list(options), "comment": comment or None}
+                (added if change > 0 else removed).append(item)
+        return added, removed
+
+
+# ============================================================================
+# GESTIONNAIRE SUPABASE
+# ============================================================================
+
+class SupabaseHttpSession:
+    """Session HTTP unique pour tous les appels Supabase (polling, statuts, sync).
+
+    Connexions keep-alive réutilisées (pool borné), HTTP/2 optionnel,
+    compression des réponses optionnelle et délais stricts: une requête
+    bloquée échoue au lieu de figer le polling. Chaque requête est chronométrée
+    (log DEBUG), avec le coût TCP/TLS quand une nouvelle connexion est ouverte.
+    """
+    
+    SUMMARY_EVERY = 200  # requêtes entre deux résumés (log INFO)
+    
+    def __init__(self):
+        http2 = Config.SUPABASE_HTTP2
+        if http2:
+            try:
+                import h2  # type: ignore # noqa: F401
+            except ImportError:
+                logger.warning("⚠️ HTTP/2 demandé mais paquet 'h2' absent (pip install httpx[http2]): HTTP/1.1 keep-alive")
+                http2 = False
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.total_ms = 0.0
+        self.handshake_ms = 0.0
+        self.client = httpx.Client(
+            http2=http2,
+            timeout=httpx.Timeout(Config.SUPABASE_READ_TIMEOUT, connect=Config.SUPABASE_CONNECT_TIMEOUT,
+                                  pool=Config.SUPABASE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=Config.SUPABASE_POOL_SIZE,
+                                max_keepalive_connections=Config.SUPABASE_POOL_SIZE,
+                                keepalive_expiry=Config.SUPABASE_KEEPALIVE_EXPIRY),
+            headers={} if Config.SUPABASE_COMPRESSION else {"Accept-Encoding": "identity"},
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
+    
+    def client_options(self):
+        """Options du client supabase utilisant cette session"""
+        try:
+            return ClientOptions(httpx_client=self.client)
+        except TypeError:
+            # supabase < 2.10: pas de client httpx injectable, seuls les délais s'appliquent
+            logger.warning("⚠️ Version de supabase sans session HTTP partagée: délais stricts uniquement")
+            return ClientOptions(postgrest_client_timeout=self.client.timeout)
+    
+    def _on_request(self, request):
+        timing = {"start": time.perf_counter(), "tcp": None, "tls": None}
+        
+        def trace(event: str, info: Dict):
+            step, _, phase = event.rpartition(".")
+            key = {"connection.connect_tcp": "tcp", "connection.start_tls": "tls"}.get(step)
+            if key and phase == "started":
+                timing[key + "_start"] = time.perf_counter()
+            elif key and phase == "complete":
+                timing[key] = (time.perf_counter() - timing[key + "_start"]) * 1000
+        request.extensions["trace"] = trace
+        request.extensions["mitake_timing"] = timing
+    
+    def _on_response(self, response):
+        timing = response.request.extensions.get("mitake_timing")
+        if not timing:
+            return
+        elapsed = (time.perf_counter() - timing["start"]) * 1000
+        handshake = (timing["tcp"] or 0.0) + (timing["tls"] or 0.0)
+        new_connection = timing["tcp"] is not None
+        with self.lock:
+            self.requests += 1
+            self.total_ms += elapsed
+            if new_connection:
+                self.connections += 1
+                self.handshake_ms += handshake
+            summary = self.requests % self.SUMMARY_EVERY == 0
+        detail = (f"nouvelle connexion: TCP {timing['tcp']:.0f} ms, TLS {timing['tls'] or 0:.0f} ms"
+                  if new_connection else "connexion réutilisée")
+        logger.debug(f"⏱️ Supabase {response.request.method} {response.request.url.path} {response.status_code} "
+                     f"{response.http_version} {elapsed:.0f} ms ({detail})")
+        if summary:
+            stats = self.stats()
+            logger.info(f"🌐 Supabase: {stats['requests']} requêtes, {stats['connections']} connexions "
+                        f"({stats['reuse_percent']}% réutilisées), {stats['avg_ms']} ms en moyenne")
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "reuse_percent": round(100 * (1 - self.connections / self.requests), 1) if self.requests else None,
+                "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else None,
+                "avg_handshake_ms": round(self.handshake_ms / self.connections, 1) if self.connections else None,
+            }
+    
+    def close(self):
+        self.client.close()
+
+
+class SupabaseManager:
+    """Gère la connexion et les interactions avec Supabase"""
+    
+    def __init__(self):
+        self.recorder = OrderRecorder(Config.ORDER_RECORD_PATH) if Config.ORDER_RECORD_PATH else None
+        self.http: Optional[SupabaseHttpSession] = None
+        if not SUPABASE_AVAILABLE:
+            if Config.PRINTER_MODE == 'mock':
+                logger.warning("⚠️ Supabase non installé. Mode mock actif: les événements Realtime ne fonctionneront pas. Installe avec 'pip install -r requirements.txt'.")
+            else:
+                logger.error("❌ Supabase non installé. Exécute 'pip install -r requirements.txt'.")
+                raise RuntimeError("Supabase library missing")
+        else:
+            if httpx is not None and ClientOptions is not None:
+                self.http = SupabaseHttpSession()
+                self.client: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY,
+                                                    options=self.http.client_options())
+            else:
+                self.client: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+            logger.info("✅ Connexion à Supabase établie")
+    
+    def _received(self, order: Dict, source: str):
+        """Enregistre une commande reçue (si ORDER_RECORD_PATH est défini)"""
+        if self.recorder:
+            self.recorder.record(order, source)
+    
+    def get_pending_orders(self) -> List[Dict]:
+        """Récupère les commandes en attente d'impression"""
+        orders = self._fetch_pending_orders()
+        for order in orders:
+            self._received(order, "pending")
+        return orders
+    
+    def _fetch_pending_orders(self) -> List[Dict]:
+        """Requête des commandes en attente (et des réservations expirées)"""
+        if not SUPABASE_AVAILABLE:
+            # Mode dégradé: retourne une commande factice pour test manuel
+            logger.info("🧪 [MOCK] Génération d'une commande factice locale (Supabase absent)")
+            return [{
+                "id": random.randint(1000, 9999),
+                "order_number": f"LOCAL-{int(time.time())}",
+                "customer_name": "Client Local",
+                "payment_status": "paid",
+                "items": [
+                    {"name": "Ramen Shoyu", "quantity": 1, "price": 11.5, "options": ["Extra œuf"], "comment": "Moins salé"},
+                    {"name": "Gyoza", "quantity": 2, "price": 6.0, "options": [], "comment": None}
+                ],
+                "status": Config.STATUS_PENDING
+            }]
+        try:
+            response = self.client.table(Config.TABLE_NAME)\
+                .select("*")\
+                .eq("status", Config.STATUS_PENDING)\
+                .execute()
+            return response.data + self.get_expired_claims()
+        except Exception as e:
+            logger.error(f"❌ Erreur récupération commandes: {e}")
+            return []
+    
+    def get_updated_orders(self, since: str) -> List[Dict]:
+        """Commandes imprimées ou annulées mises à jour après `since` (ISO 8601, horloge serveur)"""
+        if not SUPABASE_AVAILABLE:
+            return []
+        try:
+            response = self.client.table(Config.TABLE_NAME)\
+                .select("*")\
+                .in_("status", [Config.STATUS_PRINTED, Config.STATUS_CANCELLED])\
+                .gt(Config.ORDER_UPDATED_COLUMN, since)\
+                .order(Config.ORDER_UPDATED_COLUMN)\
+                .execute()
+            return response.data
+        except Exception as e:
+            logger.error(f"❌ Erreur récupération commandes modifiées: {e}")
+            return []
+    
+    def get_expired_claims(self) -> List[Dict]:
+        """Récupère les commandes réservées dont le bail a expiré (agent tombé)"""
+        if not Config.CLAIM_ORDERS or not SUPABASE_AVAILABLE:
+            return []
+        try:
+            response = self.client.table(Config.TABLE_NAME)\
+                .select("*")\
+                .eq("status", Config.STATUS_PRINTING)\
+                .lt("lease_expires_at", datetime.now(timezone.utc).isoformat())\
+                .execute()
+            return response.data
+        except Exception as e:
+            logger.error(f"❌ Erreur récupération baux expirés: {e}")
+            return []
+    
+    def claim_order(self, order: Dict) -> bool:
+        """
+        Réserve atomiquement une commande pour cet agent
+        Mise à jour conditionnelle pending_print -> printing (ou reprise d'un
+        bail expiré): un seul agent voit sa mise à jour appliquée.
+        Returns: True si la commande est réservée par cet agent
+        """
+        if not Config.CLAIM_ORDERS or not SUPABASE_AVAILABLE:
+            return True
+        now = datetime.now(timezone.utc)
+        lease = {
+            "status": Config.STATUS_PRINTING,
+            "claimed_by": Config.AGENT_ID,
+            "lease_expires_at": (now + timedelta(seconds=Config.CLAIM_LEASE_SECONDS)).isoformat(),
+        }
+        try:
+            query = self.client.table(Config.TABLE_NAME)\
+                .update(lease)\
+                .eq("id", order.get('id'))
+            if order.get('status') == Config.STATUS_PRINTING:
+                query = query.eq("status", Config.STATUS_PRINTING)\
+                    .lt("lease_expires_at", now.isoformat())
+            else:
+                query = query.eq("status", Config.STATUS_PENDING)
+            return bool(query.execute().data)
+        except Exception as e:
+            logger.error(f"❌ Erreur réservation commande {order.get('id')}: {e}")
+            return False
+    
+    def renew_claims(self, order_ids: List) -> bool:
+        """Prolonge le bail des commandes encore réservées par cet agent (une seule requête)"""
+        if not Config.CLAIM_ORDERS or not SUPABASE_AVAILABLE or not order_ids:
+            return True
+        expires = datetime.now(timezone.utc) + timedelta(seconds=Config.CLAIM_LEASE_SECONDS)
+        try:
+            self.client.table(Config.TABLE_NAME)\
+                .update({"lease_expires_at": expires.isoformat()})\
+                .in_("id", list(order_ids))\
+                .eq("status", Config.STATUS_PRINTING)\
+                .eq("claimed_by", Config.AGENT_ID)\
+                .execute()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Erreur prolongation des baux ({len(order_ids)} commande(s)): {e}")
+            return False
+    
+    def release_order(self, order_id: int) -> bool:
+        """Rend une commande réservée (échec d'impression) pour qu'un agent la reprenne"""
+        if not Config.CLAIM_ORDERS or not SUPABASE_AVAILABLE:
+            return True
+        try:
+            self.client.table(Config.TABLE_NAME)\
+                .update({"status": Config.STATUS_PENDING, "claimed_by": None, "lease_expires_at": None})\
+                .eq("id", order_id)\
+                .eq("claimed_by", Config.AGENT_ID)\
+                .execute()
+            logger.info(f"↩️ Commande {order_id} rendue (statut {Config.STATUS_PENDING})")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Erreur libération commande {order_id}: {e}")
+            return False
+    
+    def mark_as_printed(self, order_id: int) -> bool:
+        """Marque une commande comme imprimée"""
+        if not SUPABASE_AVAILABLE:
+            logger.info(f"🧪 [MOCK] Commande {order_id} marquée comme imprimée (local)")
+            return True
+        try:
+            # Mise à jour du statut uniquement (colonne printed_at optionnelle)
+            update = {"status": Config.STATUS_PRINTED}
+            if Config.CLAIM_ORDERS:
+                update["lease_expires_at"] = None
+            self.client.table(Config.TABLE_NAME)\
+                .update(update)\
+                .eq("id", order_id)\
+                .execute()
+            logger.info(f"✅ Commande {order_id} marquée comme imprimée")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Erreur mise à jour statut: {e}")
+            return False
+    
+    def sync_local_order(self, order: Dict, printed: bool) -> bool:
+        """
+        Envoie une commande reçue en local (upsert sur order_number)
+        Imprimée: statut printed (le polling l'ignore). Échec: pending_print,
+        pour qu'un agent la reprenne.
+        """
+        row = {key: order[key] for key in Config.INGEST_SYNC_COLUMNS if key in order}
+        row["status"] = Config.STATUS_PRINTED if printed else Config.STATUS_PENDING
+        if not SUPABASE_AVAILABLE:
+            logger.info(f"🧪 [MOCK] Commande locale {order.get('order_number')} synchronisée ({row['status']})")
+            return True
+        try:
+            self.client.table(Config.TABLE_NAME).upsert(row, on_conflict="order_number").execute()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Synchronisation commande {order.get('order_number')} impossible: {e}")
+            return False
+    
+    def subscribe_to_new_orders(self, callback, on_update=None, capacity=None, updated_since=None):
+        """
+        S'abonne aux nouvelles commandes (polling simple sans WebSocket)
+        Args:
+            callback: Fonction appelée lors d'une nouvelle insertion
+            on_update: Fonction appelée pour une commande imprimée puis modifiée
+                ou annulée (None = modifications ignorées)
+            capacity: Fonction retournant le nombre de commandes acceptables
+                (contre-pression: 0 suspend la lecture; None = sans limite)
+            updated_since: Curseur initial des modifications (date serveur ISO 8601;
+                None = maintenant, horloge de ce PC)
+        """
+        if not SUPABASE_AVAILABLE:
+            logger.error("❌ Supabase non installé. Impossible de s'abonner aux commandes. Installe: pip install -r requirements.txt")
+            logger.info("⏳ En attente de commandes... (Aucune ne sera traitée sans Supabase)")
+            return None
+        
+        # Polling simple : vérifie les commandes toutes les 2 secondes
+        last_check = time.time()
+        
+        class PollingChannel:
+            def __init__(self, manager, cb, on_update, capacity, updated_since):
+                self.manager = manager
+                self.cb = cb
+                self.on_update = on_update
+                self.capacity = capacity
+                self.throttled = False
+                self.last_id = None
+                self.next_rescan = time.monotonic() + Config.PENDING_RESCAN_SECONDS
+                # Curseur des modifications: plus grande date de mise à jour déjà vue
+                self.updated_since = updated_since or datetime.now(timezone.utc).isoformat()
+                
+            def run_forever(self):
+                logger.info(f"🔔 Écoute activée sur '{Config.TABLE_NAME}' (polling)")
+                while True:
+                    try:
+                        # Contre-pression: files pleines → pas de lecture; sinon page réduite
+                        limit = self.capacity() if self.capacity else None
+                        if limit is not None and limit <= 0:
+                            if not self.throttled:
+                                logger.warning("🚦 Files d'impression pleines: lecture des nouvelles commandes suspendue")
+                                self.throttled = True
+                            time.sleep(2)
+                            continue
+                        if self.throttled:
+                            logger.info(f"🚦 Lecture des commandes reprise ({limit} place(s) libre(s))")
+                            self.throttled = False
+                        # Relecture périodique sans filtre sur l'id: une commande rendue
+                        # (release_order) repasse en attente avec un id déjà dépassé
+                        rescan = time.monotonic() >= self.next_rescan
+                        if rescan:
+                            self.next_rescan = time.monotonic() + Config.PENDING_RESCAN_SECONDS
+                        query = self.manager.client.table(Config.TABLE_NAME)\
+                            .select("*")\
+                            .eq("status", Config.STATUS_PENDING)
+                        if self.last_id is not None and not rescan:
+                            query = query.gt("id", self.last_id)
+                        if limit is not None:
+                            query = query.order("id").limit(limit)
+                        response = query.execute()
+                        
+                        new_orders = [
+                            order for order in response.data
+                            if (rescan or self.last_id is None or order.get('id') > self.last_id)
+                            and order.get('status') == Config.STATUS_PENDING
+                        ]
+                        # Plusieurs commandes d'un coup (ex: après coupure réseau): les plus urgentes d'abord
+                        for order in OrderPriority.sort(new_orders):
+                            if self.last_id is not None and order.get('id') <= self.last_id:
+                                # Déjà enregistrée à sa première réception (pas de doublon au rejeu)
+                                logger.info(f"🔁 Commande de nouveau en attente: {order.get('order_number')}")
+                            else:
+                                logger.info(f"📩 Nouvelle commande détectée: {order.get('order_number')}")
+                                self.manager._received(order, "poll")
+                            self.cb(order)
+                        if new_orders:
+                            self.last_id = max([order.get('id') for order in new_orders]
+                                               + ([self.last_id] if self.last_id is not None else []))
+                        
+                        # Commandes abandonnées par un autre agent (bail expiré)
+                        for order in OrderPriority.sort(self.manager.get_expired_claims()):
+                            logger.info(f"♻️ Reprise commande (bail expiré): {order.get('order_number')}")
+                            self.manager._received(order, "expired")
+                            self.cb(order)
+                        
+                        # Commandes déjà imprimées puis modifiées ou annulées
+                        if self.on_update:
+                            for order in self.manager.get_updated_orders(self.updated_since):
+                                self.manager._received(order, "update")
+                                self.on_update(order)
+                                self.updated_since = max(self.updated_since,
+                                                         str(order.get(Config.ORDER_UPDATED_COLUMN) or ""))
+                        
+                        time.sleep(2)  # Polling toutes les 2 secondes
+                        
+                    except Exception as e:
+                        logger.error(f"❌ Erreur polling: {e}")
+                        time.sleep(5)
+            
+            def close(self):
+                pass
+        
+        return PollingChannel(self, callback, on_update, capacity, updated_since)
+
+
+class ClaimRenewer:
+    """Prolonge les baux des commandes réservées tant qu'elles sont en cours.
+
+    Une commande peut attendre plus que CLAIM_LEASE_SECONDS (file chargée,
+    fenêtre RUSH, nouvelles tentatives): sans prolongation, un autre agent la
+    reprendrait (get_expired_claims) et l'imprimerait une seconde fois.
+    """
+    
+    def __init__(self, supabase, order_ids: Callable[[], List],
+                 interval: float = max(Config.CLAIM_LEASE_SECONDS / 3, 1)):
+        self.supabase = supabase
+        self.order_ids = order_ids
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="claim-renewer", daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            order_ids = self.order_ids()
+            if order_ids:
+                self.supabase.renew_claims(order_ids)
+    
+    def stop(self):
+        self.stopped.set()
+
+
+# ============================================================================
+# ENREGISTREMENT ET REJEU DU FLUX DE COMMANDES
+# ============================================================================
+
+class OrderRecorder:
+    """Enregistre les commandes reçues, une ligne JSON horodatée par commande"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+        logger.info(f"⏺️ Enregistrement des commandes reçues dans {path}")
+    
+    def record(self, order: Dict, source: str):
+        line = json.dumps({"t": round(time.time(), 3), "source": source, "order": order},
+                          ensure_ascii=False, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+    
+    def close(self):
+        with self.lock:
+            self.file.close()
+    
+    @staticmethod
+    def read(path: str) -> Iterator[Dict]:
+        """Relit un enregistrement ligne par ligne (lignes invalides ignorées)"""
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"⚠️ Ligne {number} illisible dans {path}")
+                    continue
+                if isinstance(record, dict) and isinstance(record.get("order"), dict):
+                    yield record
+
+
+class ReplayStore:
+    """Remplace SupabaseManager pendant un rejeu: aucune écriture distante,
+    mesure la latence entre la réception d'une commande et son acquittement."""
+    
+    def __init__(self):
+        self.received: Dict = {}
+        self.latencies: List[float] = []
+        self.failed = 0
+        self.lock = threading.Lock()
+    
+    def claim_order(self, order: Dict) -> bool:
+        with self.lock:
+            self.received[order.get("id")] = time.monotonic()
+        return True
+    
+    def mark_as_printed(self, order_id) -> bool:
+        with self.lock:
+            started = self.received.pop(order_id, None)
+            if started is not None:
+                self.latencies.append(time.monotonic() - started)
+        return True
+    
+    def renew_claims(self, order_ids) -> bool:
+        return True
+    
+    def release_order(self, order_id) -> bool:
+        with self.lock:
+            self.received.pop(order_id, None)
+            self.failed += 1
+        return True
+    
+    def get_pending_orders(self) -> List[Dict]:
+        return []
+
+
+class OrderReplayer:
+    """Rejoue un enregistrement dans PrinterAgent.process_order.
+
+    speed=1: rythme réel; speed=10: dix fois plus vite; speed=0: au plus vite.
+    Une commande déjà rejouée (même id, ex: enregistrement antérieur à la
+    déduplication à la source) n'est pas soumise une seconde fois. Les
+    commandes modifiées ou annulées (source "update") passent par
+    PrinterAgent.process_order_update, comme en production.
+    """
+    
+    def __init__(self, agent: "PrinterAgent", store: ReplayStore, speed: float = 1.0):
+        self.agent = agent
+        self.store = store
+        self.speed = speed
+    
+    def run(self, path: str) -> Dict:
+        """Rejoue le fichier, attend la fin des impressions et retourne les mesures"""
+        start = time.monotonic()
+        first = None
+        count = 0
+        duplicates = 0
+        updates = 0
+        replayed = set()
+        for record in OrderRecorder.read(path):
+            order_id = record["order"].get("id")
+            update = record.get("source") == "update"
+            if not update and order_id is not None and order_id in replayed:
+                duplicates += 1
+                continue
+            if first is None:
+                first = record.get("t", 0)
+            if self.speed > 0:
+                delay = (record.get("t", first) - first) / self.speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if update:
+                self.agent.process_order_update(record["order"])
+                updates += 1
+                continue
+            if order_id is not None:
+                replayed.add(order_id)
+            self.agent.process_order(record["order"])
+            count += 1
+        submitted = time.monotonic() - start
+        # Attend que chaque commande et chaque ticket modificatif soit terminé avant l'arrêt
+        while self.store.received or self.agent.in_flight:
+            time.sleep(0.1)
+        self.agent.shutdown()
+        elapsed = time.monotonic() - start
+        latencies = sorted(self.store.latencies)
+        percentile = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3) if latencies else None
+        return {
+            "orders": count,
+            "updates": updates,
+            "duplicates": duplicates,
+            "printed": len(latencies),
+            "failed": self.store.failed,
+            "submit_seconds": round(submitted, 2),
+            "total_seconds": round(elapsed, 2),
+            "orders_per_minute": round(count / elapsed * 60, 1) if elapsed else None,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "latency_max": round(latencies[-1], 3) if latencies else None,
+        }
+
+
+# ============================================================================
+# MODE RUSH (TICKETS CUISINE GROUPÉS)
+# ============================================================================
+
+class RushBatcher:
+    """Regroupe les tickets cuisine des commandes arrivées dans une même fenêtre.
+
+    La première commande ouvre une fenêtre de Config.RUSH_WINDOW secondes;
+    à son expiration (ou dès Config.RUSH_MAX_ORDERS commandes) un seul ticket
+    de préparation groupé est envoyé à la file cuisine, puis le suivi de
+    chaque commande du lot est notifié.
+    """
+
+    def __init__(self, dispatcher: PrintDispatcher,
+                 window: float = Config.RUSH_WINDOW, max_orders: int = Config.RUSH_MAX_ORDERS):
+        self.dispatcher = dispatcher
+        self.window = window
+        self.max_orders = max_orders
+        self.pending: List = []  # (commande, callback de fin du ticket cuisine)
+        self.timer: Optional[threading.Timer] = None
+        self.lock = threading.Lock()
+
+    def add(self, order: Dict, on_done: Callable[[bool], None]):
+        """Ajoute une commande au lot en cours (on_done(succès) une fois le ticket imprimé)"""
+        with self.lock:
+            self.pending.append((order, on_done))
+            count = len(self.pending)
+            full = count >= self.max_orders
+            if not full and self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        logger.info(f"⏱️ [RUSH] Commande #{order.get('order_number', 'N/A')} ajoutée au lot ({count})")
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Envoie le lot en cours (ticket groupé, ou ticket normal si une seule commande)"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not batch:
+            return
+        orders = [order for order, _ in batch]
+        callbacks = [callback for _, callback in batch]
+
+        def on_done(success: bool):
+            for callback in callbacks:
+                callback(success)
+
+        if len(orders) == 1:
+            commands = lambda p: TicketGenerator.print_kitchen_ticket(p, orders[0])
+        else:
+            logger.info(f"🔥 [RUSH] Ticket cuisine groupé pour {len(orders)} commandes")
+            commands = lambda p: TicketGenerator.print_kitchen_rush_ticket(p, orders)
+        priority = min(OrderPriority.deadline(order) for order in orders)
+        self.dispatcher.submit(PrintJob(commands, on_done, label=f"rush ({len(orders)} commandes)",
+                                        priority=priority,
+                                        order_numbers=[order.get('order_number') for order in orders]))
+
+
+# ============================================================================
+# ADMINISTRATION LOCALE (HTTP)
+# ============================================================================
+
+def require_token_off_loopback(service: str, host: str, token: str, setting: str):
+    """Refuse d'exposer un service sur le réseau sans jeton (PermissionError)"""
+    if host == "localhost" or host == "::1" or host.startswith("127.") or token:
+        return
+    raise PermissionError(f"{service}: écoute sur {host or '0.0.0.0'} refusée sans {setting} "
+                          f"(définir {setting}, ou écouter sur 127.0.0.1)")
+
+
+class AdminServer:
+    """API HTTP locale: état des files, pause/reprise, réimpression instantanée.
+
+    GET  /status                          files de chaque poste
+    GET  /history/<poste>                 derniers tickets imprimés
+    POST /pause/<poste>, /resume/<poste>
+    POST /reprint/<poste>/<n>[?to=<poste>]
+    """
+    
+    NAME = "API d'administration"
+    TOKEN_SETTING = "ADMIN_TOKEN"
+    
+    def __init__(self, agent: "PrinterAgent", host: str = Config.ADMIN_HOST, port: int = Config.ADMIN_PORT,
+                 token: str = Config.ADMIN_TOKEN):
+        require_token_off_loopback(self.NAME, host, token, self.TOKEN_SETTING)
+        self.agent = agent
+        self.token = token
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"http-{port}", daemon=True)
+        self.thread.start()
+        logger.info(f"🛠️ {self.NAME} sur http://{host}:{self.httpd.server_port}")
+    
+    def handle(self, method: str, parts: List[str], query: Dict, body) -> tuple:
+        """Traite une requête; retourne (code HTTP, corps JSON)"""
+        return self.agent.admin_command(method, parts, query)
+    
+    def _handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code: int, body):
+                data = json.dumps(body, ensure_ascii=False, indent=2).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def _route(self, method: str):
+                if server.token and self.headers.get("X-Admin-Token") != server.token:
+                    return self._reply(403, {"error": "jeton invalide"})
+                url = urllib.parse.urlparse(self.path)
+                parts = [part for part in url.path.split("/") if part]
+                query = urllib.parse.parse_qs(url.query)
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    body = json.loads(self.rfile.read(length).decode("utf-8")) if length else None
+                except (ValueError, UnicodeDecodeError) as e:
+                    return self._reply(400, {"error": f"JSON invalide: {e}"})
+                try:
+                    code, result = server.handle(method, parts, query, body)
+                except Exception as e:
+                    logger.error(f"❌ Erreur {server.NAME} ({self.path}): {e}")
+                    code, result = 500, {"error": str(e)}
+                self._reply(code, result)
+            
+            def do_GET(self):
+                self._route("GET")
+            
+            def do_POST(self):
+                self._route("POST")
+            
+            def log_message(self, format, *args):
+                logger.debug(f"🛠️ {self.address_string()} {format % args}")
+        
+        return Handler
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ============================================================================
+# RÉCEPTION LOCALE DES COMMANDES (CAISSE SUR LE RÉSEAU LOCAL)
+# ============================================================================
+
+class IngestServer(AdminServer):
+    """Réception directe des commandes de la caisse du restaurant.
+
+    POST /orders (JSON d'une commande, même format que la table orders):
+    impression immédiate, sans attendre l'aller-retour Supabase + polling.
+    """
+    
+    NAME = "Réception locale des commandes"
+    TOKEN_SETTING = "INGEST_TOKEN"
+    
+    def __init__(self, agent: "PrinterAgent", host: str = Config.INGEST_HOST, port: int = Config.INGEST_PORT,
+                 token: str = Config.INGEST_TOKEN):
+        super().__init__(agent, host, port, token)
+    
+    def handle(self, method: str, parts: List[str], query: Dict, body) -> tuple:
+        if method == "POST" and parts == ["orders"]:
+            return self.agent.ingest_order(body)
+        if method == "GET" and parts == ["orders"]:
+            return 200, self.agent.outbox.list()
+        return 404, {"error": f"commande inconnue: {method} /{'/'.join(parts)}"}
+
+
+class LocalOrderOutbox:
+    """Commandes reçues en local, en attente de synchronisation vers Supabase.
+
+    Persistée en SQLite (survit à un redémarrage sans internet). Le numéro de
+    commande sert de clé: une commande reçue deux fois n'est imprimée qu'une
+    fois, et le polling ignore une commande déjà imprimée en local.
+    États: printing → printed | failed, puis synced_at une fois envoyée.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            order_number TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            received_at REAL NOT NULL,
+            state TEXT NOT NULL,
+            synced_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_sync ON outbox(synced_at, state);
+    """
+    KEEP_SYNCED_DAYS = 2  # fenêtre de dédoublonnage après synchronisation
+    
+    def __init__(self, path: str = Config.INGEST_OUTBOX):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self.SCHEMA)
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+    
+    def add(self, order: Dict) -> bool:
+        """Enregistre une commande reçue; False si ce numéro est déjà connu"""
+        try:
+            with self.lock, self.db:
+                self.db.execute(
+                    "INSERT INTO outbox (order_number, data, received_at, state) VALUES (?, ?, ?, 'printing')",
+                    (str(order["order_number"]), json.dumps(order, ensure_ascii=False, default=str), time.time())
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+    
+    def state(self, order_number) -> Optional[str]:
+        """État local d'une commande (None si jamais reçue en local)"""
+        with self.lock:
+            row = self.db.execute("SELECT state FROM outbox WHERE order_number = ?", (str(order_number),)).fetchone()
+        return row[0] if row else None
+    
+    def mark_result(self, order_number, success: bool):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbox SET state = ? WHERE order_number = ?",
+                            ("printed" if success else "failed", str(order_number)))
+    
+    def list(self) -> List[Dict]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT order_number, received_at, state, synced_at FROM outbox ORDER BY received_at DESC LIMIT 100"
+            ).fetchall()
+        return [{"order_number": row[0], "state": row[2], "synced": row[3] is not None,
+                 "received_at": datetime.fromtimestamp(row[1]).strftime("%d/%m/%Y %H:%M:%S")} for row in rows]
+    
+    def sync(self, supabase: "SupabaseManager") -> int:
+        """Envoie à Supabase les commandes dont l'impression locale est terminée"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT order_number, data, state FROM outbox "
+                "WHERE synced_at IS NULL AND state != 'printing' ORDER BY received_at"
+            ).fetchall()
+        synced = 0
+        for order_number, data, state in rows:
+            if not supabase.sync_local_order(json.loads(data), printed=(state == "printed")):
+                break  # Supabase injoignable: nouvel essai au prochain passage
+            with self.lock, self.db:
+                self.db.execute("UPDATE outbox SET synced_at = ? WHERE order_number = ?", (time.time(), order_number))
+            synced += 1
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM outbox WHERE synced_at < ?", (time.time() - self.KEEP_SYNCED_DAYS * 86400,))
+        if synced:
+            logger.info(f"☁️ {synced} commande(s) locale(s) synchronisée(s) avec Supabase")
+        if len(rows) > synced:
+            logger.warning(f"⚠️ {len(rows) - synced} commande(s) locale(s) en attente de synchronisation")
+        return synced
+    
+    def start_sync(self, supabase: "SupabaseManager", interval: float = Config.INGEST_SYNC_INTERVAL):
+        """Synchronise en tâche de fond toutes les `interval` secondes"""
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    self.sync(supabase)
+                except Exception as e:
+                    logger.error(f"❌ Erreur synchronisation des commandes locales: {e}")
+        self.thread = threading.Thread(target=run, name="outbox-sync", daemon=True)
+        self.thread.start()
+    
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            self.db.close()
 
 
 # ============================================================================
-# GESTIONNAIRE SUPABASE
+# SORTIES COMPLÉMENTAIRES (ÉCRAN CUISINE)
 # ============================================================================
 
-class SupabaseManager:
-    """Gère la connexion et les interactions avec Supabase"""
+class OrderSink(abc.ABC):
+    """
+    Sortie complémentaire aux imprimantes (écran cuisine, webhook...): reçoit
+    chaque commande sous forme structurée, indépendamment du rendu ESC/POS.
+    Une nouvelle sortie est une sous-classe enregistrée avec
+    @OrderSink.register("nom") puis activée par ORDER_SINKS=nom.
     
-    def __init__(self):
-        if not SUPABASE_AVAILABLE:
-            if Config.PRINTER_MODE == 'mock':
-                logger.warning("⚠️ Supabase non installé. Mode mock actif: les événements Realtime ne fonctionneront pas. Installe avec 'pip install -r requirements.txt'.")
-            else:
-                logger.error("❌ Supabase non installé. Exécute 'pip install -r requirements.txt'.")
-                raise RuntimeError("Supabase library missing")
+    Événements: new (commande reçue, avant impression), printed, print_failed,
+    modified et cancelled (commande déjà imprimée, voir ORDER_UPDATES)
+    """
+    
+    TYPES: Dict[str, type] = {}
+    
+    @classmethod
+    def register(cls, name: str):
+        def decorator(sink_class: type) -> type:
+            cls.TYPES[name] = sink_class
+            return sink_class
+        return decorator
+    
+    @classmethod
+    def create(cls, name: str) -> "OrderSink":
+        if name not in cls.TYPES:
+            raise ValueError(f"sortie inconnue: {name} (connues: {', '.join(sorted(cls.TYPES))})")
+        return cls.TYPES[name]()
+    
+    @staticmethod
+    def event(event: str, order: Dict) -> Dict:
+        """Événement structuré (champs utiles en cuisine, sans prix)"""
+        return {
+            "event": event,
+            "at": datetime.now(timezone.utc).isoformat(),
+            "order": {
+                "id": order.get("id"),
+                "order_number": order.get("order_number"),
+                "customer_name": order.get("customer_name"),
+                "order_type": order.get("order_type"),
+                "pickup_time": order.get("pickup_time"),
+                "payment_status": order.get("payment_status"),
+                "items": [{"name": item.get("name", "Produit"), "quantity": item.get("quantity", 1),
+                           "options": item.get("options") or [], "comment": item.get("comment")}
+                          for item in order.get("items") or []],
+            },
+        }
+    
+    @abc.abstractmethod
+    def publish(self, event: str, order: Dict):
+        """Transmet un événement (appelé depuis les threads d'impression: ne doit pas bloquer)"""
+    
+    def close(self):
+        pass
+
+
+KDS_PAGE = """<!doctype html>
+<html lang="fr"><head><meta charset="utf-8"><title>MITAKE - Cuisine</title>
+<style>
+body{margin:0;background:#111;color:#eee;font-family:sans-serif;display:flex;flex-wrap:wrap;align-items:flex-start}
+.o{background:#222;margin:8px;padding:12px;width:280px;border-top:8px solid #3a3;cursor:pointer}
+.o.print_failed{border-color:#d33}h2{margin:0}small{color:#aaa}ul{padding-left:0;list-style:none}
+li{font-size:1.4em;margin:6px 0}.opt{color:#fc0;font-size:.7em}.note{background:#eee;color:#111;font-size:.7em}
+</style></head><body><script>
+const esc = s => String(s ?? "").replace(/[&<>"]/g, c => ({"&":"&amp;","<":"&lt;",">":"&gt;",'"':"&quot;"})[c]);
+function show(m) {
+  const o = m.order, id = "o-" + o.order_number;
+  let card = document.getElementById(id);
+  if (m.event == "cancelled") return card && card.remove();
+  if (!card) {
+    card = document.createElement("div");
+    card.id = id;
+    card.onclick = () => card.remove();  // commande servie
+    document.body.appendChild(card);
+  }
+  card.className = "o " + m.event;
+  card.innerHTML = `<h2>N° ${esc(o.order_number)}</h2><small>${esc(o.customer_name)} ${esc(o.order_type)}
+    ${new Date(m.at).toLocaleTimeString().slice(0, 5)}</small><ul>` + o.items.map(i =>
+    `<li>${esc(i.quantity)}x ${esc(i.name)}${i.options.map(x => `<div class="opt">&gt;&gt; ${esc(x)}</div>`).join("")}
+    ${i.comment ? `<div class="note">${esc(i.comment)}</div>` : ""}</li>`).join("") + "</ul>";
+}
+function connect() {
+  const ws = new WebSocket((location.protocol == "https:" ? "wss://" : "ws://") + location.host + "/ws" + location.search);
+  ws.onmessage = e => show(JSON.parse(e.data));
+  ws.onclose = () => setTimeout(connect, 2000);
+}
+connect();
+</script></body></html>
+"""
+
+
+@OrderSink.register("kds")
+class KdsSink(OrderSink):
+    """Écran cuisine (KDS): événements JSON poussés en websocket.
+    
+    GET /     page d'affichage minimale (un clic retire une commande servie)
+    GET /ws   flux websocket des événements (?token=... si KDS_TOKEN)
+    
+    Une commande s'affiche dès sa réception, sans attendre l'impression; les
+    KDS_BACKLOG dernières commandes sont renvoyées à un écran qui se (re)connecte.
+    """
+    
+    WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+    
+    def __init__(self, host: str = Config.KDS_HOST, port: int = Config.KDS_PORT,
+                 token: str = Config.KDS_TOKEN, backlog: int = Config.KDS_BACKLOG):
+        # Noms des clients diffusés: pas d'écoute réseau sans jeton
+        require_token_off_loopback("Écran cuisine", host, token, "KDS_TOKEN")
+        self.token = token
+        self.backlog = backlog
+        self.recent = collections.OrderedDict()  # numéro de commande → dernier message
+        self.clients = set()
+        self.lock = threading.Lock()       # recent
+        self.send_lock = threading.Lock()  # clients et écritures (trames jamais entrelacées)
+        self.outgoing = queue.Queue()
+        self.closed = False
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"kds-{port}", daemon=True)
+        self.thread.start()
+        self.sender = threading.Thread(target=self._broadcast, name="kds-broadcast", daemon=True)
+        self.sender.start()
+        logger.info(f"🖥️ Écran cuisine sur http://{host}:{self.httpd.server_port}")
+    
+    def publish(self, event: str, order: Dict):
+        """Non bloquant: l'envoi aux écrans se fait dans le thread kds-broadcast"""
+        message = json.dumps(self.event(event, order), ensure_ascii=False).encode("utf-8")
+        with self.lock:
+            self.recent.pop(order.get("order_number"), None)
+            if event != "cancelled":
+                self.recent[order.get("order_number")] = message
+            while len(self.recent) > self.backlog:
+                self.recent.popitem(last=False)
+        self.outgoing.put(message)
+    
+    def _broadcast(self):
+        while True:
+            message = self.outgoing.get()
+            if message is None:
+                return
+            frame = self._frame(message)
+            with self.send_lock:
+                for client in list(self.clients):
+                    try:
+                        client.sendall(frame)
+                    except OSError as e:
+                        # Écran lent ou parti: déconnecté (il recevra l'historique en revenant)
+                        logger.warning(f"⚠️ Écran cuisine déconnecté: {e}")
+                        self.clients.discard(client)
+                        self._shutdown(client)
+    
+    @staticmethod
+    def _frame(data: bytes, opcode: int = 0x1) -> bytes:
+        """Trame websocket serveur → client (non masquée, non fragmentée)"""
+        length = len(data)
+        if length < 126:
+            header = bytes([0x80 | opcode, length])
+        elif length < 65536:
+            header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
         else:
-            self.client: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
-            logger.info("✅ Connexion à Supabase établie")
+            header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+        return header + data
     
-    def get_pending_orders(self) -> List[Dict]:
-        """Récupère les commandes en attente d'impression"""
-        if not SUPABASE_AVAILABLE:
-            # Mode dégradé: retourne une commande factice pour test manuel
-            logger.info("🧪 [MOCK] Génération d'une commande factice locale (Supabase absent)")
-            return [{
-                "id": random.randint(1000, 9999),
-                "order_number": f"LOCAL-{int(time.time())}",
-                "customer_name": "Client Local",
-                "payment_status": "paid",
-                "items": [
-                    {"name": "Ramen Shoyu", "quantity": 1, "price": 11.5, "options": ["Extra œuf"], "comment": "Moins salé"},
-                    {"name": "Gyoza", "quantity": 2, "price": 6.0, "options": [], "comment": None}
-                ],
-                "status": Config.STATUS_PENDING
-            }]
+    @staticmethod
+    def _shutdown(client: socket.socket):
         try:
-            response = self.client.table(Config.TABLE_NAME)\
-                .select("*")\
-                .eq("status", Config.STATUS_PENDING)\
-                .execute()
-            return response.data
-        except Exception as e:
-            logger.error(f"❌ Erreur récupération commandes: {e}")
-            return []
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
     
-    def mark_as_printed(self, order_id: int) -> bool:
-        """Marque une commande comme imprimée"""
-        if not SUPABASE_AVAILABLE:
-            logger.info(f"🧪 [MOCK] Commande {order_id} marquée comme imprimée (local)")
-            return True
+    def _recv(self, client: socket.socket, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            if self.closed:
+                raise ConnectionError("écran cuisine arrêté")
+            try:
+                chunk = client.recv(size - len(data))
+            except socket.timeout:
+                continue  # délai d'envoi, pas d'inactivité: on continue d'attendre
+            if not chunk:
+                raise ConnectionError("connexion fermée")
+            data += chunk
+        return data
+    
+    def _serve_client(self, handler: BaseHTTPRequestHandler):
+        """Poignée de main websocket, historique récent, puis lecture des trames de contrôle"""
+        key = handler.headers.get("Sec-WebSocket-Key")
+        if not key:
+            return handler.send_error(400, "Sec-WebSocket-Key manquant")
+        accept = base64.b64encode(hashlib.sha1((key + self.WS_GUID).encode("ascii")).digest()).decode("ascii")
+        handler.send_response(101, "Switching Protocols")
+        handler.send_header("Upgrade", "websocket")
+        handler.send_header("Connection", "Upgrade")
+        handler.send_header("Sec-WebSocket-Accept", accept)
+        handler.end_headers()
+        handler.close_connection = True
+        client = handler.connection
+        client.settimeout(Config.KDS_SEND_TIMEOUT)
+        with self.send_lock:
+            with self.lock:
+                history = list(self.recent.values())
+            try:
+                for message in history:
+                    client.sendall(self._frame(message))
+            except OSError:
+                return
+            self.clients.add(client)
+        logger.info(f"🖥️ Écran cuisine connecté ({handler.address_string()}, {len(history)} commande(s) renvoyée(s))")
         try:
-            # Mise à jour du statut uniquement (colonne printed_at optionnelle)
-            self.client.table(Config.TABLE_NAME)\
-                .update({"status": Config.STATUS_PRINTED})\
-                .eq("id", order_id)\
-                .execute()
-            logger.info(f"✅ Commande {order_id} marquée comme imprimée")
-            return True
-        except Exception as e:
-            logger.error(f"❌ Erreur mise à jour statut: {e}")
-            return False
+            while True:
+                header = self._recv(client, 2)
+                length = header[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(self._recv(client, 2), "big")
+                elif length == 127:
+                    length = int.from_bytes(self._recv(client, 8), "big")
+                if length > 65536:
+                    break  # les écrans n'envoient que des trames de contrôle
+                mask = self._recv(client, 4) if header[1] & 0x80 else b""
+                payload = self._recv(client, length) if length else b""
+                if mask:
+                    payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+                opcode = header[0] & 0x0F
+                if opcode == 0x8:  # fermeture
+                    with self.send_lock:
+                        client.sendall(self._frame(payload[:2], 0x8))
+                    break
+                if opcode == 0x9:  # ping → pong
+                    with self.send_lock:
+                        client.sendall(self._frame(payload, 0xA))
+        except OSError:
+            pass
+        finally:
+            with self.send_lock:
+                self.clients.discard(client)
+            logger.info(f"🖥️ Écran cuisine déconnecté ({handler.address_string()})")
     
-    def subscribe_to_new_orders(self, callback):
-        """
-        S'abonne aux nouvelles commandes (polling simple sans WebSocket)
-        Args:
-            callback: Fonction appelée lors d'une nouvelle insertion
-        """
-        if not SUPABASE_AVAILABLE:
-            logger.error("❌ Supabase non installé. Impossible de s'abonner aux commandes. Installe: pip install -r requirements.txt")
-            logger.info("⏳ En attente de commandes... (Aucune ne sera traitée sans Supabase)")
-            return None
-        
-        # Polling simple : vérifie les commandes toutes les 2 secondes
-        last_check = time.time()
+    def _handler(self):
+        sink = self
         
-        class PollingChannel:
-            def __init__(self, manager, cb):
-                self.manager = manager
-                self.cb = cb
-                self.last_id = None
-                
-            def run_forever(self):
-                logger.info(f"🔔 Écoute activée sur '{Config.TABLE_NAME}' (polling)")
-                while True:
-                    try:
-                        response = self.manager.client.table(Config.TABLE_NAME)\
-                            .select("*")\
-                            .eq("status", Config.STATUS_PENDING)\
-                            .execute()
-                        
-                        for order in response.data:
-                            if self.last_id is None or order.get('id') > self.last_id:
-                                if order.get('status') == Config.STATUS_PENDING:
-                                    logger.info(f"📩 Nouvelle commande détectée: {order.get('order_number')}")
-                                    self.cb(order)
-                                    self.last_id = order.get('id')
-                        
-                        time.sleep(2)  # Polling toutes les 2 secondes
-                        
-                    except Exception as e:
-                        logger.error(f"❌ Erreur polling: {e}")
-                        time.sleep(5)
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # exigé par les navigateurs pour la réponse 101
             
-            def close(self):
-                pass
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                if sink.token and urllib.parse.parse_qs(url.query).get("token", [""])[0] != sink.token:
+                    return self.send_error(403, "jeton invalide")
+                if url.path == "/ws" and self.headers.get("Upgrade", "").lower() == "websocket":
+                    return sink._serve_client(self)
+                if url.path != "/":
+                    return self.send_error(404)
+                data = KDS_PAGE.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def log_message(self, format, *args):
+                logger.debug(f"🖥️ {self.address_string()} {format % args}")
         
-        return PollingChannel(self, callback)
+        return Handler
+    
+    def close(self):
+        self.closed = True
+        self.outgoing.put(None)
+        self.sender.join(timeout=Config.KDS_SEND_TIMEOUT + 1)
+        with self.send_lock:
+            for client in self.clients:
+                try:
+                    client.sendall(self._frame(b"", 0x8))
+                except OSError:
+                    pass
+                self._shutdown(client)
+            self.clients.clear()
+        self.httpd.shutdown()
+        self.httpd.server_close()
 
 
 # ============================================================================
@@ -755,10 +3580,73 @@ class SupabaseManager:
 class PrinterAgent:
     """Orchestrateur principal du système d'impression"""
     
-    def __init__(self):
-        self.supabase = SupabaseManager()
+    PARTIAL_ORDERS_MAX = 500  # commandes en échec partiel gardées en mémoire
+    
+    def __init__(self, supabase=None):
+        self.supabase = supabase or SupabaseManager()
         self.cashier_printer = PrinterManager(Config.PRINTER_CASHIER)
         self.kitchen_printer = PrinterManager(Config.PRINTER_KITCHEN)
+        self.printers = {"cashier": self.cashier_printer, "kitchen": self.kitchen_printer}
+        if Config.KITCHEN_BACKUP_ENABLED:
+            self.printers["kitchen_backup"] = PrinterManager(Config.PRINTER_KITCHEN_BACKUP)
+        self.archive = None
+        if Config.ARCHIVE_PATH:
+            try:
+                self.archive = TicketArchive()
+            except sqlite3.Error as e:
+                logger.error(f"❌ Archive des tickets indisponible ({Config.ARCHIVE_PATH}): {e}")
+        self.queues = {station: PrintDispatcher(manager, station, self.archive)
+                       for station, manager in self.printers.items()}
+        self.cashier_queue = self.queues["cashier"]
+        self.kitchen_queue = self.queues["kitchen"]
+        if Config.KITCHEN_LOAD_BALANCE and "kitchen_backup" in self.queues:
+            self.kitchen_queue = PrinterPool([self.queues["kitchen"], self.queues["kitchen_backup"]])
+            logger.info("⚖️ Tickets cuisine répartis entre les deux imprimantes cuisine")
+        # Chaînes de basculement (postes inconnus ou non configurés ignorés)
+        for station, chain in Config.FAILOVER.items():
+            if station not in self.queues:
+                continue
+            self.queues[station].failover = [self.queues[st] for st in chain if st in self.queues and st != station]
+            if self.queues[station].failover:
+                logger.info(f"🔀 Basculement {station}: {' → '.join(d.station for d in self.queues[station].failover)}")
+        self.watchdog = PrintWatchdog(list(self.queues.values()))
+        self.rush = RushBatcher(self.kitchen_queue) if Config.RUSH_MODE else None
+        # Commandes en cours d'impression (évite une double prise par le polling)
+        self.in_flight = set()
+        # Modifications reçues pendant l'impression de la commande: traitées ensuite
+        self.pending_updates: Dict = {}
+        # Échecs partiels: postes déjà imprimés par numéro de commande (pas de doublon à la reprise)
+        self.printed_stations: collections.OrderedDict = collections.OrderedDict()
+        self.in_flight_lock = threading.Lock()
+        # Plusieurs agents: baux prolongés tant que la commande n'est pas terminée
+        self.claims = ClaimRenewer(self.supabase, self._claimed_ids) if Config.CLAIM_ORDERS else None
+        if self.rush:
+            logger.info(f"🔥 Mode RUSH actif (fenêtre {Config.RUSH_WINDOW:.0f}s, max {Config.RUSH_MAX_ORDERS} commandes)")
+        self.outbox = None
+        self.ingest = None
+        if Config.INGEST_PORT:
+            try:
+                self.outbox = LocalOrderOutbox()
+                self.ingest = IngestServer(self)
+                self.outbox.start_sync(self.supabase)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"❌ Réception locale des commandes indisponible (port {Config.INGEST_PORT}): {e}")
+                self.outbox = None
+        if Config.ORDER_UPDATES and not self.archive:
+            logger.warning("⚠️ ORDER_UPDATES sans archive (ARCHIVE_PATH): tickets modificatifs désactivés")
+        # Sorties complémentaires (écran cuisine...): mêmes commandes, sans délai d'impression
+        self.sinks: List[OrderSink] = []
+        for name in Config.ORDER_SINKS:
+            try:
+                self.sinks.append(OrderSink.create(name))
+            except (ValueError, TypeError, OSError) as e:
+                logger.error(f"❌ Sortie {name} indisponible: {e}")
+        self.admin = None
+        if Config.ADMIN_PORT:
+            try:
+                self.admin = AdminServer(self)
+            except OSError as e:
+                logger.error(f"❌ API d'administration indisponible (port {Config.ADMIN_PORT}): {e}")
         logger.info("🚀 PrinterAgent initialisé")
     
     def process_order(self, order: Dict):
@@ -770,24 +3658,231 @@ class PrinterAgent:
         order_id = order.get('id')
         order_number = order.get('order_number', 'N/A')
         
+        # Commande déjà reçue directement de la caisse: pas de double impression
+        local_state = self.outbox.state(order_number) if self.outbox else None
+        if local_state in ("printing", "printed"):
+            logger.info(f"🔁 Commande #{order_number} déjà reçue en local ({local_state}): ignorée")
+            if local_state == "printed" and order_id is not None:
+                self.supabase.mark_as_printed(order_id)
+            return
+        
+        with self.in_flight_lock:
+            if order_id in self.in_flight:
+                logger.info(f"⏭️ Commande #{order_number} déjà en cours d'impression")
+                return
+            self.in_flight.add(order_id)
+        
+        # Plusieurs agents: seul celui qui réserve la commande l'imprime
+        if not self.supabase.claim_order(order):
+            logger.info(f"⏭️ Commande #{order_number} réservée par un autre agent")
+            with self.in_flight_lock:
+                self.in_flight.discard(order_id)
+            return
+        
         logger.info(f"📄 Traitement commande #{order_number} (ID: {order_id})")
+        self._print_order(order, self._finalize_order)
+    
+    def _claimed_ids(self) -> List:
+        with self.in_flight_lock:
+            return [order_id for order_id in self.in_flight if order_id is not None]
+    
+    def _print_order(self, order: Dict, on_complete: Callable[[Dict, bool], None]):
+        """Envoie les tickets caisse et cuisine; on_complete(order, succès) une fois les deux terminés"""
+        order_number = order.get('order_number', 'N/A')
+        # Échec partiel précédent: seuls les postes qui n'ont pas imprimé sont relancés
+        with self.in_flight_lock:
+            already_printed = self.printed_stations.get(order_number, set())
+        stations = [station for station in ("cashier", "kitchen") if station not in already_printed]
+        if already_printed:
+            logger.info(f"🔁 Commande #{order_number}: déjà imprimée sur {', '.join(sorted(already_printed))}, "
+                        f"relance de {', '.join(stations)} uniquement")
+        else:
+            self._publish("new", order)
         
-        # Impression ticket CAISSE
-        cashier_success = self.cashier_printer.print_raw(
-            lambda p: TicketGenerator.print_cashier_ticket(p, order)
-        )
+        def completed(order: Dict, success: bool):
+            with self.in_flight_lock:
+                if success:
+                    self.printed_stations.pop(order_number, None)
+                else:
+                    self.printed_stations[order_number] = already_printed | tracker.printed
+                    self.printed_stations.move_to_end(order_number)
+                    while len(self.printed_stations) > self.PARTIAL_ORDERS_MAX:
+                        self.printed_stations.popitem(last=False)
+            self._publish("printed" if success else "print_failed", order)
+            on_complete(order, success)
         
-        # Impression ticket CUISINE
-        kitchen_success = self.kitchen_printer.print_raw(
-            lambda p: TicketGenerator.print_kitchen_ticket(p, order)
-        )
+        # Suivi par poste: statut mis à jour quand tous les tickets sont terminés
+        tracker = OrderTracker(order, stations, completed)
+        priority = OrderPriority.deadline(order)
+        
+        # Ticket CAISSE (file de l'imprimante caisse)
+        if "cashier" in stations:
+            self.cashier_queue.submit(PrintJob(
+                lambda p: TicketGenerator.print_cashier_ticket(p, order),
+                tracker.done("cashier"), label=f"caisse #{order_number}", priority=priority,
+                order_numbers=[order_number]
+            ))
         
-        # Mise à jour du statut si au moins une impression réussie
-        if cashier_success or kitchen_success:
-            self.supabase.mark_as_printed(order_id)
+        if "kitchen" not in stations:
+            return
+        
+        # Mode RUSH: le ticket CUISINE part dans le prochain ticket groupé
+        if self.rush:
+            self.rush.add(order, tracker.done("kitchen"))
+            return
+        
+        # Ticket CUISINE (file de l'imprimante cuisine)
+        self.kitchen_queue.submit(PrintJob(
+            lambda p: TicketGenerator.print_kitchen_ticket(p, order),
+            tracker.done("kitchen"), label=f"cuisine #{order_number}", priority=priority,
+            order_numbers=[order_number]
+        ))
+    
+    def _publish(self, event: str, order: Dict):
+        """Transmet un événement de commande aux sorties complémentaires"""
+        for sink in self.sinks:
+            try:
+                sink.publish(event, order)
+            except Exception as e:
+                logger.warning(f"⚠️ Sortie {type(sink).__name__}: événement {event} non transmis: {e}")
+    
+    def _finalize_order(self, order: Dict, success: bool):
+        """Met à jour le statut si chaque poste a imprimé son ticket"""
+        order_number = order.get('order_number', 'N/A')
+        if success:
+            if self.archive:
+                self.archive.remember_order(order)
+            self.supabase.mark_as_printed(order.get('id'))
             logger.info(f"✅ Commande #{order_number} traitée avec succès")
         else:
-            logger.error(f"❌ Échec total impression commande #{order_number}")
+            logger.error(f"❌ Échec impression commande #{order_number} (au moins un poste n'a rien imprimé)")
+            self.supabase.release_order(order.get('id'))
+        with self.in_flight_lock:
+            self.in_flight.discard(order.get('id'))
+            update = self.pending_updates.pop(order.get('id'), None)
+        if update is not None and success:
+            self.process_order_update(update)
+    
+    def process_order_update(self, order: Dict):
+        """
+        Commande déjà imprimée puis modifiée ou annulée: imprime uniquement les
+        changements (ajouts/retraits) en cuisine; une annulation va aussi en caisse.
+        La version imprimée de référence est celle gardée dans l'archive.
+        """
+        order_number = order.get('order_number', 'N/A')
+        with self.in_flight_lock:
+            if order.get('id') in self.in_flight:
+                self.pending_updates[order.get('id')] = order
+                logger.info(f"⏳ Commande #{order_number} modifiée pendant son impression: traitée ensuite")
+                return
+        printed = self.archive.printed_order(order_number) if self.archive else None
+        if printed is None or printed["cancelled"]:
+            return  # jamais imprimée par cet agent, ou annulation déjà imprimée
+        cancelled = order.get('status') == Config.STATUS_CANCELLED
+        # Annulation: tout ce qui avait été imprimé est retiré
+        added, removed = OrderDelta.diff(printed["order"].get('items'), [] if cancelled else order.get('items'))
+        if not cancelled and not added and not removed:
+            return  # simple changement de statut (ex: notre propre passage à printed)
+        with self.in_flight_lock:
+            if order.get('id') in self.in_flight:  # ticket modificatif précédent encore en cours
+                self.pending_updates[order.get('id')] = order
+                return
+            self.in_flight.add(order.get('id'))
+        self._publish("cancelled" if cancelled else "modified", order)
+        
+        stations = [("caisse", self.cashier_queue), ("cuisine", self.kitchen_queue)] if cancelled \
+            else [("cuisine", self.kitchen_queue)]
+        kind = "annulation" if cancelled else "modification"
+        logger.info(f"✏️ Commande #{order_number}: {kind} (+{len(added)} / -{len(removed)} produit(s))")
+        tracker = OrderTracker(order, [label for label, _ in stations], self._finalize_update)
+        for label, target in stations:
+            # Priorité maximale: la cuisine doit savoir avant de continuer la préparation
+            target.submit(PrintJob(
+                lambda p: TicketGenerator.print_delta_ticket(p, order, added, removed, cancelled),
+                tracker.done(label), label=f"{kind} {label} #{order_number}", priority=0,
+                order_numbers=[order_number]
+            ))
+    
+    def _finalize_update(self, order: Dict, success: bool):
+        """La nouvelle version devient la référence seulement si le ticket modificatif est sorti"""
+        if success:
+            self.archive.remember_order(order, order.get('status') == Config.STATUS_CANCELLED)
+        else:
+            logger.error(f"❌ Ticket modificatif #{order.get('order_number', 'N/A')} non imprimé sur au moins un poste "
+                         f"(version de référence inchangée: le changement sera repris à la prochaine modification)")
+        with self.in_flight_lock:
+            self.in_flight.discard(order.get('id'))
+            update = self.pending_updates.pop(order.get('id'), None)
+        if update is not None:
+            self.process_order_update(update)
+    
+    def ingest_order(self, order) -> tuple:
+        """
+        Commande reçue directement de la caisse (réseau local): impression
+        immédiate puis synchronisation différée vers Supabase
+        Returns: (code HTTP, corps JSON)
+        """
+        if not isinstance(order, dict) or not order.get("order_number") or not isinstance(order.get("items"), list):
+            return 400, {"error": "commande invalide: order_number et items requis"}
+        order_number = order["order_number"]
+        if not self.outbox.add(order):
+            logger.info(f"⏭️ Commande locale #{order_number} déjà reçue")
+            return 200, {"order_number": order_number, "state": self.outbox.state(order_number)}
+        logger.info(f"📥 Commande #{order_number} reçue en local")
+        self._print_order(order, self._finalize_local_order)
+        return 202, {"order_number": order_number, "state": "printing"}
+    
+    def _finalize_local_order(self, order: Dict, success: bool):
+        """Enregistre le résultat d'une commande locale (synchronisée ensuite)"""
+        order_number = order.get('order_number', 'N/A')
+        self.outbox.mark_result(order_number, success)
+        if success and self.archive:
+            self.archive.remember_order(order)
+        if success:
+            logger.info(f"✅ Commande locale #{order_number} imprimée")
+        else:
+            logger.error(f"❌ Échec impression commande locale #{order_number} (renvoyée en attente à la synchronisation)")
+    
+    def admin_command(self, method: str, parts: List[str], query: Dict) -> tuple:
+        """
+        Exécute une commande de l'API d'administration
+        Returns: (code HTTP, corps JSON)
+        """
+        action = parts[0] if parts else ""
+        if method == "GET" and action == "archive" and len(parts) > 1:
+            if not self.archive:
+                return 404, {"error": "archive désactivée (ARCHIVE_PATH)"}
+            return 200, self.archive.find_order(parts[1])
+        station = parts[1] if len(parts) > 1 else None
+        if station is not None and station not in self.queues:
+            return 404, {"error": f"poste inconnu: {station}", "postes": list(self.queues)}
+        if method == "GET" and action == "supabase":
+            http = getattr(self.supabase, "http", None)
+            return 200, http.stats() if http else {"error": "session HTTP Supabase non disponible"}
+        if method == "GET" and action == "status":
+            return 200, {name: dispatcher.status() for name, dispatcher in self.queues.items()}
+        if method == "GET" and action == "history" and station:
+            return 200, self.queues[station].history.list()
+        if method == "POST" and action in ("pause", "resume") and station:
+            getattr(self.queues[station], action)()
+            return 200, self.queues[station].status()
+        if method == "POST" and action == "reprint" and station and len(parts) > 2:
+            if not parts[2].isdigit():
+                return 400, {"error": f"numéro de ticket invalide: {parts[2]}"}
+            entry = self.queues[station].history.get(int(parts[2]))
+            if entry is None:
+                return 404, {"error": f"ticket {parts[2]} absent de l'historique {station}"}
+            target = query.get("to", [station])[0]
+            if target not in self.queues:
+                return 404, {"error": f"poste inconnu: {target}"}
+            logger.info(f"🔁 Réimpression de {entry['label']} sur {target}")
+            self.queues[target].reprint(entry)
+            return 202, {"reprint": entry["label"], "to": target}
+        return 404, {"error": f"commande inconnue: {method} /{'/'.join(parts)}"}
+    
+    def capacity(self) -> int:
+        """Commandes acceptables avant que la file caisse ou cuisine soit pleine"""
+        return min(self.cashier_queue.free_slots(), self.kitchen_queue.free_slots())
     
     def process_pending_orders(self):
         """Traite toutes les commandes en attente au démarrage"""
@@ -796,7 +3891,12 @@ class PrinterAgent:
         
         if pending:
             logger.info(f"📦 {len(pending)} commande(s) en attente trouvée(s)")
-            for order in pending:
+            # Arriéré (démarrage, reconnexion): ordre de besoin de la cuisine, dans la
+            # limite des files; le reste est repris par le polling au fil de l'impression
+            capacity = self.capacity()
+            if len(pending) > capacity:
+                logger.warning(f"🚦 {len(pending) - capacity} commande(s) différée(s): files d'impression pleines")
+            for order in OrderPriority.sort(pending)[:capacity]:
                 self.process_order(order)
         else:
             logger.info("✓ Aucune commande en attente")
@@ -808,8 +3908,15 @@ class PrinterAgent:
         # Traite d'abord les commandes en attente
         self.process_pending_orders()
         
+        # Modifications: reprise depuis la dernière version imprimée connue (horloge
+        # serveur), pour ne pas perdre celles faites pendant un arrêt de l'agent
+        on_update = self.process_order_update if Config.ORDER_UPDATES and self.archive else None
+        since = self.archive.last_updated(Config.ORDER_UPDATED_COLUMN) if on_update else None
+        if since:
+            logger.info(f"✏️ Modifications de commandes suivies depuis {since}")
+        
         # Lance la souscription Realtime
-        ws = self.supabase.subscribe_to_new_orders(self.process_order)
+        ws = self.supabase.subscribe_to_new_orders(self.process_order, on_update, self.capacity, since)
         
         if ws:
             logger.info("✅ Système d'impression actif - En attente de commandes...")
@@ -832,16 +3939,573 @@ class PrinterAgent:
     
     def shutdown(self):
         """Arrêt propre du système"""
+        if self.ingest:
+            self.ingest.stop()
+        if self.rush:
+            self.rush.flush()
+        logger.info("🖨️ Impression des tickets restants...")
+        for dispatcher in self.queues.values():
+            dispatcher.stop(timeout=30)
+        self.watchdog.stop()
+        if self.claims:
+            self.claims.stop()
+        for sink in self.sinks:
+            sink.close()
+        if self.admin:
+            self.admin.stop()
+        if self.outbox:
+            self.outbox.sync(self.supabase)
+            self.outbox.close()
+        if self.archive:
+            self.archive.close()
         logger.info("🔌 Déconnexion des imprimantes...")
-        self.cashier_printer.disconnect()
-        self.kitchen_printer.disconnect()
+        for manager in self.printers.values():
+            manager.disconnect()
         logger.info("👋 PrinterAgent arrêté")
 
 
+# ============================================================================
+# DIAGNOSTIC
+# ============================================================================
+
+class Diagnostics:
+    """
+    Diagnostic non interactif: imprimantes, Supabase et USB sondés en parallèle.
+    Chaque sonde a son propre délai maximum (une imprimante injoignable ne
+    retarde pas les autres); le résultat est un dict sérialisable en JSON.
+    """
+    
+    # Requêtes d'état temps réel ESC/POS (DLE EOT n) et octet d'état attendu
+    STATUS_REQUESTS = (("printer", 1), ("offline", 2), ("error", 3), ("paper", 4))
+    # (requête, masque, anomalie, bloquante)
+    STATUS_FLAGS = (
+        ("printer", 0x08, "offline", True),
+        ("offline", 0x04, "cover_open", True),
+        ("offline", 0x20, "paper_end_stop", True),
+        ("error", 0x08, "cutter_error", True),
+        ("error", 0x20, "unrecoverable_error", True),
+        ("error", 0x40, "recoverable_error", True),
+        ("paper", 0x60, "paper_end", True),
+        ("paper", 0x0C, "paper_near_end", False),
+    )
+    # Spouleur Windows: PRINTER_STATUS_* (GetPrinter niveau 2)
+    WINDOWS_FLAGS = ((0x00000001, "paused"), (0x00000002, "error"), (0x00000008, "paper_jam"),
+                     (0x00000010, "paper_out"), (0x00000080, "offline"), (0x00001000, "not_available"),
+                     (0x00400000, "door_open"))
+    
+    def __init__(self, timeout: float = None):
+        self.timeout = timeout or Config.DIAG_TIMEOUT
+    
+    def probes(self) -> Dict[str, Callable[[float], Dict]]:
+        """Sondes à lancer: une par imprimante configurée, Supabase et le bus USB"""
+        stations = {"cashier": Config.PRINTER_CASHIER, "kitchen": Config.PRINTER_KITCHEN}
+        if Config.KITCHEN_BACKUP_ENABLED:
+            stations["kitchen_backup"] = Config.PRINTER_KITCHEN_BACKUP
+        probes = {f"printer:{station}": functools.partial(self.probe_printer, config)
+                  for station, config in stations.items()}
+        probes["supabase"] = self.probe_supabase
+        probes["usb"] = self.probe_usb
+        return probes
+    
+    def run(self) -> Dict:
+        """Lance toutes les sondes et attend au plus `timeout` (+ marge)"""
+        started = time.perf_counter()
+        results: Dict[str, Dict] = {}
+        threads = []
+        for name, probe in self.probes().items():
+            thread = threading.Thread(target=self._run_probe, args=(name, probe, started + self.timeout, results),
+                                      name=f"diag-{name}", daemon=True)
+            thread.start()
+            threads.append((name, thread))
+        for name, thread in threads:
+            # Une sonde bloquée (DNS, pilote USB...) est abandonnée: thread démon
+            thread.join(max(0.0, started + self.timeout + 0.5 - time.perf_counter()))
+            if thread.is_alive():
+                results[name] = {"ok": False, "error": f"pas de réponse en {self.timeout:g}s",
+                                 "ms": round(self.timeout * 1000, 1)}
+        return {
+            "ok": all(result["ok"] for result in results.values()),
+            "checked_at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "timeout": self.timeout,
+            "probes": {name: results[name] for name, _ in threads},
+        }
+    
+    @staticmethod
+    def _run_probe(name: str, probe: Callable[[float], Dict], deadline: float, results: Dict):
+        started = time.perf_counter()
+        try:
+            result = {"ok": True, **probe(deadline)}
+        except Exception as e:
+            result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        results.setdefault(name, result)
+    
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise TimeoutError("délai de la sonde dépassé")
+        return remaining
+    
+    def probe_printer(self, config: Dict, deadline: float) -> Dict:
+        printer_type = "mock" if Config.PRINTER_MODE == "mock" else config.get("type", "network")
+        result = {"type": printer_type, "name": config.get("name")}
+        if printer_type == "network":
+            result.update(self.probe_network(config["ip"], int(config.get("port", 9100)), deadline))
+        elif printer_type == "usb":
+            result.update(self.probe_usb_printer(config))
+        elif printer_type == "windows":
+            result.update(self.probe_windows(config["name"]))
+        elif printer_type != "mock" and printer_type not in PrinterManager.CONNECTORS:
+            result.update(ok=False, error=f"type d'imprimante non supporté: {printer_type}")
+        return result
+    
+    def probe_network(self, ip: str, port: int, deadline: float) -> Dict:
+        """Connexion TCP puis DLE EOT 1-4: latence de connexion, octets d'état et allers-retours"""
+        if not ip:
+            return {"ok": False, "error": "adresse IP non configurée"}
+        started = time.perf_counter()
+        with socket.create_connection((ip, port), timeout=self._remaining(deadline)) as sock:
+            result = {"address": f"{ip}:{port}", "connect_ms": round((time.perf_counter() - started) * 1000, 1)}
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            status, round_trips = {}, []
+            try:
+                for key, n in self.STATUS_REQUESTS:
+                    sock.settimeout(self._remaining(deadline))
+                    sent = time.perf_counter()
+                    sock.sendall(b"\x10\x04" + bytes([n]))
+                    reply = sock.recv(1)
+                    if not reply:
+                        raise ConnectionError("connexion fermée par l'imprimante")
+                    round_trips.append((time.perf_counter() - sent) * 1000)
+                    status[key] = reply[0]
+            except (OSError, TimeoutError) as e:
+                # Imprimante joignable mais muette (modèle sans DLE EOT, autre client connecté...)
+                result["status_error"] = f"{type(e).__name__}: {e}" if str(e) else "pas de réponse DLE EOT"
+        result["status"] = {key: f"0x{value:02x}" for key, value in status.items()}
+        if round_trips:
+            result["rtt_ms"] = {"min": round(min(round_trips), 2), "max": round(max(round_trips), 2),
+                                "avg": round(sum(round_trips) / len(round_trips), 2)}
+        flags = [(flag, blocking) for key, mask, flag, blocking in self.STATUS_FLAGS
+                 if key in status and status[key] & mask]
+        result["flags"] = [flag for flag, _ in flags]
+        result["ok"] = not any(blocking for _, blocking in flags)
+        return result
+    
+    @staticmethod
+    def probe_usb_printer(config: Dict) -> Dict:
+        """Présence du périphérique USB (l'état n'est pas lu: l'interface appartient à l'agent)"""
+        import usb.core  # type: ignore
+        vendor_id, product_id = config.get("vendor_id", 0x04b8), config.get("product_id", 0x0e28)
+        device = usb.core.find(idVendor=vendor_id, idProduct=product_id)
+        result = {"vid": f"0x{vendor_id:04x}", "pid": f"0x{product_id:04x}"}
+        if device is None:
+            return {**result, "ok": False, "error": "périphérique USB absent"}
+        return {**result, "bus": device.bus, "address": device.address}
+    
+    @classmethod
+    def probe_windows(cls, name: str) -> Dict:
+        """État de l'imprimante dans le spouleur Windows"""
+        if not WINDOWS_PRINTING:
+            return {"ok": False, "error": "win32print non disponible"}
+        handle = win32print.OpenPrinter(name)
+        try:
+            info = win32print.GetPrinter(handle, 2)
+        finally:
+            win32print.ClosePrinter(handle)
+        flags = [flag for mask, flag in cls.WINDOWS_FLAGS if info["Status"] & mask]
+        return {"status": f"0x{info['Status']:08x}", "jobs": info["cJobs"], "flags": flags, "ok": not flags}
+    
+    def probe_supabase(self, deadline: float) -> Dict:
+        """Résolution DNS puis requête REST minimale (une ligne de la table des commandes)"""
+        url = urllib.parse.urlsplit(Config.SUPABASE_URL)
+        if not url.hostname:
+            return {"ok": False, "error": "SUPABASE_URL non configurée"}
+        started = time.perf_counter()
+        socket.getaddrinfo(url.hostname, url.port or 443, proto=socket.IPPROTO_TCP)
+        result = {"host": url.hostname, "dns_ms": round((time.perf_counter() - started) * 1000, 1)}
+        request = urllib.request.Request(
+            f"{Config.SUPABASE_URL.rstrip('/')}/rest/v1/{Config.TABLE_NAME}?select=id&limit=1",
+            headers={"apikey": Config.SUPABASE_KEY, "Authorization": f"Bearer {Config.SUPABASE_KEY}"})
+        sent = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self._remaining(deadline)) as response:
+                response.read()
+                result["http_status"] = response.status
+        except urllib.error.HTTPError as e:
+            result.update(http_status=e.code, ok=False, error=e.reason)
+        result["request_ms"] = round((time.perf_counter() - sent) * 1000, 1)
+        return result
+    
+    @staticmethod
+    def probe_usb(deadline: float) -> Dict:
+        """Imprimantes présentes sur le bus USB (classe 7 ou Epson)"""
+        try:
+            import usb.core  # type: ignore
+        except ImportError:
+            return {"skipped": "pyusb non installé"}
+        try:
+            found = list(usb.core.find(find_all=True))
+        except usb.core.NoBackendError:
+            return {"skipped": "libusb introuvable"}
+        devices = []
+        for device in found:
+            is_printer = device.idVendor == 0x04b8 or device.bDeviceClass == 7 or any(
+                interface.bInterfaceClass == 7 for cfg in device for interface in cfg)
+            if is_printer:
+                devices.append({"vid": f"0x{device.idVendor:04x}", "pid": f"0x{device.idProduct:04x}",
+                                "bus": device.bus, "address": device.address})
+        return {"devices": devices}
+
+
+# ============================================================================
+# RENDU HORS LIGNE (LOTS DE COMMANDES)
+# ============================================================================
+
+class EscposPreview:
+    """Aperçu texte d'un ticket rendu: relit les octets ESC/POS réellement
+    envoyés (page de code, alignement, coupes, images, QR codes)."""
+    
+    CODECS = {number: codec for number, codec in CodepageProfile.TABLES.values()}
+    
+    @classmethod
+    def text(cls, payload: bytes, width: int = Config.PAPER_WIDTH) -> str:
+        lines: List[str] = []
+        current = bytearray()
+        codec = CodepageProfile.get().codec
+        align, char_width = 0, 1
+        
+        def flush():
+            line = current.decode(codec, errors="replace")
+            columns = len(line) * char_width
+            pad = (width - columns) // 2 if align == 1 else width - columns if align == 2 else 0
+            lines.append((" " * max(0, pad) + line).rstrip())
+            current.clear()
+        
+        i, n = 0, len(payload)
+        while i < n:
+            byte = payload[i]
+            if byte == 0x0A:  # LF
+                flush()
+                i += 1
+            elif byte == 0x1B and i + 1 < n:  # ESC
+                cmd = payload[i + 1]
+                if cmd == ord('t') and i + 2 < n:
+                    codec = cls.CODECS.get(payload[i + 2], codec)
+                elif cmd == ord('a') and i + 2 < n:
+                    align = payload[i + 2] % 48
+                elif cmd == ord('d') and i + 2 < n:
+                    lines.extend([""] * payload[i + 2])
+                i += 2 if cmd == ord('@') else 3
+            elif byte == 0x1D and i + 1 < n:  # GS
+                cmd = payload[i + 1]
+                if cmd == ord('!') and i + 2 < n:
+                    char_width = (payload[i + 2] >> 4) + 1
+                    i += 3
+                elif cmd == ord('V') and i + 2 < n:
+                    if current:
+                        flush()
+                    lines.append("-" * (width // 2 - 3) + " CUT " + "-" * (width // 2 - 2))
+                    i += 4 if payload[i + 2] in (65, 66) else 3
+                elif cmd == ord('v') and i + 7 < n:
+                    width_bytes = payload[i + 4] + payload[i + 5] * 256
+                    height = payload[i + 6] + payload[i + 7] * 256
+                    lines.append(f"[image {width_bytes * 8}x{height}]")
+                    i += 8 + width_bytes * height
+                elif cmd == ord('(') and i + 6 < n and payload[i + 2] == ord('k'):
+                    length = payload[i + 3] + payload[i + 4] * 256
+                    if payload[i + 6] == 0x50:  # données du QR code
+                        data = payload[i + 8:i + 5 + length].decode("utf-8", errors="replace")
+                        lines.append(f"[QR: {data}]")
+                    i += 5 + length
+                else:
+                    i += 3
+            else:
+                if byte >= 0x20:
+                    current.append(byte)
+                i += 1
+        if current:
+            flush()
+        return "\n".join(lines) + "\n"
+
+
+# Options des processus de rendu (fixées par _render_worker_init)
+_RENDER_OPTIONS: Dict = {}
+
+
+def _render_worker_init(directory: str, codepage: str, preview: bool):
+    _RENDER_OPTIONS.update(directory=directory, codepage=codepage, preview=preview)
+
+
+def _render_order_files(task: tuple) -> List[Dict]:
+    """
+    Rend les tickets caisse et cuisine d'une commande et écrit les fichiers
+    <ligne>-<numéro>.cashier.bin, <ligne>-<numéro>.kitchen.bin (et .txt); le
+    numéro de ligne rend le nom unique (numéros de commande répétés d'un jour à l'autre)
+    Returns: une ligne de statistiques par ticket (fichier, octets, lignes, mm, secondes)
+    """
+    line_number, order = task
+    profile = CodepageProfile.get(_RENDER_OPTIONS["codepage"])
+    number = str(order.get("order_number") or "sans-numero")
+    name = f"{line_number:06d}-" + "".join(char if char.isalnum() or char in "-_" else "_" for char in number)
+    base = os.path.join(_RENDER_OPTIONS["directory"], name)
+    rows, previews = [], []
+    for station, render in (("cashier", TicketGenerator.print_cashier_ticket),
+                            ("kitchen", TicketGenerator.print_kitchen_ticket)):
+        row = {"line": line_number, "order_number": number, "station": station}
+        try:
+            buffer = TicketBuffer(profile)
+            started = time.perf_counter()
+            render(buffer, order, profile)
+            row["render_us"] = round((time.perf_counter() - started) * 1e6, 1)
+            payload = buffer.getvalue()
+        except Exception as e:
+            rows.append(dict(row, error=str(e)))
+            continue
+        row["file"] = f"{name}.{station}.bin"
+        with open(os.path.join(_RENDER_OPTIONS["directory"], row["file"]), "wb") as f:
+            f.write(payload)
+        stats = PrintTimeEstimator.analyze(payload)
+        row.update(bytes=len(payload), lines=stats["lines"], mm=round(stats["mm"], 1),
+                   seconds=round(PrintTimeEstimator.seconds(payload, Config.PRINT_SPEED), 2))
+        rows.append(row)
+        if _RENDER_OPTIONS["preview"]:
+            previews.append(f"=== {station} #{number} ({len(payload)} octets, {row['mm']} mm) ===\n"
+                            + EscposPreview.text(payload))
+    if previews:
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(previews))
+    return rows
+
+
 # ============================================================================
 # POINT D'ENTRÉE
 # ============================================================================
 
+def admin_cli(args: List[str]) -> int:
+    """
+    Client en ligne de commande de l'API d'administration (agent déjà lancé)
+    Exemples:
+        python printer_agent.py admin status
+        python printer_agent.py admin history kitchen
+        python printer_agent.py admin reprint kitchen 12 --to cashier
+        python printer_agent.py admin pause cashier
+    """
+    if not args:
+        print(admin_cli.__doc__)
+        return 2
+    command, rest = args[0], args[1:]
+    target = None
+    if "--to" in rest:
+        index = rest.index("--to")
+        target = rest[index + 1] if index + 1 < len(rest) else None
+        rest = rest[:index]
+    method = "GET" if command in ("status", "history") else "POST"
+    path = "/" + "/".join([command] + rest)
+    if target:
+        path += "?" + urllib.parse.urlencode({"to": target})
+    if not Config.ADMIN_PORT:
+        print("❌ API d'administration désactivée: définir ADMIN_PORT (ex: 8765) pour l'agent et ce client")
+        return 1
+    port = Config.ADMIN_PORT
+    # Agent à l'écoute sur toutes les interfaces: le client passe par la boucle locale
+    host = "127.0.0.1" if Config.ADMIN_HOST in ("", "0.0.0.0", "::") else Config.ADMIN_HOST
+    if ":" in host:
+        host = f"[{host}]"  # adresse IPv6
+    request = urllib.request.Request(f"http://{host}:{port}{path}", method=method,
+                                     headers={"X-Admin-Token": Config.ADMIN_TOKEN})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            print(response.read().decode("utf-8"))
+            return 0
+    except urllib.error.HTTPError as e:
+        print(e.read().decode("utf-8"))
+        return 1
+    except OSError as e:
+        print(f"❌ Agent injoignable sur le port {port} (ADMIN_PORT configuré ?): {e}")
+        return 1
+
+
+def archive_cli(args: List[str]) -> int:
+    """
+    Recherche dans l'archive des tickets (sans agent lancé)
+    Exemples:
+        python printer_agent.py archive CMD-2025-001          # tickets d'une commande
+        python printer_agent.py archive --date 19/10/2026 [--printer kitchen]
+        python printer_agent.py archive --prune               # applique la conservation
+    """
+    if not args or not Config.ARCHIVE_PATH or not os.path.exists(Config.ARCHIVE_PATH):
+        print(archive_cli.__doc__ if not args else f"❌ Archive introuvable: {Config.ARCHIVE_PATH or '(désactivée)'}")
+        return 2 if not args else 1
+    archive = TicketArchive()
+    try:
+        if args[0] == "--prune":
+            print(f"🧹 {archive.prune()} ticket(s) supprimé(s)")
+            return 0
+        if args[0] == "--date":
+            day = datetime.strptime(args[1], "%d/%m/%Y")
+            printer = args[args.index("--printer") + 1] if "--printer" in args else None
+            rows = archive.find_between(day, day + timedelta(days=1), printer)
+        else:
+            rows = archive.find_order(args[0])
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0 if rows else 1
+    except (IndexError, ValueError) as e:
+        print(f"❌ Arguments invalides: {e}")
+        return 2
+    finally:
+        archive.close()
+
+
+def replay_cli(args: List[str]) -> int:
+    """
+    Rejoue un enregistrement de commandes (ORDER_RECORD_PATH) sans toucher à Supabase
+    Exemples:
+        python printer_agent.py replay samedi.jsonl                   # rythme réel, imprimantes factices
+        python printer_agent.py replay samedi.jsonl --speed 10
+        python printer_agent.py replay samedi.jsonl --speed max --printer mock
+    """
+    if not args or not os.path.exists(args[0]):
+        print(replay_cli.__doc__ if not args else f"❌ Fichier introuvable: {args[0]}")
+        return 2
+    speed_arg = args[args.index("--speed") + 1] if "--speed" in args else "1"
+    speed = 0.0 if speed_arg == "max" else float(speed_arg)
+    sink = args[args.index("--printer") + 1] if "--printer" in args else "fake"
+    # Rejeu isolé: pas d'historique disque, d'API ni d'écran cuisine; archive
+    # temporaire (version imprimée de référence des tickets modificatifs)
+    Config.ARCHIVE_PATH = os.path.join(tempfile.mkdtemp(prefix="mitake_replay_"), "archive.db")
+    Config.REPRINT_DIR = ""
+    Config.ADMIN_PORT = Config.INGEST_PORT = 0
+    Config.ORDER_SINKS = []
+    if sink == "mock":
+        Config.PRINTER_MODE = "mock"
+    else:
+        Config.PRINTER_MODE = "normal"
+        for printer in (Config.PRINTER_CASHIER, Config.PRINTER_KITCHEN, Config.PRINTER_KITCHEN_BACKUP):
+            printer["type"] = "fake"
+    store = ReplayStore()
+    agent = PrinterAgent(supabase=store)
+    logger.info(f"⏯️ Rejeu de {args[0]} (vitesse {'max' if not speed else f'x{speed:g}'}, imprimantes {sink})")
+    summary = OrderReplayer(agent, store, speed).run(args[0])
+    print(json.dumps(summary, indent=2))
+    return 0 if not summary["failed"] else 1
+
+
+def diagnose_cli(args: List[str]) -> int:
+    """
+    Diagnostic parallèle des imprimantes, de Supabase et de l'USB (sans agent lancé)
+    Exemples:
+        python printer_agent.py diagnose                  # résumé lisible
+        python printer_agent.py diagnose --json           # pour la supervision
+        python printer_agent.py diagnose --timeout 1
+    Code de retour: 0 si tout est OK, 1 sinon
+    """
+    if "--help" in args or "-h" in args:
+        print(diagnose_cli.__doc__)
+        return 2
+    try:
+        timeout = float(args[args.index("--timeout") + 1]) if "--timeout" in args else None
+    except (IndexError, ValueError):
+        print(diagnose_cli.__doc__)
+        return 2
+    report = Diagnostics(timeout).run()
+    if "--json" in args:
+        print(json.dumps(report, ensure_ascii=False))
+        return 0 if report["ok"] else 1
+    for name, result in report["probes"].items():
+        details = ", ".join(f"{key}={value}" for key, value in result.items() if key not in ("ok", "error"))
+        line = f"{'✅' if result['ok'] else '❌'} {name:<24} {details}"
+        print(line + (f"\n   └─ {result['error']}" if result.get("error") else ""))
+    print(f"\n{'✅ Tout est OK' if report['ok'] else '❌ Anomalies détectées'} ({report['duration_ms']:.0f} ms)")
+    return 0 if report["ok"] else 1
+
+
+def _read_orders(path: str) -> Iterator[tuple]:
+    """(n° de ligne, commande) d'un JSONL de commandes ou d'un enregistrement ORDER_RECORD_PATH"""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"⚠️ Ligne {number} illisible dans {path}")
+                continue
+            if isinstance(record, dict):
+                yield number, record["order"] if isinstance(record.get("order"), dict) else record
+
+
+def render_cli(args: List[str]) -> int:
+    """
+    Rendu hors ligne d'un lot de commandes (sans imprimante ni Supabase)
+    Exemples:
+        python printer_agent.py render commandes.jsonl rendu/
+        python printer_agent.py render octobre.jsonl rendu/ --workers 8 --codepage cp1252 --no-preview
+    Écrit <ligne>-<numéro>.cashier.bin / .kitchen.bin (ESC/POS), <ligne>-<numéro>.txt
+    (aperçu) et index.jsonl (fichier, octets, lignes, mm de papier, durée estimée par ticket)
+    """
+    if len(args) < 2 or not os.path.exists(args[0]):
+        print(render_cli.__doc__ if len(args) < 2 else f"❌ Fichier introuvable: {args[0]}")
+        return 2
+    source, directory = args[0], args[1]
+    try:
+        workers = int(args[args.index("--workers") + 1]) if "--workers" in args else os.cpu_count() or 1
+        codepage = args[args.index("--codepage") + 1] if "--codepage" in args else Config.PRINTER_CODEPAGE
+    except (IndexError, ValueError):
+        print(render_cli.__doc__)
+        return 2
+    options = (directory, codepage, "--no-preview" not in args)
+    os.makedirs(directory, exist_ok=True)
+    
+    started = time.perf_counter()
+    orders = _read_orders(source)
+    totals = {"orders": 0, "tickets": 0, "errors": 0, "bytes": 0, "mm": 0.0, "seconds": 0.0}
+    stations: Dict[str, List[int]] = {}
+    
+    def collect(rows: List[Dict]):
+        totals["orders"] += 1
+        for row in rows:
+            index.write(json.dumps(row, ensure_ascii=False) + "\n")
+            if "error" in row:
+                totals["errors"] += 1
+                logger.error(f"❌ Rendu {row['station']} #{row['order_number']}: {row['error']}")
+                continue
+            totals["tickets"] += 1
+            totals["bytes"] += row["bytes"]
+            totals["mm"] += row["mm"]
+            totals["seconds"] += row["seconds"]
+            stations.setdefault(row["station"], []).append(row["bytes"])
+    
+    with open(os.path.join(directory, "index.jsonl"), "w", encoding="utf-8") as index:
+        if workers <= 1:
+            _render_worker_init(*options)
+            for task in orders:
+                collect(_render_order_files(task))
+        else:
+            # Lecture par tranches: mémoire bornée quelle que soit la taille du fichier
+            with multiprocessing.Pool(workers, initializer=_render_worker_init, initargs=options) as pool:
+                while True:
+                    batch = list(itertools.islice(orders, workers * 64))
+                    if not batch:
+                        break
+                    for rows in pool.imap_unordered(_render_order_files, batch, chunksize=16):
+                        collect(rows)
+    
+    elapsed = time.perf_counter() - started
+    summary = {
+        **totals,
+        "mm": round(totals["mm"], 1),
+        "seconds": round(totals["seconds"], 1),
+        "avg_bytes": {station: round(sum(sizes) / len(sizes)) for station, sizes in stations.items()},
+        "workers": max(1, workers),
+        "elapsed": round(elapsed, 2),
+        "orders_per_second": round(totals["orders"] / elapsed, 1) if elapsed else None,
+    }
+    print(json.dumps(summary, indent=2))
+    return 0 if not totals["errors"] else 1
+
+
 def main():
     """Fonction principale"""
     logger.info("=" * 60)
@@ -865,4 +4529,15 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # exe PyInstaller: processus du rendu hors ligne
+    if len(sys.argv) > 1 and sys.argv[1] == "admin":
+        sys.exit(admin_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "archive":
+        sys.exit(archive_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "replay":
+        sys.exit(replay_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "diagnose":
+        sys.exit(diagnose_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "render":
+        sys.exit(render_cli(sys.argv[2:]))
     main()
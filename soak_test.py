@@ -0,0 +1,234 @@
+"""
+Test d'endurance de l'agent d'impression
+Simule des commandes pendant des heures sur des imprimantes factices (ou mock)
+et suit la mémoire (tracemalloc, RSS), les fichiers et sockets ouverts et les
+threads. Le rapport final donne la tendance de chaque mesure (par heure) et
+les lignes de code dont les allocations ont le plus augmenté.
+
+Utilisation:
+    python soak_test.py --minutes 240 --rate 10
+    python soak_test.py --minutes 30 --rate 60 --printer mock --reconnect-every 50
+"""
+
+import argparse
+import collections
+import csv
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    from printer_agent import (
+        Config,
+        PrinterAgent,
+        ReplayStore,
+        logger,
+    )
+except ImportError as e:
+    print(f"❌ Erreur import: {e}")
+    print("Assurez-vous que printer_agent.py est dans le même dossier")
+    sys.exit(1)
+
+
+MENU = [
+    ("Ramen Tonkotsu", 13.50), ("Ramen Miso", 12.50), ("Ramen Shoyu", 11.50),
+    ("Gyoza", 6.00), ("Karaage", 7.50), ("Edamame", 4.50), ("Thé vert", 2.50),
+]
+OPTIONS = ["Extra chashu", "Œuf mariné", "Sans oignons", "Épicé", "Nouilles fermes"]
+
+
+class SoakStore(ReplayStore):
+    """ReplayStore à mémoire bornée (le test ne doit pas fausser ses propres mesures)"""
+
+    def __init__(self):
+        super().__init__()
+        self.latencies = collections.deque(maxlen=1000)
+        self.printed = 0
+
+    def mark_as_printed(self, order_id) -> bool:
+        self.printed += 1
+        return super().mark_as_printed(order_id)
+
+
+def make_order(number: int) -> dict:
+    """Commande simulée (taille et contenu variables)"""
+    items = []
+    for name, price in random.sample(MENU, random.randint(1, 5)):
+        items.append({
+            "name": name,
+            "quantity": random.randint(1, 3),
+            "price": price,
+            "options": random.sample(OPTIONS, random.randint(0, 2)),
+            "comment": random.choice([None, None, "Bien chaud SVP", "Allergie arachides"]),
+        })
+    return {
+        "id": number,
+        "order_number": f"SOAK-{number:06d}",
+        "customer_name": f"Client {number}",
+        "payment_status": random.choice(["paid", "pending"]),
+        "items": items,
+    }
+
+
+def open_descriptors() -> tuple:
+    """(fichiers ouverts, sockets) du processus; (None, None) si non mesurable"""
+    try:
+        import psutil  # type: ignore
+        process = psutil.Process()
+        files = process.num_handles() if os.name == "nt" else process.num_fds()
+        connections = getattr(process, "net_connections", None) or process.connections
+        return files, len(connections(kind="all"))
+    except ImportError:
+        pass
+    try:
+        descriptors = os.listdir("/proc/self/fd")
+    except OSError:
+        return None, None
+    links = []
+    for fd in descriptors:
+        try:
+            links.append(os.readlink(os.path.join("/proc/self/fd", fd)))
+        except OSError:
+            pass  # descripteur fermé entre-temps (dont celui de listdir)
+    return len(links), sum(1 for link in links if link.startswith("socket:"))
+
+
+def rss_mb() -> float:
+    """Mémoire résidente du processus (Mo); None si non mesurable"""
+    try:
+        import psutil  # type: ignore
+        return psutil.Process().memory_info().rss / 1048576
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def sample(start: float, store: SoakStore, submitted: int) -> dict:
+    traced, _ = tracemalloc.get_traced_memory()
+    files, sockets = open_descriptors()
+    rss = rss_mb()
+    return {
+        "minutes": round((time.monotonic() - start) / 60, 2),
+        "orders": submitted,
+        "printed": store.printed,
+        "failed": store.failed,
+        "rss_mb": round(rss, 2) if rss is not None else None,
+        "traced_mb": round(traced / 1048576, 3),
+        "files": files,
+        "sockets": sockets,
+        "threads": threading.active_count(),
+    }
+
+
+def slope_per_hour(samples: list, key: str) -> float:
+    """Pente (moindres carrés) d'une mesure, par heure"""
+    points = [(s["minutes"] / 60, s[key]) for s in samples if s[key] is not None]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test d'endurance de l'agent d'impression")
+    parser.add_argument("--minutes", type=float, default=60, help="durée du test (défaut: 60)")
+    parser.add_argument("--rate", type=float, default=10, help="commandes par minute (défaut: 10)")
+    parser.add_argument("--printer", choices=("fake", "mock"), default="fake",
+                        help="imprimantes factices (durée simulée) ou mock (affichage)")
+    parser.add_argument("--interval", type=float, default=60, help="secondes entre deux mesures")
+    parser.add_argument("--reconnect-every", type=int, default=0,
+                        help="force une reconnexion des imprimantes toutes les N commandes")
+    parser.add_argument("--csv", default="soak_samples.csv", help="fichier des mesures")
+    args = parser.parse_args()
+
+    # Agent isolé: pas de Supabase, d'API locales, d'écran cuisine ni d'enregistrement; archive temporaire
+    workdir = tempfile.mkdtemp(prefix="mitake_soak_")
+    Config.ARCHIVE_PATH = os.path.join(workdir, "archive.db")
+    Config.REPRINT_DIR = Config.ORDER_RECORD_PATH = ""
+    Config.ADMIN_PORT = Config.INGEST_PORT = 0
+    Config.ORDER_SINKS = []
+    if args.printer == "mock":
+        Config.PRINTER_MODE = "mock"
+    else:
+        Config.PRINTER_MODE = "normal"
+        for printer in (Config.PRINTER_CASHIER, Config.PRINTER_KITCHEN, Config.PRINTER_KITCHEN_BACKUP):
+            printer["type"] = "fake"
+
+    print("=" * 60)
+    print("  TEST D'ENDURANCE - MITAKE")
+    print("=" * 60)
+    print(f"\n⏱️  {args.minutes:g} min, {args.rate:g} commandes/min, imprimantes {args.printer}\n")
+
+    tracemalloc.start(10)
+    store = SoakStore()
+    agent = PrinterAgent(supabase=store)
+    start = time.monotonic()
+    baseline = tracemalloc.take_snapshot()
+    samples = [sample(start, store, 0)]
+    next_sample = start + args.interval
+    end = start + args.minutes * 60
+    submitted = 0
+
+    try:
+        while time.monotonic() < end:
+            submitted += 1
+            agent.process_order(make_order(submitted))
+            if args.reconnect_every and submitted % args.reconnect_every == 0:
+                # Chemin de reconnexion: fermée par le thread d'impression avant son
+                # prochain envoi (jamais pendant une écriture), puis rouverte
+                for manager in agent.printers.values():
+                    manager.request_reconnect()
+            if time.monotonic() >= next_sample:
+                samples.append(sample(start, store, submitted))
+                last = samples[-1]
+                logger.info(f"📈 {last['minutes']:.0f} min: {last['printed']} imprimées, RSS {last['rss_mb']} Mo, "
+                            f"tracemalloc {last['traced_mb']} Mo, {last['files']} fichiers, "
+                            f"{last['sockets']} sockets, {last['threads']} threads")
+                next_sample += args.interval
+            time.sleep(random.expovariate(args.rate / 60))
+    except KeyboardInterrupt:
+        print("\n⏹️  Interrompu: rapport sur les mesures déjà prises")
+
+    # Laisse les imprimantes finir les tickets en file (2 min max)
+    deadline = time.monotonic() + 120
+    while store.received and time.monotonic() < deadline:
+        time.sleep(0.5)
+    samples.append(sample(start, store, submitted))
+    agent.shutdown()
+    growth = tracemalloc.take_snapshot().compare_to(baseline, "lineno")
+    tracemalloc.stop()
+
+    with open(args.csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(samples[0]))
+        writer.writeheader()
+        writer.writerows(samples)
+
+    first, last = samples[0], samples[-1]
+    print("\n" + "=" * 60)
+    print(f"📦 {last['orders']} commandes, {last['printed']} imprimées, {last['failed']} en échec")
+    print(f"\n{'Mesure':<12} {'Début':>10} {'Fin':>10} {'Tendance/h':>12}")
+    for key in ("rss_mb", "traced_mb", "files", "sockets", "threads"):
+        print(f"{key:<12} {str(first[key]):>10} {str(last[key]):>10} {slope_per_hour(samples, key):>+12.3f}")
+    print("\n🔍 Plus fortes hausses d'allocations (tracemalloc):")
+    for stat in growth[:10]:
+        frame = stat.traceback[0]
+        print(f"   {stat.size_diff / 1024:+9.1f} Kio  {stat.count_diff:+7d} blocs  "
+              f"{os.path.basename(frame.filename)}:{frame.lineno}")
+    print(f"\n📝 Mesures: {args.csv}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()